@@ -0,0 +1,207 @@
+"""
+Benchmark `Segmentizer()` on the bundled AIS fixtures and on synthetic
+streams of up to many millions of messages.
+
+    $ python benchmarks/run.py --sizes 100000,10000000 --vessels 1,10,50 \\
+    >     --output results.json
+
+Each case is run in a fresh process and reported as one JSON object per line
+so runs can be compared with `jq` or loaded into a dataframe.  A case is run
+twice: once as is to measure throughput and peak RSS, and once with
+`Segmentizer(stats=True)` to give the time spent in each stage, the number of
+discrepancy evaluations and the other counters of `SegmentizerStats()`.
+Stage times include the overhead of the timers, so they are only meaningful
+relative to each other.  `--no-profile` skips the second run.
+
+Synthetic streams come from `gpsdio_segment.synthetic.SyntheticAIS()` and
+are generated lazily, so the message count is only limited by time.  The
+time taken to generate the messages is measured separately and subtracted
+from the throughput.
+"""
+
+
+from __future__ import division, print_function
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+import gpsdio_segment
+from gpsdio_segment.cli import loads
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.synthetic import SyntheticAIS
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+clock = getattr(time, 'perf_counter', time.time)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, 'tests', 'data')
+FIXTURES = ['263576000', '338013000', '416000000']
+
+
+def load_fixture(name):
+    """
+    Messages of one of the bundled fixtures.
+    """
+    msgs = []
+    with io.open(os.path.join(FIXTURE_DIR, name + '.json'), encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                msg = loads(line)
+                msg.setdefault('type', 'AIS.1')
+                msg.setdefault('msgid', i)
+                msgs.append(msg)
+    return msgs
+
+
+def peak_rss_mb():
+    if resource is None:  # pragma: no cover
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _segment(msgs, options):
+    segmentizer = Segmentizer(msgs, **options)
+    n_segments = 0
+    start = clock()
+    for seg in segmentizer:
+        if not seg.noise:
+            n_segments += 1
+    return clock() - start, n_segments, segmentizer.stats
+
+
+def run_case(case):
+    """
+    Run one benchmark case described by a `dict` with `source`, `name`,
+    `options` and the size of the input and return the result.  Intended to
+    be run in a fresh process.
+    """
+    options = case['options']
+    profile = case['profile']
+    result = dict(case, python=platform.python_version(),
+                  version=gpsdio_segment.__version__)
+    del result['profile']
+
+    if case['source'] == 'fixture':
+        msgs = load_fixture(case['name'])
+        result['n_msgs'] = len(msgs)
+        timings = [_segment([x.copy() for x in msgs], options)
+                        for _ in range(case['repeat'])]
+        seconds, n_segments, _ = min(timings, key=lambda x: x[0])
+        make_msgs = lambda: [x.copy() for x in msgs]
+    else:
+        workload = SyntheticAIS(case['n_vessels'], seed=case['seed'])
+        make_msgs = lambda: workload.messages(case['n_msgs'])
+        start = clock()
+        for _ in make_msgs():
+            pass
+        generate_seconds = clock() - start
+        seconds, n_segments, _ = _segment(make_msgs(), options)
+        seconds -= generate_seconds
+        result['generate_seconds'] = generate_seconds
+
+    result.update(seconds=seconds,
+                  msgs_per_second=result['n_msgs'] / seconds if seconds else None,
+                  n_segments=n_segments,
+                  peak_rss_mb=peak_rss_mb())
+
+    if profile:
+        total, _, stats = _segment(make_msgs(), dict(options, stats=True))
+        stats = stats.as_dict()
+        stats['seconds']['other'] = total - sum(stats['seconds'].values())
+        result.update(stats=stats,
+                      discrepancy_evaluations_per_msg=(
+                          stats['discrepancy_evaluations'] / result['n_msgs']))
+    return result
+
+
+def run_isolated(case):
+    """
+    `run_case()` in a new process so peak RSS is not shared between cases.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        pool = multiprocessing.get_context('spawn').Pool(1)
+    else:  # pragma: no cover
+        pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_case, (case,))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def cases(args):
+    options = dict(args.option)
+    common = dict(options=options, profile=args.profile)
+    if args.fixtures:
+        for name in FIXTURES:
+            yield dict(common, source='fixture', name=name, repeat=args.repeat)
+    for n_msgs in args.sizes:
+        for n_vessels in args.vessels:
+            yield dict(common, source='synthetic',
+                       name='{}x{}'.format(n_msgs, n_vessels),
+                       n_msgs=n_msgs, n_vessels=n_vessels, seed=args.seed)
+
+
+def _ints(value):
+    return [int(float(x)) for x in value.split(',') if x]
+
+
+def _option(value):
+    key, _, raw = value.partition('=')
+    if not key or not raw:
+        raise argparse.ArgumentTypeError("expected KEY=VALUE, got {!r}".format(value))
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--sizes', type=_ints, default=[10000],
+                        help="Comma separated numbers of synthetic messages, "
+                             "e.g. 1e5,1e7.  Default: %(default)s")
+    parser.add_argument('--vessels', type=_ints, default=[1, 10, 50],
+                        help="Comma separated numbers of vessels sharing the "
+                             "synthetic MMSI.  Default: %(default)s")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for the synthetic messages.")
+    parser.add_argument('--no-fixtures', dest='fixtures', action='store_false',
+                        help="Skip the bundled fixtures.")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Report the best of this many runs for fixtures.")
+    parser.add_argument('--no-profile', dest='profile', action='store_false',
+                        help="Skip the per stage timing run.")
+    parser.add_argument('--option', type=_option, action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help="Passed to `Segmentizer()`, e.g. vectorize=true.  "
+                             "May be given multiple times.")
+    parser.add_argument('--output', default=None,
+                        help="Append results to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    dst = io.open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for case in cases(args):
+            result = run_isolated(case)
+            dst.write(u'{}\n'.format(json.dumps(result, sort_keys=True)))
+            dst.flush()
+    finally:
+        if dst is not sys.stdout:
+            dst.close()
+
+
+if __name__ == '__main__':
+    main()
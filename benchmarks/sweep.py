@@ -0,0 +1,119 @@
+"""
+Compare `Segmentizer()` parameter sets on the bundled fixtures or on files
+of newline delimited JSON messages.
+
+    $ python benchmarks/sweep.py --param max_hours=4,8,12 \\
+    >     --param max_knots=20,25,30 --output sweep.json
+
+    $ python benchmarks/sweep.py messages.json --random 50 \\
+    >     --range max_knots=15:35 --range lookback=2:8
+
+The messages are parsed and classified once, then segmented with each
+parameter set by `gpsdio_segment.sweep.sweep()` on a pool of processes.  By
+default every combination of the `--param` values is run.  With `--random N`,
+N parameter sets are drawn instead, choosing among the `--param` values and
+uniformly within each `--range`.  Each parameter set is reported as one JSON
+object per line with the number of segments, the distribution of their
+lengths, the noise and discard ratios and the throughput.
+"""
+
+
+from __future__ import division, print_function
+import argparse
+import io
+import json
+import sys
+
+from gpsdio_segment.cli import loads
+from gpsdio_segment.sweep import SweepDataset
+from gpsdio_segment.sweep import grid
+from gpsdio_segment.sweep import random_search
+from gpsdio_segment.sweep import sweep
+
+from run import FIXTURES
+from run import _option
+from run import load_fixture
+
+
+def load_file(path):
+    """
+    Messages of a newline delimited JSON file.
+    """
+    with io.open(path, encoding='utf-8') as f:
+        return [loads(line) for line in f if line.strip()]
+
+
+def _values(value):
+    key, raw = _option(value)
+    if not isinstance(raw, list):
+        raw = [_option('_=' + x)[1] for x in u'{}'.format(raw).split(',')]
+    return key, raw
+
+
+def _range(value):
+    key, _, raw = value.partition('=')
+    try:
+        low, high = [json.loads(x) for x in raw.split(':')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected KEY=LOW:HIGH, got {!r}".format(value))
+    return key, (low, high)
+
+
+def configs(args):
+    if args.random is None:
+        if args.range:
+            raise SystemExit("--range is only used with --random")
+        return grid(**dict(args.param))
+    space = dict(args.param)
+    space.update(args.range)
+    return random_search(args.random, seed=args.seed, **space)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('inputs', nargs='*', metavar='PATH',
+                        help="Newline delimited JSON messages sorted by timestamp.  "
+                             "Defaults to the bundled fixtures.")
+    parser.add_argument('--param', type=_values, action='append', default=[],
+                        metavar='KEY=V1,V2,...',
+                        help="Values of a `Segmentizer()` parameter to try.  "
+                             "May be given multiple times.")
+    parser.add_argument('--range', type=_range, action='append', default=[],
+                        metavar='KEY=LOW:HIGH',
+                        help="Range of a parameter to draw from with --random.  "
+                             "Integers if both bounds are.")
+    parser.add_argument('--random', type=int, default=None, metavar='N',
+                        help="Draw N random parameter sets instead of running "
+                             "every combination.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for --random.")
+    parser.add_argument('--option', type=_option, action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help="Passed to every `Segmentizer()`, e.g. vectorize=true.  "
+                             "May be given multiple times.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of processes.  Defaults to the number of CPUs.")
+    parser.add_argument('--output', default=None,
+                        help="Append results to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    if args.inputs:
+        msgs = [msg for path in args.inputs for msg in load_file(path)]
+        msgs.sort(key=lambda msg: msg['timestamp'])
+        dataset = SweepDataset.from_stream(msgs)
+    else:
+        dataset = SweepDataset((int(name), load_fixture(name)) for name in FIXTURES)
+
+    dst = io.open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for result in sweep(dataset, configs(args), max_workers=args.workers,
+                            **dict(args.option)):
+            dst.write(u'{}\n'.format(json.dumps(result, sort_keys=True)))
+            dst.flush()
+    finally:
+        if dst is not sys.stdout:
+            dst.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,12 @@ Includes a CLI plugin for `gpsdio` to run the algorithm.
 """
 
 
+from gpsdio_segment.arrays import segment_arrays
 from gpsdio_segment.segment import BadSegment
 from gpsdio_segment.segment import Segment
 from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.multi import MultiSegmentizer
+from gpsdio_segment.parallel import segment_parallel
 
 
 __version__ = '0.20.2'
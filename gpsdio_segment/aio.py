@@ -0,0 +1,114 @@
+"""
+Segment a live feed of messages without blocking an `asyncio` event loop.
+
+`segment_async()` consumes an async iterable of time ordered messages, such
+as a socket reader or a queue consumer, and is itself an async generator of
+finalized segments:
+
+    >>> from gpsdio_segment.aio import segment_async
+    >>> async for seg in segment_async(feed):
+    ...     await sink.write(seg)
+
+The feed is read by a separate task into a bounded buffer, so a burst of
+messages is absorbed without waiting on the consumer, and a consumer that
+falls behind eventually stops the feed from being read, which is the usual
+`asyncio` backpressure.  Messages are segmented in batches of everything
+already buffered, up to `batch_size`, with control returned to the event
+loop after each batch, so the loop stays responsive while the segmenter
+keeps up with the feed.
+
+Requires Python 3.7 or newer and is not imported by `gpsdio_segment`.
+"""
+
+
+import asyncio
+
+from gpsdio_segment.core import Segmentizer
+
+
+# Marks the end of the feed in the buffer
+_END = object()
+
+
+async def _read_feed(feed, buffer):
+    try:
+        async for msg in feed:
+            await buffer.put(msg)
+    except Exception as e:
+        await buffer.put(e)
+    else:
+        await buffer.put(_END)
+
+
+async def segment_async(feed, seg_states=None, buffer_size=None, **kwargs):
+
+    """
+    Segment an async iterable of messages.
+
+    Parameters
+    ----------
+    feed : async iterable
+        Time ordered messages, as passed to `Segmentizer()`.
+    seg_states : iterable of SegmentState, optional
+        Continue from these states as with `Segmentizer.from_seg_states()`.
+    buffer_size : int, optional
+        Maximum number of messages read ahead of the segmenter.  Defaults
+        to 10 batches.
+    kwargs : **kwargs, optional
+        Passed to `Segmentizer()`.  `batch_size` is the maximum number of
+        messages processed before returning control to the event loop.
+
+    Yields
+    ------
+    Segment
+        In the order `Segmentizer()` produces them, including the open
+        segments once `feed` is exhausted.
+    """
+    if seg_states is not None:
+        segmentizer = Segmentizer.from_seg_states(seg_states, None, **kwargs)
+    else:
+        segmentizer = Segmentizer(None, **kwargs)
+    batch_size = segmentizer.batch_size
+    if buffer_size is None:
+        buffer_size = 10 * batch_size
+    buffer = asyncio.Queue(maxsize=buffer_size)
+    reader = asyncio.ensure_future(_read_feed(feed, buffer))
+    try:
+        done = False
+        while not done:
+            batch = [await buffer.get()]
+            while len(batch) < batch_size and not buffer.empty():
+                batch.append(buffer.get_nowait())
+            last = batch[-1]
+            if last is _END or isinstance(last, Exception):
+                batch.pop()
+                done = True
+            for x in _process_batch(segmentizer, batch):
+                yield x
+            if isinstance(last, Exception):
+                # Raised by the feed
+                raise last
+            # Let the feed and everything else on the loop run
+            await asyncio.sleep(0)
+        for x in segmentizer.close_all():
+            yield x
+    finally:
+        # Wait for the reader to stop, so no pending task is left behind when
+        # the consumer stops early
+        reader.cancel()
+        try:
+            await reader
+        except asyncio.CancelledError:
+            pass
+
+
+def _process_batch(segmentizer, batch):
+    if segmentizer.vectorize and batch:
+        msg_types, locs = segmentizer._classify_batch(batch)
+        for msg, msg_type, loc in zip(batch, msg_types, locs):
+            for x in segmentizer._process_msg(msg, msg_type, loc):
+                yield x
+    else:
+        for msg in batch:
+            for x in segmentizer.process_msg(msg):
+                yield x
@@ -0,0 +1,183 @@
+"""
+Segment the messages of one ssvid held in parallel arrays.
+
+Columnar extracts would otherwise have to be expanded into complete message
+dicts before they can be passed to `Segmentizer()`.  `segment_arrays()`
+instead classifies all messages at once from the arrays and feeds
+`Segmentizer()` a minimal dict per message, built as it is consumed, so every
+message goes through exactly the same rules as `Segmentizer.process()`.  The
+results are reported as arrays that line up with the input.
+"""
+
+
+from __future__ import division, print_function
+from collections import namedtuple
+import datetime
+
+from gpsdio_segment.core import BAD_MESSAGE
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.discrepancy import epoch_microseconds
+from gpsdio_segment.discrepancy import np
+from gpsdio_segment.segment import BadSegment, DiscardedSegment, InfoSegment
+from gpsdio_segment.stats import POSITION, INFO, BAD, NOISE, DISCARDED, DUPLICATE
+
+
+SegmentedArrays = namedtuple('SegmentedArrays',
+    ['segment_ids', 'classification', 'segments', 'states'])
+
+REQUIRED_FIELDS = ('timestamp', 'lat', 'lon', 'speed', 'course')
+OPTIONAL_FIELDS = ('heading', 'type', 'msgid')
+
+# Position of each message in the input arrays
+INDEX_FIELD = '_index'
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _column(data, name):
+    names = getattr(getattr(data, 'dtype', None), 'names', None)
+    if name not in (data if names is None else names):
+        return None
+    return np.asarray(data[name])
+
+
+def _timestamps(values):
+    if values.dtype.kind == 'M':
+        # `datetime64` values are taken to be UTC
+        us = values.astype('datetime64[us]').astype(np.int64).tolist()
+        return [_EPOCH + datetime.timedelta(microseconds=x) for x in us]
+    return values.tolist()
+
+
+def _datetime64(ts):
+    return np.datetime64(epoch_microseconds(ts), 'us')
+
+
+def _without_index(msg):
+    if msg is None or INDEX_FIELD not in msg:
+        return msg
+    msg = dict(msg)
+    del msg[INDEX_FIELD]
+    return msg
+
+
+def segment_arrays(data, ssvid=None, seg_states=None, **kwargs):
+
+    """
+    Segment the messages of a single ssvid given as parallel arrays.
+
+        >>> from gpsdio_segment import segment_arrays
+        >>> result = segment_arrays({'timestamp': ts, 'lat': lat, 'lon': lon,
+        ...                          'speed': speed, 'course': course},
+        ...                         ssvid=123456789)
+        >>> result.segment_ids[result.classification == 'position']
+
+    Parameters
+    ----------
+    data : numpy.ndarray or dict
+        A structured array or a mapping of field name to array, such as a
+        `dict` or a `pandas.DataFrame`, sorted by timestamp.  `timestamp`,
+        `lat`, `lon`, `speed` and `course` are required, `heading`, `type`
+        and `msgid` are optional.  Timestamps may be `datetime64` values,
+        which are taken to be UTC, or `datetime.datetime()`s.  Missing
+        values are `NaN`.  If there are no msgids each message is taken to
+        be unique.
+    ssvid : int, optional
+        The ssvid of the messages.
+    seg_states : iter, optional
+        Passed to `Segmentizer.from_seg_states()`.
+    **kwargs
+        Passed on to `Segmentizer()`.
+
+    Returns
+    -------
+    SegmentedArrays
+        `segment_ids` is an object array holding the id of the segment each
+        message was added to, or `None` if it was not added to one.
+        `classification` says what happened to each message: `'position'`
+        if it was added to a segment, `'info'`, `'bad'` if it is not a valid
+        position, `'noise'` if it was rejected while matching, `'discarded'`
+        if it was later dropped from its segment, or `'duplicate'`.
+        `segments` is a structured array with one row per segment giving its
+        `id`, `first_timestamp`, `last_timestamp`, `msg_count` including
+        previous runs, `n_msgs` in this run and whether it is `closed`.
+        `states` are the `SegmentState()`s of those segments for a future run.
+    """
+    if np is None:
+        raise ImportError("numpy is required to segment arrays")
+
+    columns = {}
+    for name in REQUIRED_FIELDS + OPTIONAL_FIELDS:
+        columns[name] = _column(data, name)
+        if columns[name] is None and name in REQUIRED_FIELDS:
+            raise ValueError("`data` is missing required field `{}`".format(name))
+    n = len(columns['timestamp'])
+    timestamps = _timestamps(columns['timestamp'])
+    values = {k: (v.tolist() if v is not None else [None] * n)
+                for (k, v) in columns.items() if k != 'timestamp'}
+    msgids = values['msgid'] if (columns['msgid'] is not None) else range(n)
+
+    def messages():
+        for i in range(n):
+            yield {'ssvid': ssvid,
+                   'msgid': msgids[i],
+                   'timestamp': timestamps[i],
+                   'type': values['type'][i],
+                   'lat': values['lat'][i],
+                   'lon': values['lon'][i],
+                   'speed': values['speed'][i],
+                   'course': values['course'][i],
+                   'heading': values['heading'][i],
+                   INDEX_FIELD: i}
+
+    kwargs['ssvid'] = ssvid
+    if seg_states:
+        segmentizer = Segmentizer.from_seg_states(seg_states, None, **kwargs)
+    else:
+        segmentizer = Segmentizer(None, **kwargs)
+    msg_types, locs = segmentizer._classify_arrays(
+        *[np.full(n, np.nan) if (columns[k] is None) else columns[k].astype(float)
+            for k in ('lon', 'lat', 'course', 'speed', 'heading')])
+
+    def emitted():
+        for msg, msg_type, loc in zip(messages(), msg_types, locs):
+            for seg in segmentizer._process_msg(msg, msg_type, loc):
+                yield seg
+        for seg in segmentizer.close_all():
+            yield seg
+
+    segment_ids = np.full(n, None, dtype=object)
+    classification = np.full(n, DUPLICATE, dtype='U9')
+    rows = []
+    states = []
+    for seg in emitted():
+        indices = [msg.pop(INDEX_FIELD) for msg in seg.msgs]
+        if isinstance(seg, InfoSegment):
+            classification[indices] = INFO
+        elif isinstance(seg, DiscardedSegment):
+            classification[indices] = DISCARDED
+        elif isinstance(seg, BadSegment):
+            for i in indices:
+                # Otherwise positional, but rejected while matching
+                classification[i] = BAD if (msg_types[i] is BAD_MESSAGE) else NOISE
+        else:
+            classification[indices] = POSITION
+            segment_ids[indices] = seg.id
+            # Spilled messages are read back with the index on every access
+            state = seg.state
+            state = state._replace(**dict(
+                (k, _without_index(getattr(state, k))) for k in
+                    ('first_msg', 'last_msg', 'first_msg_of_day', 'last_msg_of_day')))
+            rows.append((seg.id,
+                         _datetime64(state.first_msg['timestamp']),
+                         _datetime64(state.last_msg['timestamp']),
+                         state.msg_count, len(seg), seg.closed))
+            states.append(state)
+
+    segments = np.array(rows, dtype=[('id', object),
+                                     ('first_timestamp', 'datetime64[us]'),
+                                     ('last_timestamp', 'datetime64[us]'),
+                                     ('msg_count', np.int64),
+                                     ('n_msgs', np.int64),
+                                     ('closed', bool)])
+    return SegmentedArrays(segment_ids, classification, segments, states)
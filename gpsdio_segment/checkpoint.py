@@ -0,0 +1,304 @@
+"""
+Compact binary storage for `SegmentState()`s carried between runs.
+
+A `SegmentState()` holds complete copies of the first and last messages of
+a segment, identity info included, but `Segmentizer.from_seg_states()` only
+needs their time, position, speed, course and type.  `write_states()` stores
+just those fields in a versioned binary format, and `read_states()` streams
+them back one state at a time, so a checkpoint of millions of vessels never
+has to be held in memory.
+
+    >>> from gpsdio_segment.checkpoint import read_states, write_states
+    >>> with open('states.bin', 'wb') as f:
+    ...     write_states((seg.state for seg in segments), f)
+    >>> with open('states.bin', 'rb') as f:
+    ...     segmentizer = Segmentizer.from_seg_states(read_states(f), msgs)
+
+The restored messages have `ssvid`, `timestamp`, `lat`, `lon`, `speed`,
+`course`, `type` and, if set, `metric`.  `first_msg_of_day` and
+`last_msg_of_day` are not stored and are restored as `None`.
+
+Format
+------
+A header of `MAGIC` followed by a version byte, then one record per state:
+a little-endian `uint32` length followed by the flags, `msg_count`, the
+ssvid, the id unless it is the default id for the first message, then the
+first and last messages.  Strings are stored as a `uint32` length and UTF-8.
+Integers are `int64`s.
+"""
+
+
+from __future__ import division, print_function
+import datetime
+import io
+import numbers
+import struct
+
+from gpsdio_segment.core import INFO_TYPES
+from gpsdio_segment.core import POSITION_TYPES
+from gpsdio_segment.discrepancy import epoch_microseconds
+from gpsdio_segment.segment import SegmentState
+
+try:
+    from datetime import timezone
+    UTC = timezone.utc
+except ImportError:  # pragma: no cover
+
+    class _UTC(datetime.tzinfo):
+
+        zone = 'UTC'
+
+        def utcoffset(self, dt):
+            return datetime.timedelta(0)
+
+        def tzname(self, dt):
+            return 'UTC'
+
+        def dst(self, dt):
+            return datetime.timedelta(0)
+
+    UTC = _UTC()
+
+
+MAGIC = b'GSEGSTATE'
+VERSION = 1
+
+# Flags
+_NOISE = 1
+_CLOSED = 2
+_FIRST_MSG = 4
+_LAST_MSG = 8
+_SSVID_INT = 16
+_SSVID_STR = 32
+_ID_DERIVED = 64
+_AWARE = 128
+_ID_INT = 256
+
+_HEADER = struct.Struct('<B')
+_LENGTH = struct.Struct('<I')
+_RECORD = struct.Struct('<Hq')
+_INT = struct.Struct('<q')
+_MSG = struct.Struct('<qdddddB')
+
+# Message types are stored as an index into this list, or as a string
+_TYPES = sorted(set(POSITION_TYPES) | set(INFO_TYPES))
+_TYPE_CODES = dict((t, i) for (i, t) in enumerate(_TYPES))
+_NO_TYPE = 254
+_OTHER_TYPE = 255
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_UTC_EPOCH = _EPOCH.replace(tzinfo=UTC)
+_NAN = float('nan')
+
+
+def _default_id(ssvid, ts):
+    # Same as `Segmentizer._segment_unique_id()` without collisions, but
+    # formatted without `strftime()`, which is several times slower
+    return u'%s-%04d-%02d-%02dT%02d:%02d:%02d.%06dZ' % (
+        ssvid, ts.year, ts.month, ts.day, ts.hour, ts.minute, ts.second, ts.microsecond)
+
+
+def _is_int(value):
+    # The `numbers` check is slow, so try the common case first
+    return type(value) is int or (isinstance(value, numbers.Integral) and
+                                  not isinstance(value, bool))
+
+
+def _encode_str(value):
+    data = u'{}'.format(value).encode('utf-8')
+    return _LENGTH.pack(len(data)) + data
+
+
+def _encode_msg(msg, parts):
+    get = msg.get
+    lat, lon, speed, course, metric = (get('lat'), get('lon'), get('speed'),
+                                       get('course'), get('metric'))
+    type_ = get('type')
+    code = _NO_TYPE if (type_ is None) else _TYPE_CODES.get(type_, _OTHER_TYPE)
+    parts.append(_MSG.pack(epoch_microseconds(msg['timestamp']),
+                           _NAN if (lat is None) else lat,
+                           _NAN if (lon is None) else lon,
+                           _NAN if (speed is None) else speed,
+                           _NAN if (course is None) else course,
+                           _NAN if (metric is None) else metric,
+                           code))
+    if code == _OTHER_TYPE:
+        parts.append(_encode_str(type_))
+
+
+def encode_state(state):
+    """
+    Encode a `SegmentState()`, or a dict with the same fields, as one record.
+
+    Returns
+    -------
+    bytes
+        Including the length prefix.
+    """
+    if isinstance(state, dict):
+        state = SegmentState(**state)
+    first_msg, last_msg = state.first_msg, state.last_msg
+    ssvid = state.ssvid
+    flags = 0
+    if state.noise:
+        flags |= _NOISE
+    if state.closed:
+        flags |= _CLOSED
+    if first_msg is not None:
+        flags |= _FIRST_MSG
+    if last_msg is not None:
+        flags |= _LAST_MSG
+    if _is_int(ssvid):
+        flags |= _SSVID_INT
+    elif ssvid is not None:
+        flags |= _SSVID_STR
+    timestamps = [m['timestamp'] for m in (first_msg, last_msg) if m is not None]
+    if any(ts.tzinfo is not None for ts in timestamps):
+        if not all(ts.tzinfo is not None for ts in timestamps):
+            raise ValueError("Can not mix naive and aware timestamps in state {!r}"
+                             .format(state.id))
+        flags |= _AWARE
+    if (first_msg is not None and
+            state.id == _default_id(ssvid, first_msg['timestamp'])):
+        flags |= _ID_DERIVED
+    elif _is_int(state.id):
+        flags |= _ID_INT
+
+    parts = [_RECORD.pack(flags, state.msg_count)]
+    if flags & _SSVID_INT:
+        parts.append(_INT.pack(ssvid))
+    elif flags & _SSVID_STR:
+        parts.append(_encode_str(ssvid))
+    if flags & _ID_INT:
+        parts.append(_INT.pack(state.id))
+    elif not flags & _ID_DERIVED:
+        parts.append(_encode_str(state.id))
+    for msg in (first_msg, last_msg):
+        if msg is not None:
+            _encode_msg(msg, parts)
+    body = b''.join(parts)
+    return _LENGTH.pack(len(body)) + body
+
+
+def _decode_str(data, offset):
+    (n,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    return data[offset:offset + n].decode('utf-8'), offset + n
+
+
+def _decode_msg(data, offset, ssvid, epoch_base):
+    epoch, lat, lon, speed, course, metric, code = _MSG.unpack_from(data, offset)
+    offset += _MSG.size
+    if code == _OTHER_TYPE:
+        type_, offset = _decode_str(data, offset)
+    else:
+        type_ = None if (code == _NO_TYPE) else _TYPES[code]
+    # NaN is the only value not equal to itself, and marks missing values
+    msg = {'ssvid': ssvid,
+           'timestamp': epoch_base + datetime.timedelta(microseconds=epoch),
+           'type': type_,
+           'lat': lat if (lat == lat) else None,
+           'lon': lon if (lon == lon) else None,
+           'speed': speed if (speed == speed) else None,
+           'course': course if (course == course) else None}
+    if metric == metric:
+        msg['metric'] = metric
+    return msg, offset
+
+
+def decode_state(data):
+    """
+    Inverse of `encode_state()` for a record without its length prefix.
+
+    Returns
+    -------
+    SegmentState
+    """
+    flags, msg_count = _RECORD.unpack_from(data, 0)
+    offset = _RECORD.size
+    ssvid = None
+    if flags & _SSVID_INT:
+        (ssvid,) = _INT.unpack_from(data, offset)
+        offset += _INT.size
+    elif flags & _SSVID_STR:
+        ssvid, offset = _decode_str(data, offset)
+    id_ = None
+    if flags & _ID_INT:
+        (id_,) = _INT.unpack_from(data, offset)
+        offset += _INT.size
+    elif not flags & _ID_DERIVED:
+        id_, offset = _decode_str(data, offset)
+    epoch_base = _UTC_EPOCH if (flags & _AWARE) else _EPOCH
+    first_msg = last_msg = None
+    if flags & _FIRST_MSG:
+        first_msg, offset = _decode_msg(data, offset, ssvid, epoch_base)
+    if flags & _LAST_MSG:
+        last_msg, offset = _decode_msg(data, offset, ssvid, epoch_base)
+    if offset != len(data):
+        raise ValueError("Corrupt state record")
+    if flags & _ID_DERIVED:
+        id_ = _default_id(ssvid, first_msg['timestamp'])
+    return SegmentState(id=id_, ssvid=ssvid,
+                        first_msg=first_msg, last_msg=last_msg,
+                        first_msg_of_day=None, last_msg_of_day=None,
+                        msg_count=msg_count,
+                        noise=bool(flags & _NOISE),
+                        closed=bool(flags & _CLOSED))
+
+
+def write_states(states, dst):
+    """
+    Write a header and then each of `states` to the binary file-like object
+    `dst`.  `states` may be any iterable and is consumed lazily.
+
+    Returns
+    -------
+    int
+        Number of states written.
+    """
+    dst.write(MAGIC + _HEADER.pack(VERSION))
+    n = 0
+    for state in states:
+        dst.write(encode_state(state))
+        n += 1
+    return n
+
+
+def read_states(src):
+    """
+    Lazily read the `SegmentState()`s written by `write_states()` from the
+    binary file-like object `src`.
+    """
+    header = src.read(len(MAGIC) + _HEADER.size)
+    if header[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a segment state file")
+    (version,) = _HEADER.unpack(header[len(MAGIC):])
+    if version != VERSION:
+        raise ValueError("Unsupported segment state format version {}".format(version))
+    while True:
+        prefix = src.read(_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) != _LENGTH.size:
+            raise ValueError("Truncated segment state file")
+        (n,) = _LENGTH.unpack(prefix)
+        data = src.read(n)
+        if len(data) != n:
+            raise ValueError("Truncated segment state file")
+        yield decode_state(data)
+
+
+def encode_states(states):
+    """
+    `write_states()` to `bytes`.
+    """
+    buf = io.BytesIO()
+    write_states(states, buf)
+    return buf.getvalue()
+
+
+def decode_states(data):
+    """
+    `read_states()` from `bytes`, returned as a list.
+    """
+    return list(read_states(io.BytesIO(data)))
@@ -0,0 +1,265 @@
+"""
+Commandline interface for gpsdio-segment, registered as a `gpsdio` plugin.
+
+Messages are read from newline delimited JSON and written out as soon as the
+segment they belong to is finalized, so memory use is bounded by the open
+segments rather than the size of the file.
+"""
+
+
+from __future__ import division, print_function
+import datetime
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import zlib
+
+import click
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.multi import MultiSegmentizer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    from queue import Full
+except ImportError:  # pragma: no cover
+    from Queue import Full
+
+
+logging.basicConfig()
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.WARNING)
+
+
+# Lines are passed to worker processes in batches of this many
+BATCH_SIZE = 1000
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+_SSVID_RE = re.compile(r'"ssvid"\s*:\s*"?([^",}\s]*)')
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO 8601 timestamp such as `2017-01-01T00:00:00.000000Z` into a
+    naive UTC `datetime.datetime()`.  `T` or a space may separate the date
+    and time, fractional seconds are optional and the timezone may be `Z`,
+    an offset such as `+00:00` or missing, in which case UTC is assumed.
+    """
+    try:
+        # Fast path for the common fixed layout
+        ts = datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                               int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        rest = value[19:]
+        if rest.startswith('.'):
+            digits = len(rest) - len(rest[1:].lstrip('0123456789'))
+            fraction = rest[1:digits]
+            ts += datetime.timedelta(microseconds=int(round(
+                                        int(fraction) * 10 ** (6 - len(fraction)))))
+            rest = rest[digits:]
+        if rest in ('', 'Z', 'z'):
+            return ts
+        sign = {'+': -1, '-': 1}[rest[0]]
+        hours, minutes = rest[1:].replace(':', '')[:2], rest[1:].replace(':', '')[2:]
+        return ts + sign * datetime.timedelta(hours=int(hours), minutes=int(minutes or 0))
+    except (ValueError, KeyError, IndexError, TypeError):
+        raise ValueError("Could not parse timestamp: {!r}".format(value))
+
+
+def format_timestamp(ts):
+    if ts.tzinfo is not None:
+        ts = (ts - ts.utcoffset()).replace(tzinfo=None)
+    return ts.strftime(_TIMESTAMP_FORMAT)
+
+
+def loads(line):
+    """
+    Parse a line of JSON into a message with a `datetime.datetime()` timestamp.
+    """
+    msg = orjson.loads(line) if orjson is not None else json.loads(line)
+    if msg.get('timestamp') is not None:
+        msg['timestamp'] = parse_timestamp(msg['timestamp'])
+    return msg
+
+
+def dumps(msg):
+    """
+    Inverse of `loads()`.
+    """
+    if msg.get('timestamp') is not None:
+        msg = dict(msg, timestamp=format_timestamp(msg['timestamp']))
+    if orjson is not None:
+        # Identity counts have int and `None` keys, which `json` converts
+        return orjson.dumps(msg, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(msg)
+
+
+def open_text(path, mode):
+    """
+    Open `path` as text, decompressing or compressing if it ends with `.gz`.
+    `-` is stdin or stdout.
+    """
+    if path == '-':
+        stream = sys.stdin if (mode == 'r') else sys.stdout
+        return io.open(stream.fileno(), mode, encoding='utf-8', closefd=False)
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, mode + 'b'), encoding='utf-8')
+    return io.open(path, mode, encoding='utf-8')
+
+
+def read_lines(src):
+    for line in src:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def write_segments(segments, dst, segment_field):
+    """
+    Write the messages of each segment to `dst` as newline delimited JSON
+    with the segment id in `segment_field`.  Messages in noise segments get
+    `None`.
+    """
+    for seg in segments:
+        seg_id = None if seg.noise else seg.id
+        for msg in seg:
+            msg[segment_field] = seg_id
+            dst.write(dumps(msg))
+            dst.write(u'\n')
+
+
+def shard(line, n):
+    """
+    Index of the worker `line` is sent to, which only depends on its ssvid.
+    """
+    match = _SSVID_RE.search(line)
+    ssvid = match.group(1) if match else str(loads(line).get('ssvid'))
+    return zlib.crc32(ssvid.encode('utf-8')) % n
+
+
+def _segment_shard(queue, path, segment_field, kwargs):
+    # Worker process: segment batches of lines from `queue` until `None`
+    def lines():
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            for line in batch:
+                yield line
+
+    with io.open(path, 'w', encoding='utf-8') as dst:
+        msgs = (loads(line) for line in lines())
+        write_segments(MultiSegmentizer(msgs, **kwargs), dst, segment_field)
+
+
+def _put(queue, process, item):
+    # Don't wait forever on a worker that has died
+    while True:
+        try:
+            queue.put(item, timeout=1)
+            return
+        except Full:
+            if not process.is_alive():
+                raise click.ClickException("A worker process failed")
+
+
+def segment_workers(src, dst, workers, segment_field, kwargs):
+    """
+    Segment all ssvid in `src` using `workers` processes, each of which gets
+    all of the messages of a subset of ssvid.  Workers write to temporary
+    files that are copied to `dst` in order at the end, so the output does
+    not depend on how the work was scheduled.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        queues = [multiprocessing.Queue(maxsize=4) for _ in range(workers)]
+        paths = [os.path.join(tmpdir, '{}.json'.format(i)) for i in range(workers)]
+        processes = [multiprocessing.Process(target=_segment_shard,
+                                             args=(q, p, segment_field, kwargs))
+                        for (q, p) in zip(queues, paths)]
+        for process in processes:
+            process.start()
+        try:
+            batches = [[] for _ in range(workers)]
+            for line in read_lines(src):
+                i = shard(line, workers)
+                batches[i].append(line)
+                if len(batches[i]) >= BATCH_SIZE:
+                    _put(queues[i], processes[i], batches[i])
+                    batches[i] = []
+            for i, batch in enumerate(batches):
+                if batch:
+                    _put(queues[i], processes[i], batch)
+        finally:
+            for queue, process in zip(queues, processes):
+                try:
+                    _put(queue, process, None)
+                except click.ClickException:
+                    pass
+            for queue, process in zip(queues, processes):
+                process.join()
+                if process.exitcode:
+                    # Batches that a failed worker never read would otherwise
+                    # block this process from exiting
+                    queue.cancel_join_thread()
+        if any(process.exitcode for process in processes):
+            raise click.ClickException("A worker process failed")
+        for path in paths:
+            with io.open(path, encoding='utf-8') as f:
+                shutil.copyfileobj(f, dst)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@click.command()
+@click.argument('infile')
+@click.argument('outfile')
+@click.option('--mmsi', type=int, default=None,
+              help="Only segment this MMSI.  If not given all MMSI are segmented.")
+@click.option('--max-hours', type=float, default=Segmentizer.max_hours, show_default=True,
+              help="Points with a time delta larger than N hours are forced to be "
+                   "discontinuous.")
+@click.option('--max-speed', type=float, default=Segmentizer.max_knots, show_default=True,
+              help="Units are knots.  Points with a speed above this value are always "
+                   "considered discontinuous.")
+@click.option('--noise-dist', type=float, default=None,
+              help="DEPRECATED and ignored.")
+@click.option('--segment-field', default='segment', show_default=True,
+              help="Add the segment ID to this field when writing messages.")
+@click.option('--workers', type=int, default=1, show_default=True,
+              help="Number of processes to segment with.  Messages are split "
+                   "between them by MMSI.")
+def segment(infile, outfile, mmsi, max_hours, max_speed, noise_dist,
+            segment_field, workers):
+
+    """
+    Segment AIS data into continuous segments.
+
+    INFILE and OUTFILE are newline delimited JSON, gzipped if they end with
+    `.gz`, or `-` for stdin and stdout.  Messages must be sorted by timestamp.
+    """
+    if noise_dist is not None:
+        logger.warning("--noise-dist is deprecated and has no effect")
+    kwargs = dict(max_hours=max_hours, max_knots=max_speed)
+
+    with open_text(infile, 'r') as src, open_text(outfile, 'w') as dst:
+        if mmsi is not None:
+            msgs = (loads(line) for line in read_lines(src))
+            # ssvid may be a string or an integer
+            msgs = (x for x in msgs if x.get('ssvid') in (mmsi, str(mmsi)))
+            write_segments(Segmentizer(msgs, **kwargs), dst, segment_field)
+        elif workers > 1:
+            segment_workers(src, dst, workers, segment_field, kwargs)
+        else:
+            msgs = (loads(line) for line in read_lines(src))
+            write_segments(MultiSegmentizer(msgs, **kwargs), dst, segment_field)
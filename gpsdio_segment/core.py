@@ -24,11 +24,29 @@ the logic in the function `_compute_best`.
 from __future__ import division, print_function
 import logging
 import datetime
+import heapq
+import itertools
 import math
+import time
 
 from gpsdio_segment.discrepancy import DiscrepancyCalculator
-from gpsdio_segment.segment import Segment, BadSegment, ClosedSegment
+from gpsdio_segment.discrepancy import EPOCH_FIELD
+from gpsdio_segment.discrepancy import KINEMATICS_FIELD
+from gpsdio_segment.discrepancy import epoch_microseconds
+from gpsdio_segment.discrepancy import np
+from gpsdio_segment.dedup import ExpiringDict
+from gpsdio_segment.identity import EMPTY
+from gpsdio_segment.identity import IdentityIndex
+from gpsdio_segment.identity import US_PER_MINUTE
+from gpsdio_segment.segment import Segment, BadSegment, ClosedSegment, ColumnarSegment
 from gpsdio_segment.segment import DiscardedSegment, InfoSegment
+from gpsdio_segment.segment import Assignment, ProvisionalSegment, Retraction, SegmentState
+from gpsdio_segment.segment import SpillSegment
+from gpsdio_segment.spill import SpillFile
+from gpsdio_segment.spill import SpilledMsgs
+from gpsdio_segment.stats import SegmentizerStats
+from gpsdio_segment.stats import CLASSIFICATION, DEDUP, IDENTITY, EXPIRY, MATCHING, CLEAN
+from gpsdio_segment.stats import POSITION, INFO, BAD, NOISE, DISCARDED, DUPLICATE, SKIPPED
 
 
 logging.basicConfig()
@@ -73,6 +91,10 @@ POSITION_MESSAGE = object()
 INFO_MESSAGE = object()
 BAD_MESSAGE = object()
 
+# Below this many lookback candidates left to compare, `vectorize=True`
+# computes their discrepancies one at a time, which is faster
+MIN_VECTORIZED_CANDIDATES = 32
+
 NO_MATCH = object()
 IS_NOISE = object()
 
@@ -101,6 +123,25 @@ class Segmentizer(DiscrepancyCalculator):
     penalty_speed = 5.0
     max_open_segments = 20
     min_type_27_hours = 1.0
+    vectorize = False
+    batch_size = 1000
+    dedup_hours = None
+    columnar = False
+    stats = False
+    provisional = False
+    spill = False
+    spill_dir = None
+    prefilter = False
+
+    # Keyword arguments of `Segmentizer()` that override the knobs above
+    _PARAMETERS = ('max_hours', 'penalty_hours', 'hours_exp', 'buffer_hours',
+                   'max_knots', 'lookback', 'lookback_factor',
+                   'short_seg_threshold', 'shape_factor',
+                   'transponder_mismatch_weight', 'penalty_speed',
+                   'max_open_segments', 'min_type_27_hours', 'ambiguity_factor',
+                   'vectorize', 'batch_size', 'dedup_hours',
+                   'columnar', 'stats', 'provisional', 'spill', 'spill_dir',
+                   'prefilter')
 
 
     def __init__(self, instream, 
@@ -131,12 +172,14 @@ class Segmentizer(DiscrepancyCalculator):
             MMSI or other Source Specific ID to pull out of the stream and process.  
             If not given, the first valid ssvid is used.  All messages with a 
             different ssvid are thrown away.
-        prev_msgids : set, optional
-            Messages with msgids in this set are skipped as duplicates
+        prev_msgids : set or MsgidFilter, optional
+            Messages with msgids in this set are skipped as duplicates.  A
+            `MsgidFilter()` keeps this bounded across many runs.
         prev_locations : set, optional
             Location messages that match values in this set are skipped as duplicates.
-        prev_info : set, optional
-            Set of info data from previous run that may be relevant to current run.
+        prev_info : IdentityIndex or dict, optional
+            Identity info from previous run that may be relevant to current run,
+            either an `IdentityIndex()` or a `dict` filled in by `store_info()`.
         max_hours : float, optional
             Maximum number of hours to allow between points in a segment.
         penalty_hours : float, optional
@@ -170,30 +213,115 @@ class Segmentizer(DiscrepancyCalculator):
             If a type 27 message occurs closer than this time to a non-type 27 message, it is 
             dropped. This is because the low resolution type 27 messages can result in strange
             tracks, particularly when a vessel is in port.
+        ambiguity_factor : float, optional
+            A message that matches several segments is only added to the best
+            one if its metric is more than this many times that of the others.
+            Otherwise the segments are closed and a new one is started.
+        vectorize : bool, optional
+            Classify incoming messages in batches, and gather the lookback
+            candidates of all open segments before matching, computing their
+            match metrics with a single set of `numpy` operations when at
+            least `MIN_VECTORIZED_CANDIDATES` are within reach.  Gives the same
+            segments.  Metrics computed by `numpy` may differ from the scalar
+            ones in the last bits, within a relative 1e-12, so a match could
+            only change between candidates that are tied to that precision.
+            Batch classification makes it somewhat faster, but with
+            the default `lookback` and `max_open_segments` few candidates are
+            ever within reach, so matching is not.  Requires `numpy`.
+        batch_size : int, optional
+            Number of messages read and classified at a time by `process()`
+            when `vectorize=True`.
+        dedup_hours : float, optional
+            Only remember msgids and locations for this many hours when checking
+            for duplicates, so that `cur_msgids` and `cur_locations` stay bounded
+            on long runs.  By default everything seen during the run is kept.
+        columnar : bool, optional
+            Store open segments as `ColumnarSegment()`s, which keep the fields
+            used for matching in typed arrays and do not modify the messages
+            until the segment is emitted.  Gives the same results with less
+            memory per open message.
+        stats : bool, optional
+            Collect counters and stage timings in a `SegmentizerStats()`
+            available as `Segmentizer.stats` while the stream is consumed.
+            Otherwise `stats` is `None` and nothing is collected.
+        provisional : bool, optional
+            Emit each positional message as an `Assignment()` as soon as it
+            is matched rather than when its segment is closed, followed by a
+            `Retraction()` if lookback later drops it.  Open segments only
+            keep the messages of the last `max_hours`, which are all that can
+            still be matched, plus the last `lookback` older ones, whose
+            transponder types still count when matching.  They are emitted
+            without messages when closed, so that their `state` is still
+            available.
+            Messages are annotated with the identity info known when they are
+            emitted.  Can not be combined with `columnar`.
+        spill : bool, optional
+            Keep only the messages of the last `max_hours` of each open
+            segment in memory, which are all that can still be matched, plus
+            the last `lookback` older ones, whose transponder types still
+            count when matching.  Older messages are annotated with identity
+            info, appended to a temporary file shared by all segments, and
+            read back as the segment is iterated over once it is emitted, so
+            its `msgs` are a `SpilledMsgs()` rather than a list.  The file
+            only grows, and is deleted once neither the `Segmentizer()` nor
+            any emitted segment refers to it.  Can not be combined with
+            `columnar` or `provisional`.
+        spill_dir : str, optional
+            Directory for the temporary file of `spill`.  Defaults to the
+            system temporary directory.
+        prefilter : bool, optional
+            Skip the discrepancy computation for lookback candidates that are
+            too far away to be reached in the time between them, which are
+            found with a cheap lower bound on the discrepancy.  Gives the same
+            results.  Most candidates are already skipped by the bound on
+            their metric, so this saves discrepancy computations but no time
+            on the benchmarks, and is off by default.
 
         """
+        for k in self._PARAMETERS:
+            self._update(k, kwargs)
+
         self.prev_msgids = prev_msgids if prev_msgids else set()
-        self.cur_msgids = {}
         self.prev_locations = prev_locations if prev_locations else set()
-        self.cur_locations = {}
-        self.cur_info = prev_info.copy() if prev_info else {}
-
-        for k in ['max_hours', 'penalty_hours', 'hours_exp', 'buffer_hours',
-                  'max_knots', 'lookback', 'lookback_factor', 
-                  'short_seg_threshold', 'shape_factor',
-                  'transponder_mismatch_weight', 'penalty_speed',
-                  'max_open_segments']:
-            self._update(k, kwargs)
+        if self.dedup_hours is None:
+            # Nothing is ever forgotten, so no need to keep track of age
+            self.cur_msgids = {}
+            self.cur_locations = {}
+        else:
+            dedup_age = int(self.dedup_hours * 60 * US_PER_MINUTE)
+            self.cur_msgids = ExpiringDict(dedup_age)
+            self.cur_locations = ExpiringDict(dedup_age)
+        if isinstance(prev_info, IdentityIndex):
+            self.cur_info = prev_info.copy()
+        else:
+            # Identity info from `store_info()` with a plain `dict`
+            self.cur_info = IdentityIndex(INFO_PING_INTERVAL_MINS, prev_info)
+        if self.vectorize and np is None:
+            raise ImportError("numpy is required when `vectorize=True`")
+        if self.provisional and self.columnar:
+            raise ValueError("`provisional` and `columnar` can not be combined")
+        if self.spill and (self.columnar or self.provisional):
+            raise ValueError("`spill` can not be combined with `columnar` or `provisional`")
 
         # Exposed via properties
         self._instream = instream
 
         # Internal objects
         self._segments = {}
+        self._segment_heap = []
+        self._segment_counter = itertools.count()
         self._ssvid = ssvid
+        # Times are tracked internally as epoch microseconds
         self._prev_timestamp = None
+        self._next_info_expiry = None
+        # Shared by all spilled segments, created when first needed
+        self._spill_file = None
         self._discrepancy_alpha_0 = self.max_knots / self.penalty_speed
 
+        self.stats = SegmentizerStats() if self.stats else None
+        if self.stats is not None:
+            self._instrument()
+
     def __repr__(self):
         return "<{cname}() max_knots={mspeed} max_hours={mhours} at {id_}>".format(
             cname=self.__class__.__name__, mspeed=self.max_knots,
@@ -207,6 +335,7 @@ class Segmentizer(DiscrepancyCalculator):
         via `SegmentState.fromdict()`.
         """
         s = cls(instream, **kwargs)
+        segment_class = s._open_segment_class
         for state in seg_states:
             if isinstance(state, dict):
                 if state['closed']:
@@ -214,14 +343,29 @@ class Segmentizer(DiscrepancyCalculator):
             else:
                 if state.closed:
                     continue
-            seg = Segment.from_state(state)
-            s._segments[seg.id] = seg
-            if seg.last_msg:
-                ts = seg.last_msg['timestamp']
+            seg = segment_class.from_state(state)
+            s._register_segment(seg)
+            ts = seg.last_epoch
+            if ts is not None:
                 if s._prev_timestamp is None or ts > s._prev_timestamp:
                     s._prev_timestamp = ts
         return s
 
+    def _instrument(self):
+        # Only done when `stats=True`, so the methods are untouched otherwise
+        for stage, methods, generators in [
+                (CLASSIFICATION, ['_message_type', '_classify_batch'], []),
+                (DEDUP, ['normalize_location', '_duplicate_msgid', 
+                         '_duplicate_location'], []),
+                (IDENTITY, ['store_info', 'add_info', '_expire_info'], []),
+                (EXPIRY, ['_expired_segments'], ['_remove_excess_segments']),
+                (MATCHING, ['_compute_best'], []),
+                (CLEAN, [], ['clean'])]:
+            for name in methods:
+                setattr(self, name, self.stats.timed(stage, getattr(self, name)))
+            for name in generators:
+                setattr(self, name, self.stats.timed_generator(stage, getattr(self, name)))
+
     @staticmethod
     def transponder_types(msg):
         return POSITION_TYPES.get(msg.get('type'), set())
@@ -231,6 +375,14 @@ class Segmentizer(DiscrepancyCalculator):
     def instream(self):
         return self._instream
 
+    @property
+    def _open_segment_class(self):
+        if self.provisional:
+            return ProvisionalSegment
+        if self.spill:
+            return SpillSegment
+        return ColumnarSegment if self.columnar else Segment
+
     @property
     def ssvid(self):
         return self._ssvid
@@ -244,12 +396,14 @@ class Segmentizer(DiscrepancyCalculator):
         str
         """
 
-        ts = msg['timestamp']
+        epoch = self.msg_epoch(msg)
         while True:
-            seg_id = '{}-{:%Y-%m-%dT%H:%M:%S.%fZ}'.format(msg['ssvid'], ts)
+            seconds, us = divmod(epoch, 1000000)
+            seg_id = '{}-{}.{:06d}Z'.format(
+                msg['ssvid'], time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)), us)
             if seg_id not in self._segments:
                 return seg_id
-            ts += datetime.timedelta(milliseconds=1)
+            epoch += 1000
 
 
     def _message_type(self, x, y, course, speed):
@@ -258,7 +412,7 @@ class Segmentizer(DiscrepancyCalculator):
         if is_null(x) and is_null(y) and is_null(course) and is_null(speed):
             return INFO_MESSAGE
         if  (x is not None and y is not None and
-             speed is not None and course is not None and 
+             not is_null(speed) and course is not None and 
              -180.0 <= x <= 180.0 and 
              -90.0 <= y <= 90.0 and
              course is not None and 
@@ -270,39 +424,166 @@ class Segmentizer(DiscrepancyCalculator):
             return POSITION_MESSAGE
         return BAD_MESSAGE
 
+    def _classify_arrays(self, x, y, course, speed, heading):
+        """
+        Vectorized `_message_type()` and `normalize_location()` for arrays of
+        message fields, with `NaN` for missing values.
+
+        Returns
+        -------
+        list of message types and list of locations, which are `None` for
+        messages that are not positional.
+        """
+        info = np.isnan(x) & np.isnan(y) & np.isnan(course) & np.isnan(speed)
+        excluded = np.zeros(len(speed), dtype=bool)
+        for (l, h) in REPORTED_SPEED_EXCLUSION_RANGES:
+            excluded |= (l < speed) & (speed < h)
+        position = (~np.isnan(speed) &
+                    (-180.0 <= x) & (x <= 180.0) & 
+                    (-90.0 <= y) & (y <= 90.0) &
+                    (((speed <= self.very_slow) & (course > 359.95)) |
+                     ((0.0 <= course) & (course <= 359.95))) &
+                    ((speed < SAFE_SPEED) | ~excluded))
+
+        codes = np.where(position, 0, np.where(info, 1, 2))
+        msg_types = [(POSITION_MESSAGE, INFO_MESSAGE, BAD_MESSAGE)[c] 
+                        for c in codes.tolist()]
+
+        # Same rounding as `normalize_location()`, which is half to even
+        def rounded(values):
+            return np.round(values).astype(np.int64).tolist()
+        i = np.flatnonzero(position)
+        h = heading[i]
+        missing = np.isnan(h)
+        headings = [None if m else v for (m, v) in 
+                        zip(missing.tolist(), rounded(np.where(missing, 0, h)))]
+        locs = [None] * len(codes)
+        for j, loc in zip(i.tolist(), zip(rounded(x[i] * 60000), 
+                                          rounded(y[i] * 60000), 
+                                          rounded(course[i] * 10),
+                                          rounded(speed[i] * 10),
+                                          headings)):
+            locs[j] = loc
+        return msg_types, locs
+
+    def _classify_batch(self, msgs):
+        """
+        `_classify_arrays()` for a list of message dicts.
+        """
+        fields = [np.array([msg.get(k) for msg in msgs], dtype=float) 
+                    for k in ('lon', 'lat', 'course', 'speed', 'heading')]
+        return self._classify_arrays(*fields)
+
     def _create_segment(self, msg, cls=Segment):
         id_ = self._segment_unique_id(msg)
         seg = cls(id_, self.ssvid)
         seg.add_msg(msg)
         return seg
 
+    def _register_segment(self, seg):
+        """
+        Add `seg` to the open segments.
+
+        Open segments are also tracked in a heap keyed by the epoch timestamp of 
+        their last message, so that stale segments can be found without scanning all
+        of them.  Heap entries are not updated when messages are added to a
+        segment, or removed when a segment is closed.  Instead, an entry's
+        timestamp is a lower bound for the segment's last timestamp, and
+        entries are checked and refreshed when they reach the top of the heap.
+        """
+        self._segments[seg.id] = seg
+        if self.stats is not None:
+            self.stats.peak_open_segments = max(self.stats.peak_open_segments, 
+                                                len(self._segments))
+        ts = seg.last_epoch
+        if ts is not None:
+            heapq.heappush(self._segment_heap, 
+                (ts, next(self._segment_counter), seg))
+
+    def _pop_stale_entry(self):
+        """
+        Pop the heap entry of the open segment with the oldest last message.
+        Ties are broken by the order the segments were opened in.
+
+        Returns
+        -------
+        (timestamp, counter, segment) or `None` if there are no open segments.
+        """
+        heap = self._segment_heap
+        while heap:
+            ts, counter, seg = heapq.heappop(heap)
+            if self._segments.get(seg.id) is not seg:
+                # Already closed
+                continue
+            last_ts = seg.last_epoch
+            if last_ts != ts:
+                # Messages were added since this entry was pushed
+                heapq.heappush(heap, (last_ts, counter, seg))
+                continue
+            return ts, counter, seg
+        return None
+
+    def _expired_segments(self, msg):
+        """
+        Remove and return the open segments that have not had a positional 
+        message in `max_hours`, in the order they were opened.
+        """
+        expired = []
+        timestamp = msg[EPOCH_FIELD]
+        while self._segment_heap:
+            ts = self._segment_heap[0][0]
+            # All other entries, and so all segments, have later timestamps
+            if self.compute_epoch_delta_hours(ts, timestamp) <= self.max_hours:
+                break
+            entry = self._pop_stale_entry()
+            if entry is None:
+                break
+            ts, counter, seg = entry
+            if self.compute_epoch_delta_hours(ts, timestamp) <= self.max_hours:
+                # Not expired after all, so put it back
+                heapq.heappush(self._segment_heap, entry)
+                break
+            expired.append((counter, self._segments.pop(seg.id)))
+        expired.sort(key=lambda x: x[0])
+        if self.stats is not None:
+            self.stats.segments_expired += len(expired)
+        return [seg for (_, seg) in expired]
+
     def _remove_excess_segments(self):
         while len(self._segments) >= self.max_open_segments:
             # Remove oldest segment
-            segs = list(self._segments.items())
-            segs.sort(key=lambda x: x[1].last_msg['timestamp'])
-            stalest_seg_id, _ = segs[0]
-            log('Removing stale segment {}'.format(stalest_seg_id))
-            for x in self.clean(self._segments.pop(stalest_seg_id), ClosedSegment):
+            _, _, stalest_seg = self._pop_stale_entry()
+            log('Removing stale segment {}'.format(stalest_seg.id))
+            if self.stats is not None:
+                self.stats.segments_evicted += 1
+            for x in self.clean(self._segments.pop(stalest_seg.id), ClosedSegment):
                 yield x
 
     def _add_segment(self, msg):
         for excess_seg in self._remove_excess_segments():
             yield excess_seg
-        seg = self._create_segment(msg)
-        self._segments[seg.id] = seg
+        seg = self._create_segment(msg, cls=self._open_segment_class)
+        self._register_segment(seg)
+        if self.stats is not None:
+            self.stats.segments_opened += 1
+            self.stats.messages[POSITION] += 1
+        if self.provisional:
+            yield Assignment(self._published(msg), seg.id, None)
 
 
-    def _segment_match(self, segment, msg):
-        match = {'seg_id': segment.id,
-                 'msgs_to_drop' : [],
-                 'hours' : None,
-                 'metric' : None}
+    def _lookback_candidates(self, segment, msg):
+        """
+        Gather the last `lookback` positional messages of `segment` that `msg`
+        could be matched to.
 
-        # Get the stats for the last `lookback` positional messages
+        Returns
+        -------
+        list of (existing_metric, msgs_to_drop, prev_msg) tuples and whether
+        the transponder types of `msg` and `segment` match.
+        """
         candidates = []
 
-        n = len(segment)
+        n = len(segment) + segment.n_removed
         msgs_to_drop = []
         metric = 0
         transponder_types = set()
@@ -311,10 +592,7 @@ class Segmentizer(DiscrepancyCalculator):
             if prev_msg.get('drop'):
                 continue
             transponder_types |= self.transponder_types(prev_msg)
-            hours = self.compute_msg_delta_hours(prev_msg, msg)
-            penalized_hours = hours / (1 + (hours / self.penalty_hours) ** (1 - self.hours_exp))
-            discrepancy = self.compute_discrepancy(prev_msg, msg, penalized_hours)
-            candidates.append((metric, msgs_to_drop[:], discrepancy, hours, penalized_hours))
+            candidates.append((metric, msgs_to_drop[:], prev_msg))
             if len(candidates) >= self.lookback or n < 0:
                 # This allows looking back 1 message into the previous batch of messages
                 break
@@ -326,46 +604,216 @@ class Segmentizer(DiscrepancyCalculator):
 
         assert len(candidates) > 0
 
+        return candidates, transponder_match
+
+    def _n_stale(self, segment, timestamp, annotate=False):
+        """
+        Number of leading messages of `segment` that are more than `max_hours`
+        older than the epoch `timestamp`.  `_score_candidates()` stops at the
+        first of these, so they can no longer be matched or dropped.  With
+        `annotate`, they must also be too old for any identity info still to
+        come to apply to them.  The last message is never counted.
+        """
+        msgs = segment.msgs
+        minute = timestamp // US_PER_MINUTE
+        n = 0
+        while n < len(msgs) - 1:
+            epoch = self.msg_epoch(msgs[n])
+            if self.compute_epoch_delta_hours(epoch, timestamp) <= self.max_hours:
+                break
+            if annotate and minute - epoch // US_PER_MINUTE <= self.cur_info.interval_mins:
+                break
+            n += 1
+        return n
+
+    def _penalized_hours(self, hours):
+        return hours / (1 + (hours / self.penalty_hours) ** (1 - self.hours_exp))
+
+    def _segment_match(self, segment, msg):
+        candidates, transponder_match = self._lookback_candidates(segment, msg)
+
+        epoch = self.msg_epoch(msg)
+        kinematics = self.msg_kinematics(msg)
+        hours = [self.compute_epoch_delta_hours(self.msg_epoch(prev_msg), epoch) 
+                    for (_, _, prev_msg) in candidates]
+
+        def discrepancy(i):
+            prev_kinematics = self.msg_kinematics(candidates[i][2])
+            penalized_hours = self._penalized_hours(hours[i])
+            # Same limit as `_metric()`, with an allowance for rounding so that
+            # only candidates it would certainly reject are skipped
+            if self.prefilter and self.kinematic_discrepancy_exceeds(
+                    prev_kinematics, kinematics, penalized_hours,
+                    math.hypot(hours[i], self.buffer_hours) * self.max_knots * (1 + 1e-9)):
+                if self.stats is not None:
+                    self.stats.unreachable_candidates += 1
+                return inf
+            if self.stats is not None:
+                self.stats.discrepancy_evaluations += 1
+            return self.compute_kinematic_discrepancy(prev_kinematics, kinematics, 
+                                                      penalized_hours)
+
+        return self._score_candidates(segment, candidates, transponder_match, 
+                                      hours, discrepancy)
+
+    def _metric(self, hours, discrepancy, transponder_match):
+        """
+        Compute the base metric for a match to a previous message or `None`
+        if the discrepancy is too large to allow a match.
+        """
+        padded_hours = math.hypot(hours, self.buffer_hours)
+        max_allowed_discrepancy = padded_hours * self.max_knots
+        if discrepancy <= max_allowed_discrepancy:
+            alpha = self._discrepancy_alpha_0 * discrepancy / max_allowed_discrepancy 
+            metric = math.exp(-alpha ** 2) / padded_hours #** 2
+            # Down weight cases where transceiver types don't match.
+            if not transponder_match:
+                metric *= self.transponder_mismatch_weight
+            return metric
+        else:
+            log("can't match due to discrepancy: %s / %s = %s", 
+                    discrepancy, padded_hours, discrepancy / padded_hours)
+            return None
+
+    def _metric_bound(self, hours, transponder_match):
+        """
+        Upper bound of `_metric()` for any discrepancy.  The exponential is at
+        most 1 and rounding is monotonic, so computing the rest of the metric
+        the same way gives a bound that holds exactly.
+        """
+        metric = 1.0 / math.hypot(hours, self.buffer_hours)
+        if not transponder_match:
+            metric *= self.transponder_mismatch_weight
+        return metric
+
+    def _score_candidates(self, segment, candidates, transponder_match, hours, 
+                          discrepancy=None, metrics=None):
+        """
+        Pick the best of the lookback `candidates` of `segment`.  `hours` is 
+        parallel to `candidates`.  Base metrics may be passed in via `metrics`,
+        otherwise they are computed by `_metric()` from `discrepancy()`, a
+        function of the candidate index.  It is only called for candidates 
+        whose best possible metric could still change the match.
+        """
+        match = {'seg_id': segment.id,
+                 'msgs_to_drop' : [],
+                 'hours' : None,
+                 'metric' : None}
+
         best_metric_lb = 0
-        for lookback, match_info in enumerate(candidates):
-            existing_metric, msgs_to_drop, discrepancy, hours, penalized_hours = match_info
-            assert hours >= 0
-            if hours > self.max_hours: 
+        for lookback, (existing_metric, msgs_to_drop, _) in enumerate(candidates):
+            assert hours[lookback] >= 0
+            if hours[lookback] > self.max_hours: 
                 log("can't match due to max_hours")
                 # Too long has passed, we can't match this segment
                 break
+            if metrics is None:
+                bound = self._metric_bound(hours[lookback], transponder_match)
+                bound_lb = bound / max(1, lookback * self.lookback_factor)
+                if bound_lb <= existing_metric or bound_lb <= best_metric_lb:
+                    # Rejected below whatever the discrepancy
+                    if self.stats is not None:
+                        self.stats.bounded_candidates += 1
+                    continue
+                d = discrepancy(lookback)
+                if d == inf:
+                    # Out of reach, which `_metric()` would reject
+                    continue
+                metric = self._metric(hours[lookback], d, transponder_match)
             else:
-                padded_hours = math.hypot(hours, self.buffer_hours)
-                max_allowed_discrepancy = padded_hours * self.max_knots
-                if discrepancy <= max_allowed_discrepancy:
-                    alpha = self._discrepancy_alpha_0 * discrepancy / max_allowed_discrepancy 
-                    metric = math.exp(-alpha ** 2) / padded_hours #** 2
-                    # Down weight cases where transceiver types don't match.
-                    if not transponder_match:
-                        metric *= self.transponder_mismatch_weight
-                    # For lookback use the weight reduced by the lookback factor,
-                    # But don't store this weight, use base metric instead.
-                    metric_lb = metric / max(1, lookback * self.lookback_factor)
-                    # Scale the existing metric using the lookback factor so that we only
-                    # matches to points further in the past if they are noticeably better
-                    if metric_lb <= existing_metric:
-                        log("can't make metric worse: %s vs %s (%s) at lb %s", 
-                            metric_lb, existing_metric, metric, lookback)
-                        # Don't make existing segment worse
-                        continue
-                    if metric_lb > best_metric_lb:
-                        log('updating metric %s (%s)', metric_lb, metric)
-                        best_metric_lb = metric_lb
-                        match['metric'] = metric
-                        match['hours'] = hours
-                        match['msgs_to_drop'] = msgs_to_drop
-                else:
-                    log("can't match due to discrepancy: %s / %s = %s", 
-                            discrepancy, padded_hours, discrepancy / padded_hours)
-
+                metric = metrics[lookback]
+            if metric is None:
+                continue
+            # For lookback use the weight reduced by the lookback factor,
+            # But don't store this weight, use base metric instead.
+            metric_lb = metric / max(1, lookback * self.lookback_factor)
+            # Scale the existing metric using the lookback factor so that we only
+            # matches to points further in the past if they are noticeably better
+            if metric_lb <= existing_metric:
+                log("can't make metric worse: %s vs %s (%s) at lb %s", 
+                    metric_lb, existing_metric, metric, lookback)
+                # Don't make existing segment worse
+                continue
+            if metric_lb > best_metric_lb:
+                log('updating metric %s (%s)', metric_lb, metric)
+                best_metric_lb = metric_lb
+                match['metric'] = metric
+                match['hours'] = hours[lookback]
+                match['msgs_to_drop'] = msgs_to_drop
 
         return match
 
+    def _segment_matches_vectorized(self, segs, msg):
+        """
+        Equivalent to calling `_segment_match()` for each segment in `segs`,
+        but gathers the lookback candidates of all segments first.  Candidates
+        that `_score_candidates()` would reject whatever their discrepancy,
+        and those that are out of reach, are left out, and if at least
+        `MIN_VECTORIZED_CANDIDATES` remain their discrepancies and metrics
+        are computed with a single set of numpy operations.
+        """
+        gathered = [self._lookback_candidates(seg, msg) for seg in segs]
+        epoch = self.msg_epoch(msg)
+        kinematics = self.msg_kinematics(msg)
+        hours = []
+        metrics = []
+        # Indices, kinematics, hours and transponder matches of the candidates
+        # left to compute
+        pending = []
+        for candidates, transponder_match in gathered:
+            for lookback, (existing_metric, _, prev_msg) in enumerate(candidates):
+                h = self.compute_epoch_delta_hours(self.msg_epoch(prev_msg), epoch)
+                hours.append(h)
+                metrics.append(None)
+                if h > self.max_hours:
+                    # `_score_candidates()` stops here
+                    continue
+                bound = self._metric_bound(h, transponder_match)
+                if bound / max(1, lookback * self.lookback_factor) <= existing_metric:
+                    if self.stats is not None:
+                        self.stats.bounded_candidates += 1
+                    continue
+                prev_kinematics = self.msg_kinematics(prev_msg)
+                if self.prefilter and self.kinematic_discrepancy_exceeds(
+                        prev_kinematics, kinematics, self._penalized_hours(h),
+                        math.hypot(h, self.buffer_hours) * self.max_knots * (1 + 1e-9)):
+                    if self.stats is not None:
+                        self.stats.unreachable_candidates += 1
+                    continue
+                pending.append((len(metrics) - 1, prev_kinematics, h, transponder_match))
+
+        if self.stats is not None:
+            self.stats.discrepancy_evaluations += len(pending)
+        if len(pending) < MIN_VECTORIZED_CANDIDATES:
+            # Cheaper one at a time than the overhead of numpy
+            for i, prev_kinematics, h, transponder_match in pending:
+                discrepancy = self.compute_kinematic_discrepancy(
+                                prev_kinematics, kinematics, self._penalized_hours(h))
+                metrics[i] = self._metric(h, discrepancy, transponder_match)
+        elif pending:
+            indices, k1s, hours_, matched = zip(*pending)
+            weights = [1.0 if x else self.transponder_mismatch_weight for x in matched]
+            hours_ = np.array(hours_)
+            discrepancies = self.compute_kinematic_discrepancies(
+                                k1s, kinematics, self._penalized_hours(hours_))
+            padded_hours = np.hypot(hours_, self.buffer_hours)
+            max_allowed_discrepancy = padded_hours * self.max_knots
+            alpha = self._discrepancy_alpha_0 * discrepancies / max_allowed_discrepancy
+            computed = np.exp(-alpha ** 2) / padded_hours * np.array(weights)
+            for i, m, d, a in zip(indices, computed.tolist(), discrepancies.tolist(), 
+                                  max_allowed_discrepancy.tolist()):
+                if d <= a:
+                    metrics[i] = m
+
+        matches = []
+        i = 0
+        for seg, (candidates, transponder_match) in zip(segs, gathered):
+            j = i + len(candidates)
+            matches.append(self._score_candidates(seg, candidates, transponder_match,
+                                hours[i:j], metrics=metrics[i:j]))
+            i = j
+        return matches
+
     def _compute_best(self, msg):
         # figure out which segment is the best match for the given message
 
@@ -373,7 +821,10 @@ class Segmentizer(DiscrepancyCalculator):
         best_match = NO_MATCH
 
         # get match metrics for all candidate segments
-        raw_matches = [self._segment_match(seg, msg) for seg in segs]
+        if self.vectorize and len(segs) > 1:
+            raw_matches = self._segment_matches_vectorized(segs, msg)
+        else:
+            raw_matches = [self._segment_match(seg, msg) for seg in segs]
         # If metric is none, then the segment is not a match candidate
         matches = [x for x in raw_matches if x['metric'] is not None]
 
@@ -411,18 +862,64 @@ class Segmentizer(DiscrepancyCalculator):
     def __iter__(self):
         return self.process()
 
+    def _finalize(self, msg):
+        """
+        Annotate `msg` with identity info and remove the fields only used
+        while it is in an open segment, other than `drop`.
+        """
+        self.add_info(msg)
+        msg.pop('metric', None)
+        msg.pop(EPOCH_FIELD, None)
+        msg.pop(KINEMATICS_FIELD, None)
+
+    def _published(self, msg):
+        """
+        Copy of `msg` as it is emitted by `clean()`, for messages that are
+        still held by an open segment.
+        """
+        msg = dict(msg)
+        self._finalize(msg)
+        msg.pop('drop', None)
+        return msg
+
+    def _discarded(self, msg):
+        if self.stats is not None:
+            self.stats.messages[DISCARDED] += 1
+        log(("Dropping message from ssvid: {ssvid!r} timestamp: {timestamp!r}").format(
+            **msg))
+        return self._create_segment(msg, cls=DiscardedSegment)
+
+    def _provisional_clean(self, segment, cls):
+        # The messages have already been emitted, so only the state is kept
+        first_msg, last_msg = segment.first_msg, segment.last_msg
+        first_msg_of_day = segment.first_msg_of_day
+        new_segment = cls(segment.id, segment.ssvid)
+        new_segment.prev_state = SegmentState(
+            id=segment.id, ssvid=segment.ssvid, 
+            first_msg=None if (first_msg is None) else self._published(first_msg),
+            last_msg=None if (last_msg is None) else self._published(last_msg),
+            first_msg_of_day=None, last_msg_of_day=None,
+            msg_count=segment.msg_count - segment.n_dropped,
+            noise=cls.noise, closed=cls.closed)
+        return new_segment
+
     def clean(self, segment, cls):
+        if isinstance(segment, ProvisionalSegment):
+            yield self._provisional_clean(segment, cls)
+            return
         if segment.has_prev_state:
             new_segment = cls.from_state(segment.prev_state)
         else:
             new_segment = cls(segment.id, segment.ssvid)
+        if isinstance(segment, SpillSegment) and segment.spilled is not None:
+            # Already finalized, and only read back when the segment is
+            for msg in segment.spilled.messages(dropped=True):
+                yield self._discarded(msg)
+            new_segment.msgs = SpilledMsgs(segment.spilled)
         for msg in segment.msgs:
-            self.add_info(msg)
-            msg.pop('metric', None)
+            self._finalize(msg)
             if msg.pop('drop', False):
-                log(("Dropping message from ssvid: {ssvid!r} timestamp: {timestamp!r}").format(
-                    **msg))
-                yield self._create_segment(msg, cls=DiscardedSegment)
+                yield self._discarded(msg)
                 continue
             else:
                 new_segment.add_msg(msg)
@@ -446,6 +943,12 @@ class Segmentizer(DiscrepancyCalculator):
 
     @classmethod
     def store_info(cls, info, msg):
+        """
+        Record the identity fields of `msg` in `info`, which is normally an
+        `IdentityIndex()`.  A plain `dict` may also be passed, in which case
+        the observation is added to every minute within `INFO_PING_INTERVAL_MINS`
+        of `msg` so that the result can be passed as `prev_info`.
+        """
         shipname = msg.get('shipname')
         callsign = msg.get('callsign')
         imo = msg.get('imo')
@@ -459,14 +962,17 @@ class Segmentizer(DiscrepancyCalculator):
             return
         receiver_type = msg.get('receiver_type')
         source = msg.get('source')
-        receiver = msg.get('receiver')
+        k2 = (transponder_type, receiver_type, source)
+        if isinstance(info, IdentityIndex):
+            info.add(cls.msg_epoch(msg), k2, shipname, callsign, imo, 
+                     n_shipname, n_callsign, n_imo)
+            return
         ts = msg['timestamp']
         # Using tzinfo as below is only stricly valid for UTC and naive time due to
         # issues with DST (see http://pytz.sourceforge.net).
         assert ts.tzinfo.zone == 'UTC'
         rounded_ts = datetime.datetime(ts.year, ts.month, ts.day, ts.hour, ts.minute,
                                         tzinfo=ts.tzinfo)
-        k2 = (transponder_type, receiver_type, source)
         for offset in range(-INFO_PING_INTERVAL_MINS, INFO_PING_INTERVAL_MINS + 1):
             k1 = rounded_ts + datetime.timedelta(minutes=offset)
             if k1 not in info:
@@ -479,139 +985,236 @@ class Segmentizer(DiscrepancyCalculator):
                 n_shipnames[n_shipname] = n_shipnames.get(n_shipname, 0) + 1
             if callsign is not None:
                 callsigns[callsign] = callsigns.get(callsign, 0) + 1
-                n_callsigns[n_callsign] = callsigns.get(n_callsign, 0) + 1
+                n_callsigns[n_callsign] = n_callsigns.get(n_callsign, 0) + 1
             if imo is not None:
                 imos[imo] = imos.get(imo, 0) + 1
-                n_imos[n_imo] = imos.get(n_imo, 0) + 1
+                n_imos[n_imo] = n_imos.get(n_imo, 0) + 1
 
     def add_info(self, msg):
-        ts = msg['timestamp']
-        # Using tzinfo as below is only stricly valid for UTC and naive time due to
-        # issues with DST (see http://pytz.sourceforge.net).
-        assert ts.tzinfo.zone == 'UTC'
-        k1 = datetime.datetime(ts.year, ts.month, ts.day, ts.hour, ts.minute,
-                                        tzinfo=ts.tzinfo)
-        msg['shipnames'] = shipnames = {}
-        msg['callsigns'] = callsigns = {}
-        msg['imos'] = imos = {}
-        msg['n_shipnames'] = n_shipnames = {}
-        msg['n_callsigns'] = n_callsigns = {}
-        msg['n_imos'] = n_imos = {}
-        def updatesum(orig, new):
-            for k, v in new.items():
-                orig[k] = orig.get(k, 0) + v
-        if k1 in self.cur_info:
-            for transponder_type in POSITION_TYPES.get(msg.get('type'), ()):
-                receiver_type = msg.get('receiver_type')
-                source = msg.get('source')
-                receiver = msg.get('receiver')
-                k2 = (transponder_type, receiver_type, source)
-                if k2 in self.cur_info[k1]:
-                    names, signs, nums, n_names, n_signs, n_nums = self.cur_info[k1][k2]
-                    updatesum(shipnames, names)
-                    updatesum(callsigns, signs)
-                    updatesum(imos, nums)
-                    updatesum(n_shipnames, n_names)
-                    updatesum(n_callsigns, n_signs)
-                    updatesum(n_imos, n_nums)
+        """
+        Annotate `msg` with the identity counts that apply to it.  These are
+        read only `FrozenDict()`s shared with the other messages in the same
+        minute, or `EMPTY` if there are none.
+        """
+        receiver_type = msg.get('receiver_type')
+        source = msg.get('source')
+        keys = tuple((transponder_type, receiver_type, source) for transponder_type 
+                        in POSITION_TYPES.get(msg.get('type'), ()))
+        (msg['shipnames'], msg['callsigns'], msg['imos'], msg['n_shipnames'],
+            msg['n_callsigns'], msg['n_imos']) = self.cur_info.merged_counts(
+                                                        self.msg_epoch(msg), keys)
+
+    def _duplicate_msgid(self, msgid, timestamp):
+        """
+        Check whether `msgid` has already been seen at or before the epoch
+        `timestamp`, remembering it if not.  Also forgets msgids and
+        locations older than `dedup_hours`.
+        """
+        if self.dedup_hours is not None:
+            self.cur_msgids.expire(timestamp)
+            self.cur_locations.expire(timestamp)
+        if msgid in self.prev_msgids or msgid in self.cur_msgids:
+            return True
+        self.cur_msgids[msgid] = timestamp
+        return False
+
+    def _duplicate_location(self, loc, speed, timestamp):
+        """
+        Check whether the normalized location `loc` has already been seen,
+        remembering it if not.
+        """
+        if speed > 0 and (loc in self.prev_locations or loc in self.cur_locations):
+            # Multiple identical locations with non-zero speed almost certainly bogus
+            return True
+        self.cur_locations[loc] = timestamp
+        return False
 
+    def _expire_info(self, timestamp):
+        """
+        Drop identity info that can no longer be applied to any message: every
+        message still to be annotated is either in an open segment or has not
+        been seen yet.
+        """
+        self._next_info_expiry = timestamp + self.cur_info.interval_mins * US_PER_MINUTE
+        oldest = timestamp
+        for segment in self._segments.values():
+            if len(segment):
+                # Messages that are no longer held have already been annotated
+                first = (int(segment.timestamps[0]) if self.columnar
+                            else self.msg_epoch(segment.msgs[0]))
+                oldest = min(oldest, first)
+        self.cur_info.expire(oldest)
 
     def process(self):
-        for msg in self.instream:
-            if 'type' not in msg:
-                raise ValueError("`msg` is missing required field `type`")
-
-            # Add empty info fields so they are always preset
-            msg['shipnames'] = {}
-            msg['callsigns'] = {}
-            msg['imos'] = {}
-
-            timestamp = msg.get('timestamp')
-            if timestamp is None:
-                raise ValueError("Message missing timestamp") 
-            if self._prev_timestamp is not None and timestamp < self._prev_timestamp:
-                raise ValueError("Input data is unsorted")
-            self._prev_timestamp = msg['timestamp']
-
-            msgid = msg.get('msgid')
-            if msgid in self.prev_msgids or msgid in self.cur_msgids:
-                continue
-            self.cur_msgids[msgid] = timestamp
+        if self.vectorize:
+            for batch in self._batches():
+                msg_types, locs = self._classify_batch(batch)
+                for msg, msg_type, loc in zip(batch, msg_types, locs):
+                    for x in self._process_msg(msg, msg_type, loc):
+                        yield x
+        else:
+            for msg in self.instream:
+                for x in self.process_msg(msg):
+                    yield x
+        for x in self.close_all():
+            yield x
 
-            ssvid = msg.get('ssvid')
-            if self.ssvid is None:
-                self._ssvid = ssvid
-            elif ssvid != self.ssvid:
-                logger.warning("Skipping non-matching SSVID %r, expected %r", ssvid, self.ssvid)
-                continue
+    def _batches(self):
+        instream = iter(self.instream)
+        while True:
+            batch = list(itertools.islice(instream, self.batch_size))
+            if not batch:
+                return
+            yield batch
 
+    def close_all(self, cls=Segment):
+        """
+        Finalize and remove all open segments, emitting them as `cls`.
+        """
+        for segment in list(self._segments.values()):
+            for x in self.clean(self._segments.pop(segment.id), cls):
+                yield x
+        del self._segment_heap[:]
 
-            x, y, course, speed, heading = self.extract_location(msg)
+    def process_msg(self, msg):
+        """
+        Process a single message, yielding any segments that are finalized 
+        as a result.  Messages must be passed in time order.  Call 
+        `close_all()` at the end of the stream to get the remaining 
+        open segments.
+        """
+        return self._process_msg(msg)
 
+    def _process_msg(self, msg, msg_type=None, loc=None):
+        """
+        `process_msg()` with the result of `_message_type()` and, for positional
+        messages, `normalize_location()` optionally precomputed.
+        """
+        if 'type' not in msg:
+            raise ValueError("`msg` is missing required field `type`")
+
+        # Add empty info fields so they are always preset
+        msg['shipnames'] = msg['callsigns'] = msg['imos'] = EMPTY
+
+        timestamp = msg.get('timestamp')
+        if timestamp is None:
+            raise ValueError("Message missing timestamp") 
+        # All internal time arithmetic is done on the epoch timestamp
+        epoch = epoch_microseconds(timestamp)
+        if self._prev_timestamp is not None and epoch < self._prev_timestamp:
+            raise ValueError("Input data is unsorted")
+        self._prev_timestamp = epoch
+        if self._next_info_expiry is None or epoch >= self._next_info_expiry:
+            self._expire_info(epoch)
+
+        if self._duplicate_msgid(msg.get('msgid'), epoch):
+            if self.stats is not None:
+                self.stats.messages[DUPLICATE] += 1
+            return
+
+        ssvid = msg.get('ssvid')
+        if self.ssvid is None:
+            self._ssvid = ssvid
+        elif ssvid != self.ssvid:
+            logger.warning("Skipping non-matching SSVID %r, expected %r", ssvid, self.ssvid)
+            if self.stats is not None:
+                self.stats.messages[SKIPPED] += 1
+            return
+
+
+        x, y, course, speed, heading = self.extract_location(msg)
 
+
+        if msg_type is None:
             msg_type = self._message_type(x, y, course, speed)
 
-            if msg_type is BAD_MESSAGE:
-                yield self._create_segment(msg, cls=BadSegment)
-                logger.debug(("Rejected bad message from ssvid: {ssvid!r} lat: {y!r}  lon: {x!r} "
-                              "timestamp: {timestamp!r} course: {course!r} speed: {speed!r}").format(**locals()))
-                continue
+        if msg_type is BAD_MESSAGE:
+            if self.stats is not None:
+                self.stats.messages[BAD] += 1
+            yield self._create_segment(msg, cls=BadSegment)
+            logger.debug(("Rejected bad message from ssvid: {ssvid!r} lat: {y!r}  lon: {x!r} "
+                          "timestamp: {timestamp!r} course: {course!r} speed: {speed!r}").format(**locals()))
+            return
 
-            # Type 19 messages, although rare, have both position and info, so 
-            # store any info in POSITION or INFO messages
-            self.store_info(self.cur_info, msg)
+        # Type 19 messages, although rare, have both position and info, so 
+        # store any info in POSITION or INFO messages
+        self.store_info(self.cur_info, msg)
 
-            if msg_type is INFO_MESSAGE:
-                yield self._create_segment(msg, cls=InfoSegment)
-                logger.debug("Skipping info message form ssvid: %s", msg['ssvid'])
-                continue
+        if msg_type is INFO_MESSAGE:
+            if self.stats is not None:
+                self.stats.messages[INFO] += 1
+            yield self._create_segment(msg, cls=InfoSegment)
+            logger.debug("Skipping info message form ssvid: %s", msg['ssvid'])
+            return
 
-            assert msg_type is POSITION_MESSAGE
+        assert msg_type is POSITION_MESSAGE
 
+        if loc is None:
             loc = self.normalize_location(x, y, course, speed, heading)
-            if speed > 0 and (loc in self.prev_locations or loc in self.cur_locations):
-                # Multiple identical locations with non-zero speed almost certainly bogus
-                continue
-            self.cur_locations[loc] = timestamp
+        if self._duplicate_location(loc, speed, epoch):
+            if self.stats is not None:
+                self.stats.messages[DUPLICATE] += 1
+            return
+        # Removed again when the message leaves the segmentizer
+        msg[EPOCH_FIELD] = epoch
+        msg[KINEMATICS_FIELD] = self.kinematics(x, y, course, speed)
 
-            if len(self._segments) == 0:
-                log("adding new segment because no current segments")
+        if len(self._segments) == 0:
+            log("adding new segment because no current segments")
+            for x in self._add_segment(msg):
+                yield x
+        else:
+            # Finalize and remove any segments that have not had a positional message in `max_hours`
+            for segment in self._expired_segments(msg):
+                for x in self.clean(segment, cls=ClosedSegment):
+                    yield x
+
+            best_match = self._compute_best(msg)
+            if best_match is NO_MATCH:
+                log("adding new segment because no match")
                 for x in self._add_segment(msg):
                     yield x
-            else:
-                # Finalize and remove any segments that have not had a positional message in `max_hours`
-                for segment in list(self._segments.values()):
-                    if (self.compute_msg_delta_hours(segment.last_msg, msg) > self.max_hours):
-                            for x in self.clean(self._segments.pop(segment.id), cls=ClosedSegment):
-                                yield x
-
-                best_match = self._compute_best(msg)
-                if best_match is NO_MATCH:
-                    log("adding new segment because no match")
-                    for x in self._add_segment(msg):
-                        yield x
-                elif best_match is IS_NOISE:
-                    yield self._create_segment(msg, cls=BadSegment)
-                elif isinstance(best_match, list):
-                    # This message could match multiple segments. 
-                    # So finalize and remove ambiguous segments so we can start fresh
-                    # TODO: once we are fully py3, this and similar can be cleaned up using `yield from`
-                    for match in best_match:
-                        for x in self.clean(self._segments.pop(match['seg_id']), cls=ClosedSegment):
-                            yield x
-                    # Then add as new segment.
-                    log("adding new segment because of ambiguity with {} segments".format(len(best_match)))
-                    for x in self._add_segment(msg):
+            elif best_match is IS_NOISE:
+                if self.stats is not None:
+                    self.stats.messages[NOISE] += 1
+                del msg[EPOCH_FIELD]
+                del msg[KINEMATICS_FIELD]
+                yield self._create_segment(msg, cls=BadSegment)
+            elif isinstance(best_match, list):
+                # This message could match multiple segments. 
+                # So finalize and remove ambiguous segments so we can start fresh
+                if self.stats is not None:
+                    self.stats.ambiguity_closures += len(best_match)
+                # TODO: once we are fully py3, this and similar can be cleaned up using `yield from`
+                for match in best_match:
+                    for x in self.clean(self._segments.pop(match['seg_id']), cls=ClosedSegment):
                         yield x
-                else:
-                    id_ = best_match['seg_id']
-                    for msg_to_drop in best_match['msgs_to_drop']:
-                        msg_to_drop['drop'] = True
-                    msg['metric'] = best_match['metric']
-                    self._segments[id_].add_msg(msg)
-
-
-        for series, segment in list(self._segments.items()):
-            for x in self.clean(self._segments.pop(segment.id), Segment):
-                yield x
-
+                # Then add as new segment.
+                log("adding new segment because of ambiguity with {} segments".format(len(best_match)))
+                for x in self._add_segment(msg):
+                    yield x
+            else:
+                id_ = best_match['seg_id']
+                segment = self._segments[id_]
+                for msg_to_drop in best_match['msgs_to_drop']:
+                    msg_to_drop['drop'] = True
+                    if self.provisional:
+                        segment.n_dropped += 1
+                        yield Retraction(self._published(msg_to_drop), id_)
+                msg['metric'] = best_match['metric']
+                segment.add_msg(msg)
+                if self.stats is not None:
+                    self.stats.messages[POSITION] += 1
+                if self.provisional:
+                    yield Assignment(self._published(msg), id_, best_match['metric'])
+                    n_stale = self._n_stale(segment, epoch)
+                    if n_stale:
+                        segment.trim(n_stale, self.lookback)
+                elif self.spill:
+                    n_stale = self._n_stale(segment, epoch, annotate=True)
+                    if n_stale:
+                        for x in segment.msgs[:n_stale]:
+                            self._finalize(x)
+                        if self._spill_file is None:
+                            self._spill_file = SpillFile(self.spill_dir)
+                        segment.spill(n_stale, self._spill_file, self.lookback)
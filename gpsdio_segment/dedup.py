@@ -0,0 +1,274 @@
+"""
+Structures used to detect duplicate messages.
+"""
+
+
+from __future__ import division, print_function
+from collections import OrderedDict
+import datetime
+import hashlib
+import io
+import math
+import mmap
+import os
+import struct
+
+from gpsdio_segment.discrepancy import epoch_microseconds
+
+
+# Two 64 bit hashes are taken from the md5 of each msgid
+_HASHES = struct.Struct('<QQ')
+
+
+class ExpiringDict(OrderedDict):
+
+    """
+    Map of keys to the timestamp they were last seen at that forgets keys
+    once they are more than `max_age` older than the stream.
+
+    Keys are kept in the order they were last set, which for a time sorted
+    stream is also timestamp order, so expired keys are always at the front
+    and each key is evicted in O(1).
+
+        >>> seen = ExpiringDict(datetime.timedelta(hours=24))
+        >>> seen[msgid] = msg['timestamp']
+        >>> seen.expire(msg['timestamp'])
+    """
+
+    def __init__(self, max_age=None, *args, **kwargs):
+
+        """
+        Parameters
+        ----------
+        max_age : datetime.timedelta or int, optional
+            Keys with timestamps older than this relative to the timestamp passed
+            to `expire()` are dropped, so an `int` for timestamps in epoch
+            microseconds.  If not given, keys are never dropped.
+        """
+        self.max_age = max_age
+        OrderedDict.__init__(self, *args, **kwargs)
+
+    def __setitem__(self, key, timestamp):
+        # Move updated keys to the end so the front is always the oldest.
+        # Without `max_age` the order does not matter.
+        if self.max_age is not None and key in self:
+            OrderedDict.__setitem__(self, key, timestamp)
+            self.move_to_end(key)
+        else:
+            OrderedDict.__setitem__(self, key, timestamp)
+
+    if not hasattr(OrderedDict, 'move_to_end'):  # pragma: no cover
+        # Python 2
+        def move_to_end(self, key):
+            timestamp = OrderedDict.pop(self, key)
+            OrderedDict.__setitem__(self, key, timestamp)
+
+    def __reduce__(self):
+        return self.__class__, (self.max_age, list(self.items()))
+
+    def copy(self):
+        return self.__class__(self.max_age, self)
+
+    def expire(self, timestamp):
+        """
+        Drop all keys last seen more than `max_age` before `timestamp`.
+        """
+        if self.max_age is None:
+            return
+        cutoff = timestamp - self.max_age
+        while self:
+            key = next(iter(self))
+            if OrderedDict.__getitem__(self, key) >= cutoff:
+                break
+            self.popitem(last=False)
+
+
+class MsgidFilter(object):
+
+    """
+    Compact, approximate set of msgids for detecting duplicates across runs,
+    to be passed as `prev_msgids`.
+
+    Msgids are stored in a Bloom filter per `partition_hours` of message
+    time, and partitions more than `max_age_hours` older than the newest one
+    are dropped, so memory stays constant however many runs the filter is
+    carried through.  Each partition is sized for `capacity` msgids, and as
+    long as that is not exceeded the chance that a msgid that was never added
+    is reported as present is at most `error_rate`.  Msgids that were added
+    are always reported as present until their partition expires.
+
+        >>> seen = MsgidFilter.load('msgids.bin') if exists else MsgidFilter()
+        >>> for seg in Segmentizer(msgs, prev_msgids=seen):
+        ...     seen.update((msg['msgid'], msg['timestamp']) for msg in seg)
+        >>> seen.save('msgids.bin')
+
+    Saved filters are memory mapped when loaded, so only the pages that are
+    actually read or modified are loaded into memory.
+    """
+
+    MAGIC = b'GSEGMSGID'
+    VERSION = 1
+
+    _HEADER = struct.Struct('<Bqqqqq')
+    _PARTITION = struct.Struct('<q')
+
+    def __init__(self, capacity=1000000, error_rate=0.001, partition_hours=24,
+                 max_age_hours=72):
+
+        """
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of msgids each partition is sized for.
+        error_rate : float, optional
+            False positive rate of the whole filter when no partition holds
+            more than `capacity` msgids.
+        partition_hours : float, optional
+            Span of message time covered by each partition.
+        max_age_hours : float, optional
+            Partitions that end more than this long before the start of the
+            newest partition are dropped.
+        """
+        n_partitions = int(math.ceil(max_age_hours / partition_hours)) + 1
+        # Every live partition is checked, so split the error between them
+        p = error_rate / n_partitions
+        n_bits = int(math.ceil(-capacity * math.log(p) / math.log(2) ** 2))
+        self._init(n_bytes=max(1, (n_bits + 7) // 8),
+                   n_hashes=max(1, int(round(n_bits / capacity * math.log(2)))),
+                   partition_us=int(partition_hours * 3600 * 1000000),
+                   max_age_us=int(max_age_hours * 3600 * 1000000))
+
+    def _init(self, n_bytes, n_hashes, partition_us, max_age_us):
+        self.n_bytes = n_bytes
+        self.n_hashes = n_hashes
+        self.partition_us = partition_us
+        self.max_age_us = max_age_us
+        self._n_bits = n_bytes * 8
+        # Partition index to bit array, oldest first
+        self._partitions = OrderedDict()
+        self._newest = None
+        self._mmap = None
+
+    def __len__(self):
+        """
+        Number of partitions.
+        """
+        return len(self._partitions)
+
+    def _positions(self, msgid):
+        if isinstance(msgid, bytes):
+            key = msgid
+        elif isinstance(msgid, type(u'')):
+            key = msgid.encode('utf-8')
+        else:
+            # Keep non-strings from colliding with their string form
+            key = b'\0' + repr(msgid).encode('utf-8')
+        h1, h2 = _HASHES.unpack(hashlib.md5(key).digest())
+        h2 |= 1
+        n_bits = self._n_bits
+        return [(h1 + i * h2) % n_bits for i in range(self.n_hashes)]
+
+    def __contains__(self, msgid):
+        positions = None
+        for bits in self._partitions.values():
+            if positions is None:
+                positions = self._positions(msgid)
+            for p in positions:
+                if not bits[p >> 3] & (1 << (p & 7)):
+                    break
+            else:
+                return True
+        return False
+
+    def add(self, msgid, timestamp):
+        """
+        Add `msgid` of a message sent at `timestamp`, which may be a
+        `datetime.datetime()` or epoch microseconds.  Msgids older than the
+        filter's window are ignored.
+        """
+        epoch = (epoch_microseconds(timestamp) if isinstance(timestamp, datetime.datetime)
+                    else timestamp)
+        index = epoch // self.partition_us
+        bits = self._partitions.get(index)
+        if bits is None:
+            if self._newest is not None and index < self._newest:
+                if self._expired(index, self._newest * self.partition_us):
+                    return
+            else:
+                self._newest = index
+            bits = self._partitions[index] = bytearray(self.n_bytes)
+            self._partitions = OrderedDict(sorted(self._partitions.items()))
+            self.expire(self._newest * self.partition_us)
+        for p in self._positions(msgid):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    def update(self, items):
+        """
+        `add()` each of an iterable of (msgid, timestamp) pairs.
+        """
+        for msgid, timestamp in items:
+            self.add(msgid, timestamp)
+
+    def _expired(self, index, epoch):
+        return (index + 1) * self.partition_us + self.max_age_us <= epoch
+
+    def expire(self, timestamp):
+        """
+        Drop partitions that end more than `max_age_hours` before `timestamp`,
+        which may be a `datetime.datetime()` or epoch microseconds.
+        """
+        epoch = (epoch_microseconds(timestamp) if isinstance(timestamp, datetime.datetime)
+                    else timestamp)
+        for index in list(self._partitions):
+            if not self._expired(index, epoch):
+                break
+            del self._partitions[index]
+
+    def save(self, path):
+        """
+        Write the filter to `path`, replacing it atomically.
+        """
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with io.open(tmp, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(self._HEADER.pack(self.VERSION, self.n_bytes, self.n_hashes,
+                                      self.partition_us, self.max_age_us,
+                                      len(self._partitions)))
+            for index, bits in self._partitions.items():
+                f.write(self._PARTITION.pack(index))
+                f.write(bits)
+        if os.name == 'nt':  # pragma: no cover
+            if os.path.exists(path):
+                os.remove(path)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory map a filter written by `save()`.  Changes are not written
+        back to `path` until `save()` is called.
+        """
+        with io.open(path, 'rb') as f:
+            # Copy on write, so the file is left untouched
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        offset = len(cls.MAGIC) + cls._HEADER.size
+        if len(data) < offset or data[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError("Not a msgid filter file: {}".format(path))
+        (version, n_bytes, n_hashes, partition_us, max_age_us,
+            n_partitions) = cls._HEADER.unpack_from(data, len(cls.MAGIC))
+        if version != cls.VERSION:
+            raise ValueError("Unsupported msgid filter version {}".format(version))
+        if len(data) != offset + n_partitions * (cls._PARTITION.size + n_bytes):
+            raise ValueError("Truncated msgid filter file: {}".format(path))
+        self = cls.__new__(cls)
+        self._init(n_bytes, n_hashes, partition_us, max_age_us)
+        self._mmap = data
+        view = memoryview(data)
+        for _ in range(n_partitions):
+            (index,) = cls._PARTITION.unpack_from(data, offset)
+            offset += cls._PARTITION.size
+            self._partitions[index] = view[offset:offset + n_bytes]
+            offset += n_bytes
+        if self._partitions:
+            self._newest = max(self._partitions)
+        return self
@@ -1,7 +1,88 @@
+from __future__ import division
+import datetime
 import math
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 inf = float("inf")
 
+# Messages being segmented carry their timestamp as epoch microseconds in
+# this field, so it is only converted from a `datetime.datetime()` once.
+EPOCH_FIELD = '_epoch_us'
+# Likewise for their `Kinematics()`
+KINEMATICS_FIELD = '_kinematics'
+
+DEG_LAT_PER_NM = 1.0 / 60
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def epoch_microseconds(ts):
+    """
+    Whole microseconds since 1970-01-01 UTC for a timezone aware or naive
+    `datetime.datetime()`.  Naive timestamps are taken to be UTC.
+    """
+    # `timedelta` arithmetic is exact and much faster than `utctimetuple()`
+    offset = ts.utcoffset()
+    if offset is not None:
+        ts = ts.replace(tzinfo=None) - offset
+    delta = ts - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def msg_epoch(msg):
+    """
+    Timestamp of `msg` in epoch microseconds, from `EPOCH_FIELD` if set.
+    """
+    us = msg.get(EPOCH_FIELD)
+    if us is None:
+        us = epoch_microseconds(msg['timestamp'])
+    return us
+
+
+def _wrap(x):
+    return (x + 180) % 360 - 180
+
+
+class Kinematics(object):
+
+    """
+    Quantities derived from the position, course and speed of a single message
+    that are needed when computing discrepancies.  They do not depend on the
+    message it is compared to, so they are computed once per message rather
+    than once per comparison.
+    """
+
+    __slots__ = ['lon', 'lat', 'speed', 'course_rads', 'cos_course', 'sin_course',
+                 'deg_lon_per_nm', 'expected_speed']
+
+    def __init__(self, lon, lat, course, speed):
+        epsilon = 1e-3
+        self.lon = lon
+        self.lat = lat
+        self.speed = speed
+        # Course is assumed to have `0` pointing north and positive
+        # is clockwise as is reported by AIS. This in contrast with
+        # the natural math based definition which has 0 pointing east
+        # and positive being counter-clockwise, so we switch to that
+        # here.
+        self.course_rads = math.radians(90.0 - course)
+        self.cos_course = math.cos(self.course_rads)
+        self.sin_course = math.sin(self.course_rads)
+        self.deg_lon_per_nm = DEG_LAT_PER_NM / (math.cos(math.radians(lat)) + epsilon)
+        # The heading is unknown, see `DiscrepancyCalculator.very_slow`
+        self.expected_speed = 0 if (course > 359.95) else speed
+
+    def expected_position(self, hours):
+        # Speed is in knots, so `dist` is in nautical miles (nm)
+        dist = self.expected_speed * hours 
+        dx = self.cos_course * dist * self.deg_lon_per_nm
+        dy = self.sin_course * dist * DEG_LAT_PER_NM
+        return self.lon + dx, self.lat + dy
+
 
 class DiscrepancyCalculator(object):
     """Base class that supplies discrepancy calculator"""
@@ -35,35 +116,40 @@ class DiscrepancyCalculator(object):
     def compute_ts_delta_hours(ts1, ts2):
         return (ts2 - ts1).total_seconds() / 3600
 
+    @staticmethod
+    def compute_epoch_delta_hours(us1, us2):
+        # `timedelta.total_seconds()` also divides whole microseconds by 10 ** 6,
+        # so this rounds exactly the same as `compute_ts_delta_hours()`.
+        return (us2 - us1) / 1000000 / 3600
+
+    msg_epoch = staticmethod(msg_epoch)
+
     @staticmethod
     def compute_msg_delta_hours(msg1, msg2):
-        ts1 = msg1['timestamp']
-        ts2 = msg2['timestamp']
-        return DiscrepancyCalculator.compute_ts_delta_hours(ts1, ts2)
+        return DiscrepancyCalculator.compute_epoch_delta_hours(
+                    DiscrepancyCalculator.msg_epoch(msg1), 
+                    DiscrepancyCalculator.msg_epoch(msg2))
 
     @classmethod
-    def _compute_expected_position(cls, msg, hours):
-        epsilon = 1e-3
-        x = msg['lon']
-        y = msg['lat']
-        speed = msg['speed']
-        course = msg['course']
+    def kinematics(cls, lon, lat, course, speed):
         if course > 359.95:
             assert speed <= cls.very_slow, (course, speed)
-            speed = 0
-        # Speed is in knots, so `dist` is in nautical miles (nm)
-        dist = speed * hours 
-        # Course is assumed to have `0` pointing north and positive
-        # is clockwise as is reported by AIS. This in contrast with
-        # the natural math based definition which has 0 pointing east
-        # and positive being counter-clockwise, so we switch to that
-        # here.
-        course = math.radians(90.0 - course)
-        deg_lat_per_nm = 1.0 / 60
-        deg_lon_per_nm = deg_lat_per_nm / (math.cos(math.radians(y)) + epsilon)
-        dx = math.cos(course) * dist * deg_lon_per_nm
-        dy = math.sin(course) * dist * deg_lat_per_nm
-        return x + dx, y + dy
+        return Kinematics(lon, lat, course, speed)
+
+    @classmethod
+    def msg_kinematics(cls, msg):
+        """
+        `Kinematics()` of `msg`, from `KINEMATICS_FIELD` if set.
+        """
+        kinematics = msg.get(KINEMATICS_FIELD)
+        if kinematics is None:
+            kinematics = cls.kinematics(msg['lon'], msg['lat'], 
+                                        msg['course'], msg['speed'])
+        return kinematics
+
+    @classmethod
+    def _compute_expected_position(cls, msg, hours):
+        return cls.msg_kinematics(msg).expected_position(hours)
 
     def compute_discrepancy(self, msg1, msg2, hours=None):
 
@@ -88,48 +174,166 @@ class DiscrepancyCalculator(object):
         y2 = msg2.get('lat')
 
         if (x2 is None or y2 is None):
-            distance = None
-            speed = None
-            discrepancy = None
+            return None
+        return self.compute_kinematic_discrepancy(self.msg_kinematics(msg1), 
+                                                  self.msg_kinematics(msg2), hours)
+
+    def compute_kinematic_discrepancy(self, k1, k2, hours):
+
+        """
+        Same as `compute_discrepancy()`, but for the `Kinematics()` of the two
+        messages.  `hours` is required.
+
+        Returns
+        -------
+        float
+        """
+        x1 = k1.lon
+        y1 = k1.lat
+        x2 = k2.lon
+        y2 = k2.lat
+        x2p, y2p = k1.expected_position(hours)
+        x1p, y1p = k2.expected_position(-hours)
+
+        nm_per_deg_lat = 60.0
+        y = 0.5 * (y1 + y2)
+        nm_per_deg_lon = nm_per_deg_lat  * math.cos(math.radians(y))
+        discrepancy1 = 0.5 * (
+            math.hypot(nm_per_deg_lon * _wrap(x1p - x1) , 
+                       nm_per_deg_lat * (y1p - y1)) + 
+            math.hypot(nm_per_deg_lon * _wrap(x2p - x2) , 
+                       nm_per_deg_lat * (y2p - y2)))
+
+        # Vessel just stayed put
+        dist = math.hypot(nm_per_deg_lat * (y2 - y1), 
+                          nm_per_deg_lon * _wrap(x2 - x1))
+        discrepancy2 = dist * self.shape_factor
+
+        # Distance perp to line
+        rads21 = math.atan2(nm_per_deg_lat * (y2 - y1), 
+                            nm_per_deg_lon * _wrap(x2 - x1))
+        delta21 = k1.course_rads - rads21
+        tangential21 = math.cos(delta21) * dist
+        if 0 < tangential21 <= k1.speed * hours:
+            normal21 = abs(math.sin(delta21)) * dist
         else:
-            x2p, y2p = self._compute_expected_position(msg1, hours)
-            x1p, y1p = self._compute_expected_position(msg2, -hours)
-
-            def wrap(x):
-                return (x + 180) % 360 - 180
-
-            nm_per_deg_lat = 60.0
-            y = 0.5 * (y1 + y2)
-            epsilon = 1e-3
-            nm_per_deg_lon = nm_per_deg_lat  * math.cos(math.radians(y))
-            discrepancy1 = 0.5 * (
-                math.hypot(nm_per_deg_lon * wrap(x1p - x1) , 
-                           nm_per_deg_lat * (y1p - y1)) + 
-                math.hypot(nm_per_deg_lon * wrap(x2p - x2) , 
-                           nm_per_deg_lat * (y2p - y2)))
-
-            # Vessel just stayed put
-            dist = math.hypot(nm_per_deg_lat * (y2 - y1), 
-                              nm_per_deg_lon * wrap(x2 - x1))
-            discrepancy2 = dist * self.shape_factor
-
-            # Distance perp to line
-            rads21 = math.atan2(nm_per_deg_lat * (y2 - y1), 
-                                nm_per_deg_lon * wrap(x2 - x1))
-            delta21 = math.radians(90 - msg1['course']) - rads21
-            tangential21 = math.cos(delta21) * dist
-            if 0 < tangential21 <= msg1['speed'] * hours:
-                normal21 = abs(math.sin(delta21)) * dist
-            else:
-                normal21 = inf
-            delta12 = math.radians(90 - msg2['course']) - rads21 
-            tangential12 = math.cos(delta12) * dist
-            if 0 < tangential12 <= msg2['speed'] * hours:
-                normal12 = abs(math.sin(delta12)) * dist
-            else:
-                normal12 = inf
-            discrepancy3 = 0.5 * (normal12 + normal21) * self.shape_factor
-
-            discrepancy = min(discrepancy1, discrepancy2, discrepancy3)
-
-        return discrepancy
\ No newline at end of file
+            normal21 = inf
+        delta12 = k2.course_rads - rads21 
+        tangential12 = math.cos(delta12) * dist
+        if 0 < tangential12 <= k2.speed * hours:
+            normal12 = abs(math.sin(delta12)) * dist
+        else:
+            normal12 = inf
+        discrepancy3 = 0.5 * (normal12 + normal21) * self.shape_factor
+
+        return min(discrepancy1, discrepancy2, discrepancy3)
+
+    def kinematic_discrepancy_exceeds(self, k1, k2, hours, limit):
+
+        """
+        Whether `compute_kinematic_discrepancy()` is certain to be greater
+        than `limit`, from a lower bound that only needs the distance between
+        the two positions, so is much cheaper.  The bound is only useful when
+        the positions are farther apart than either vessel could have
+        travelled in `hours`, and is `False` otherwise.
+
+        Returns
+        -------
+        bool
+        """
+        nm_per_deg_lat = 60.0
+        dy = k2.lat - k1.lat
+        dx = (k2.lon - k1.lon + 180) % 360 - 180
+        # Most pairs are close, so check against an upper bound of the
+        # distance before computing it
+        if nm_per_deg_lat * (abs(dx) + abs(dy)) <= limit:
+            return False
+        cos_y = math.cos(math.radians(0.5 * (k1.lat + k2.lat)))
+        dist = math.hypot(nm_per_deg_lat * dy, nm_per_deg_lat * cos_y * dx)
+        # Stayed put
+        if dist * self.shape_factor <= limit or dist <= limit:
+            return False
+        # Each expected position is at most this far from the actual one when
+        # measured at the mean latitude, so by the triangle inequality
+        scale = nm_per_deg_lat * cos_y
+        reach = (k1.expected_speed * max(1.0, scale * k1.deg_lon_per_nm) + 
+                 k2.expected_speed * max(1.0, scale * k2.deg_lon_per_nm))
+        if dist - 0.5 * hours * reach <= limit:
+            return False
+        # The tangential distance is at most speed * hours when the normal
+        # distance is used
+        dist2 = dist * dist
+        normal21 = dist2 - (k1.speed * hours) ** 2
+        normal12 = dist2 - (k2.speed * hours) ** 2
+        normal21 = math.sqrt(normal21) if normal21 > 0 else 0.0
+        normal12 = math.sqrt(normal12) if normal12 > 0 else 0.0
+        return 0.5 * (normal12 + normal21) * self.shape_factor > limit
+
+    def compute_kinematic_discrepancies(self, k1s, k2, hours):
+
+        """
+        Vectorized version of `compute_kinematic_discrepancy()` that compares
+        the `Kinematics()` of many previous messages against those of a
+        single new message at once.
+
+        Parameters
+        ----------
+        k1s : list of Kinematics
+            Kinematics of the previous messages.
+        k2 : Kinematics
+            Kinematics of the new message.
+        hours : numpy.ndarray
+            Hours between each previous message and the new one.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        if np is None:
+            raise ImportError("numpy is required to compute discrepancies in bulk")
+        (lon1, lat1, speed1, course_rads1, cos_course1, sin_course1, 
+         deg_lon_per_nm1, expected_speed1) = np.array(
+            [(k.lon, k.lat, k.speed, k.course_rads, k.cos_course, k.sin_course, 
+              k.deg_lon_per_nm, k.expected_speed) for k in k1s]).T
+        x2 = k2.lon
+        y2 = k2.lat
+
+        # `Kinematics.expected_position()` of each message
+        dist = expected_speed1 * hours
+        x2p = lon1 + cos_course1 * dist * deg_lon_per_nm1
+        y2p = lat1 + sin_course1 * dist * DEG_LAT_PER_NM
+        dist = k2.expected_speed * -hours
+        x1p = x2 + k2.cos_course * dist * k2.deg_lon_per_nm
+        y1p = y2 + k2.sin_course * dist * DEG_LAT_PER_NM
+
+        def wrap(x):
+            return (x + 180) % 360 - 180
+
+        nm_per_deg_lat = 60.0
+        y = 0.5 * (lat1 + y2)
+        nm_per_deg_lon = nm_per_deg_lat  * np.cos(np.radians(y))
+        discrepancy1 = 0.5 * (
+            np.hypot(nm_per_deg_lon * wrap(x1p - lon1), 
+                     nm_per_deg_lat * (y1p - lat1)) + 
+            np.hypot(nm_per_deg_lon * wrap(x2p - x2), 
+                     nm_per_deg_lat * (y2p - y2)))
+
+        # Vessel just stayed put
+        dist = np.hypot(nm_per_deg_lat * (y2 - lat1), 
+                        nm_per_deg_lon * wrap(x2 - lon1))
+        discrepancy2 = dist * self.shape_factor
+
+        # Distance perp to line
+        rads21 = np.arctan2(nm_per_deg_lat * (y2 - lat1), 
+                            nm_per_deg_lon * wrap(x2 - lon1))
+        delta21 = course_rads1 - rads21
+        tangential21 = np.cos(delta21) * dist
+        normal21 = np.where((0 < tangential21) & (tangential21 <= speed1 * hours),
+                            np.abs(np.sin(delta21)) * dist, inf)
+        delta12 = k2.course_rads - rads21 
+        tangential12 = np.cos(delta12) * dist
+        normal12 = np.where((0 < tangential12) & (tangential12 <= k2.speed * hours),
+                            np.abs(np.sin(delta12)) * dist, inf)
+        discrepancy3 = 0.5 * (normal12 + normal21) * self.shape_factor
+
+        return np.minimum(np.minimum(discrepancy1, discrepancy2), discrepancy3)
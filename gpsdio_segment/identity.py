@@ -0,0 +1,190 @@
+"""
+Index of identity information (shipname, callsign, imo) seen in messages.
+"""
+
+
+from __future__ import division, print_function
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
+
+from gpsdio_segment.discrepancy import epoch_microseconds
+
+
+US_PER_MINUTE = 60 * 1000000
+
+
+class FrozenDict(dict):
+
+    """
+    A `dict` that can not be modified, so that one instance can be shared
+    by the identity fields of many messages.  Use `copy()` to get a regular
+    `dict`.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("{} is read only".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def copy(self):
+        return dict(self)
+
+
+# Shared by all messages without identity info
+EMPTY = FrozenDict()
+EMPTY_COUNTS = (EMPTY,) * 6
+
+
+class IdentityIndex(object):
+
+    """
+    Counts of identity values bucketed by minute and by key, typically
+    `(transponder_type, receiver_type, source)`.
+
+    Each observation is stored once, in the bucket for the minute it was
+    seen in.  Lookups sum all buckets within `interval_mins` of the requested
+    minute, so an identity message applies to positions up to
+    `interval_mins` before or after it.  Timestamps are given in epoch
+    microseconds and minutes are whole minutes since the epoch.
+
+    The merged counts for a minute and set of keys are cached until an
+    observation is added within `interval_mins` of that minute, so messages
+    in the same minute share them.
+    """
+
+    def __init__(self, interval_mins, legacy=None):
+
+        """
+        Parameters
+        ----------
+        interval_mins : int
+            Identity messages apply to positions up to this many minutes away.
+        legacy : dict, optional
+            Identity info in the format produced by passing a `dict` to
+            `Segmentizer.store_info()`, where each observation has already
+            been added to every minute within `interval_mins`.  These are
+            only looked up by exact minute.
+        """
+        self.interval_mins = interval_mins
+        self.legacy = {}
+        for ts, bucket in (legacy or {}).items():
+            self.legacy[epoch_microseconds(ts) // US_PER_MINUTE] = bucket
+        self._buckets = {}
+        self._minutes = []
+        # Minute to keys to merged counts
+        self._merged = {}
+
+    def __len__(self):
+        return len(self._buckets) + len(self.legacy)
+
+    def copy(self):
+        other = self.__class__(self.interval_mins)
+        other.legacy = self.legacy.copy()
+        for minute, bucket in self._buckets.items():
+            other._buckets[minute] = {k: tuple(x.copy() for x in v)
+                                            for (k, v) in bucket.items()}
+        other._minutes = self._minutes[:]
+        return other
+
+    def add(self, timestamp, key, shipname, callsign, imo,
+                  n_shipname, n_callsign, n_imo):
+        """
+        Record an observation at `timestamp` in epoch microseconds.  `None`
+        values are not counted.
+        """
+        minute = timestamp // US_PER_MINUTE
+        bucket = self._buckets.get(minute)
+        if bucket is None:
+            self._buckets[minute] = bucket = {}
+            if not self._minutes or minute > self._minutes[-1]:
+                self._minutes.append(minute)
+            else:
+                insort(self._minutes, minute)
+        for m in range(minute - self.interval_mins, minute + self.interval_mins + 1):
+            self._merged.pop(m, None)
+        if key not in bucket:
+            bucket[key] = ({}, {}, {}, {}, {}, {})
+        shipnames, callsigns, imos, n_shipnames, n_callsigns, n_imos = bucket[key]
+        if shipname is not None:
+            shipnames[shipname] = shipnames.get(shipname, 0) + 1
+            n_shipnames[n_shipname] = n_shipnames.get(n_shipname, 0) + 1
+        if callsign is not None:
+            callsigns[callsign] = callsigns.get(callsign, 0) + 1
+            n_callsigns[n_callsign] = n_callsigns.get(n_callsign, 0) + 1
+        if imo is not None:
+            imos[imo] = imos.get(imo, 0) + 1
+            n_imos[n_imo] = n_imos.get(n_imo, 0) + 1
+
+    def counts(self, timestamp, keys):
+        """
+        Yield the `(shipnames, callsigns, imos, n_shipnames, n_callsigns, n_imos)`
+        counts for each of `keys` that apply to `timestamp` in epoch
+        microseconds.  The counts must not be modified.
+        """
+        minute = timestamp // US_PER_MINUTE
+        if self._minutes:
+            start = bisect_left(self._minutes, minute - self.interval_mins)
+            stop = bisect_right(self._minutes, minute + self.interval_mins)
+            for m in self._minutes[start:stop]:
+                bucket = self._buckets[m]
+                for key in keys:
+                    if key in bucket:
+                        yield bucket[key]
+        if self.legacy and minute in self.legacy:
+            bucket = self.legacy[minute]
+            for key in keys:
+                if key in bucket:
+                    yield bucket[key]
+
+    def merged_counts(self, timestamp, keys):
+        """
+        The sum of `counts()` for `timestamp` and the tuple `keys`, as
+        `FrozenDict()`s that may be shared with other callers.  Counts that
+        are empty are `EMPTY`.
+        """
+        minute = timestamp // US_PER_MINUTE
+        cached = self._merged.get(minute)
+        if cached is None:
+            cached = self._merged[minute] = {}
+        else:
+            merged = cached.get(keys)
+            if merged is not None:
+                return merged
+        totals = None
+        for counts in self.counts(timestamp, keys):
+            if totals is None:
+                totals = ({}, {}, {}, {}, {}, {})
+            for total, new in zip(totals, counts):
+                for k, v in new.items():
+                    total[k] = total.get(k, 0) + v
+        if totals is None:
+            merged = EMPTY_COUNTS
+        else:
+            merged = tuple(FrozenDict(x) if x else EMPTY for x in totals)
+        cached[keys] = merged
+        return merged
+
+    def expire(self, timestamp):
+        """
+        Drop observations that no longer apply to anything at or after
+        `timestamp` in epoch microseconds.
+        """
+        cutoff = timestamp // US_PER_MINUTE - self.interval_mins
+        stop = bisect_left(self._minutes, cutoff)
+        if stop:
+            for minute in self._minutes[:stop]:
+                del self._buckets[minute]
+            del self._minutes[:stop]
+        if self.legacy:
+            for minute in [x for x in self.legacy if x < cutoff]:
+                del self.legacy[minute]
+        # Nothing before `timestamp` will be looked up again
+        for minute in [x for x in self._merged if x < cutoff + self.interval_mins]:
+            del self._merged[minute]
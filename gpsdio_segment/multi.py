@@ -0,0 +1,201 @@
+"""
+Segment a time sorted stream that contains messages from many vessels.
+
+`Segmentizer()` only handles a single ssvid, so interleaved streams have to
+be split up by ssvid and read once per vessel.  `MultiSegmentizer()` instead
+routes each message to a per-ssvid `Segmentizer()` in a single pass over
+the stream.  Per-ssvid state is created when a vessel is first seen and
+released once the vessel has been silent for longer than `max_hours`, so
+memory scales with the number of active vessels rather than the total number
+of vessels in the stream.  Only the msgids and locations used to detect
+duplicates are kept for released vessels, until they are older than
+`dedup_hours` or, by default, for `max_hours` after the release.
+"""
+
+
+from __future__ import division, print_function
+from collections import OrderedDict
+import logging
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.discrepancy import epoch_microseconds
+from gpsdio_segment.identity import US_PER_MINUTE
+from gpsdio_segment.segment import ClosedSegment
+
+
+logging.basicConfig()
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.WARNING)
+
+
+class MultiSegmentizer(object):
+
+    """
+    Demultiplex a stream of messages from many ssvid into per-ssvid
+    `Segmentizer()` instances and yield the segments of all vessels.
+
+        >>> from gpsdio_segment import MultiSegmentizer
+        >>> for segment in MultiSegmentizer(src):
+        ...     for msg in segment:
+        ...         dst.write(msg)
+    """
+
+    segmentizer_class = Segmentizer
+
+    def __init__(self, instream, seg_states=None, prev_msgids=None,
+                 prev_locations=None, prev_info=None, **kwargs):
+
+        """
+        Parameters
+        ----------
+        instream : iter
+            Stream of GPSd messages from any number of ssvid sorted by timestamp.
+        seg_states : iter, optional
+            `SegmentState()`s or dicts from a previous run for any number of ssvid.
+            These are passed to `Segmentizer.from_seg_states()` when an ssvid is
+            first seen.
+        prev_msgids : set or MsgidFilter, optional
+            Messages with msgids in this set are skipped as duplicates.  Shared
+            between all ssvid.
+        prev_locations : dict, optional
+            Map of ssvid to the `prev_locations` set for that ssvid.
+        prev_info : dict, optional
+            Map of ssvid to the `prev_info` for that ssvid.
+        **kwargs
+            Passed on to each `Segmentizer()`.  `dedup_hours` also sets how
+            long the msgids and locations of vessels that have been released
+            are kept.  Without it they are kept for `max_hours` after the
+            release.
+
+        Notes
+        -----
+        The segments of a vessel that has been silent for more than `max_hours`
+        are emitted as `ClosedSegment()`s as soon as that is known, and the
+        vessel's `Segmentizer()` is released.  This is what `Segmentizer()`
+        would do on the vessel's next positional message, except that if the
+        vessel never reappears, `Segmentizer()` would instead emit them as
+        open `Segment()`s at the end of the stream.  The msgids and locations
+        the vessel has sent are kept and handed to its next `Segmentizer()`,
+        so duplicates are skipped just as `Segmentizer()` would, as long as
+        they have not expired.  Without `dedup_hours`, `Segmentizer()` never
+        forgets them, but here duplicates of a vessel that reappears more than
+        `max_hours` after its release are segmented again so that memory
+        stays bounded.
+        """
+        self._instream = instream
+        self._seg_states = {}
+        for state in (seg_states or ()):
+            ssvid = state['ssvid'] if isinstance(state, dict) else state.ssvid
+            self._seg_states.setdefault(ssvid, []).append(state)
+        self.prev_msgids = prev_msgids if prev_msgids else set()
+        self.prev_locations = prev_locations if prev_locations else {}
+        self.prev_info = prev_info if prev_info else {}
+        self.kwargs = kwargs
+        self.max_hours = kwargs.get('max_hours', self.segmentizer_class.max_hours)
+
+        # Active segmentizers, least recently used first
+        self._segmentizers = OrderedDict()
+        # `(expires, cur_msgids, cur_locations)` of released ssvid in the
+        # order they were released
+        self._released = OrderedDict()
+        self._prev_timestamp = None
+
+    def __repr__(self):
+        return "<{cname}() with {n} active ssvid at {id_}>".format(
+            cname=self.__class__.__name__, n=len(self._segmentizers), id_=hash(self))
+
+    def __iter__(self):
+        return self.process()
+
+    @property
+    def instream(self):
+        return self._instream
+
+    @property
+    def active_ssvids(self):
+        return list(self._segmentizers)
+
+    def _create_segmentizer(self, ssvid):
+        kwargs = dict(self.kwargs,
+                      ssvid=ssvid,
+                      prev_msgids=self.prev_msgids,
+                      prev_locations=self.prev_locations.get(ssvid),
+                      prev_info=self.prev_info.get(ssvid))
+        seg_states = self._seg_states.pop(ssvid, None)
+        if seg_states:
+            segmentizer = self.segmentizer_class.from_seg_states(seg_states, None, **kwargs)
+        else:
+            segmentizer = self.segmentizer_class(None, **kwargs)
+        released = self._released.pop(ssvid, None)
+        if released is not None:
+            _, segmentizer.cur_msgids, segmentizer.cur_locations = released
+        return segmentizer
+
+    def _release_dedup(self, ssvid, segmentizer, timestamp):
+        # Everything in the tables expires `dedup_hours` after the last
+        # message, otherwise they are kept for `max_hours` after the release
+        if segmentizer.dedup_hours is not None:
+            expires = segmentizer._prev_timestamp + segmentizer.cur_msgids.max_age
+        else:
+            expires = timestamp + int(self.max_hours * 60 * US_PER_MINUTE)
+        self._released[ssvid] = (expires, segmentizer.cur_msgids,
+                                 segmentizer.cur_locations)
+
+    def _expire_released(self, timestamp):
+        # Released in order of their last message, so expire in that order too
+        while self._released:
+            expires = next(iter(self._released.values()))[0]
+            if expires >= timestamp:
+                break
+            self._released.popitem(last=False)
+
+    def _release_idle(self, timestamp):
+        # Segmentizers are ordered by the time of their last message, so
+        # only the ones at the front need to be checked.
+        while self._segmentizers:
+            ssvid = next(iter(self._segmentizers))
+            segmentizer = self._segmentizers[ssvid]
+            # Segmentizers track time as epoch microseconds
+            last_timestamp = segmentizer._prev_timestamp
+            if (segmentizer.compute_epoch_delta_hours(last_timestamp, timestamp)
+                    <= self.max_hours):
+                break
+            logger.debug("Releasing idle ssvid %r", ssvid)
+            del self._segmentizers[ssvid]
+            self._release_dedup(ssvid, segmentizer, timestamp)
+            for x in segmentizer.close_all(cls=ClosedSegment):
+                yield x
+
+    def process(self):
+        for msg in self.instream:
+            timestamp = msg.get('timestamp')
+            if timestamp is None:
+                raise ValueError("Message missing timestamp")
+            if self._prev_timestamp is not None and timestamp < self._prev_timestamp:
+                raise ValueError("Input data is unsorted")
+            self._prev_timestamp = timestamp
+
+            epoch = epoch_microseconds(timestamp)
+            self._expire_released(epoch)
+            for x in self._release_idle(epoch):
+                yield x
+
+            ssvid = msg.get('ssvid')
+            segmentizer = self._segmentizers.pop(ssvid, None)
+            if segmentizer is None:
+                segmentizer = self._create_segmentizer(ssvid)
+            # (Re)insert at the end to keep the least recently used first
+            self._segmentizers[ssvid] = segmentizer
+
+            for x in segmentizer.process_msg(msg):
+                yield x
+
+        while self._segmentizers:
+            _, segmentizer = self._segmentizers.popitem(last=False)
+            for x in segmentizer.close_all():
+                yield x
+
+        # Vessels with state from a previous run that did not show up in this one
+        for ssvid in list(self._seg_states):
+            for x in self._create_segmentizer(ssvid).close_all():
+                yield x
@@ -0,0 +1,96 @@
+"""
+Segment many ssvid in parallel using a pool of processes.
+
+Segmentation of one ssvid does not depend on any other, so the messages of
+each ssvid are segmented by an independent `Segmentizer()` in a worker
+process.  The largest inputs are started first so that a single large
+ssvid does not end up running alone at the end, and idle workers pick up
+the next pending ssvid as soon as they finish their current one.  Results
+are yielded in input order, so the output is deterministic and identical to
+running a `Segmentizer()` over each input in turn.
+"""
+
+
+from __future__ import division, print_function
+from concurrent.futures import ProcessPoolExecutor
+
+from gpsdio_segment.core import Segmentizer
+
+
+def _segment_one(msgs, seg_states, kwargs):
+    if seg_states:
+        segmentizer = Segmentizer.from_seg_states(seg_states, msgs, **kwargs)
+    else:
+        segmentizer = Segmentizer(msgs, **kwargs)
+    return list(segmentizer)
+
+
+def segment_parallel(inputs, seg_states=None, prev_locations=None, prev_info=None,
+                     max_workers=None, **kwargs):
+
+    """
+    Segment the messages of many ssvid in parallel.
+
+        >>> from gpsdio_segment import segment_parallel
+        >>> for ssvid, segments in segment_parallel(msgs_by_ssvid):
+        ...     for seg in segments:
+        ...         for msg in seg:
+        ...             dst.write(msg)
+
+    Parameters
+    ----------
+    inputs : dict or iter
+        Map of ssvid to a sequence of messages for that ssvid or an iterable
+        of `(ssvid, msgs)` pairs.  Each sequence must support `len()`.
+    seg_states : dict, optional
+        Map of ssvid to a list of `SegmentState()`s as passed to
+        `Segmentizer.from_seg_states()`.  ssvid that only have states are
+        processed with no messages so that their open segments are emitted.
+    prev_locations : dict, optional
+        Map of ssvid to the `prev_locations` set for that ssvid.
+    prev_info : dict, optional
+        Map of ssvid to the `prev_info` for that ssvid.
+    max_workers : int, optional
+        Number of processes to use.  Defaults to the number of CPUs.  If
+        `1`, everything is run in the current process.
+    **kwargs
+        Passed on to each `Segmentizer()`.
+
+    Yields
+    ------
+    tuple
+        `(ssvid, segments)` in the order of `inputs`, where `segments` is
+        the list of segments that `Segmentizer()` produces for that ssvid.
+    """
+    seg_states = seg_states or {}
+    prev_locations = prev_locations or {}
+    prev_info = prev_info or {}
+
+    items = list(inputs.items() if hasattr(inputs, 'items') else inputs)
+    seen = {ssvid for (ssvid, _) in items}
+    items.extend((ssvid, []) for ssvid in seg_states if ssvid not in seen)
+
+    def job(ssvid, msgs):
+        ssvid_kwargs = dict(kwargs,
+                            prev_locations=prev_locations.get(ssvid),
+                            prev_info=prev_info.get(ssvid))
+        return msgs, seg_states.get(ssvid), ssvid_kwargs
+
+    if max_workers == 1:
+        for ssvid, msgs in items:
+            yield ssvid, _segment_one(*job(ssvid, msgs))
+        return
+
+    # Largest first, so that short jobs fill in the gaps at the end
+    order = sorted(range(len(items)), key=lambda i: len(items[i][1]), reverse=True)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i in order:
+            futures[i] = executor.submit(_segment_one, *job(*items[i]))
+        try:
+            for i, (ssvid, _) in enumerate(items):
+                yield ssvid, futures.pop(i).result()
+        finally:
+            # Don't start any more work if the caller stops early
+            for future in futures.values():
+                future.cancel()
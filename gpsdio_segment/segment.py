@@ -1,8 +1,16 @@
 from __future__ import print_function, division
 
+from array import array
 from collections import namedtuple
+import itertools
 import logging
 
+from gpsdio_segment.discrepancy import EPOCH_FIELD
+from gpsdio_segment.discrepancy import KINEMATICS_FIELD
+from gpsdio_segment.discrepancy import Kinematics
+from gpsdio_segment.discrepancy import msg_epoch
+from gpsdio_segment.spill import SpillLog
+
 logging.basicConfig()
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.INFO)
@@ -13,6 +21,12 @@ SegmentState = namedtuple('SegmentState',
      'first_msg', 'last_msg', 'first_msg_of_day',  'last_msg_of_day', 
      'msg_count', 'noise', 'closed'])
 
+# Events emitted by `Segmentizer(provisional=True)`.  `msg` is a copy of the
+# message as it would be emitted in a segment.  `metric` is `None` for the
+# first message of a segment.
+Assignment = namedtuple('Assignment', ['msg', 'seg_id', 'metric'])
+Retraction = namedtuple('Retraction', ['msg', 'seg_id'])
+
 
 class Segment(object):
 
@@ -24,6 +38,7 @@ class Segment(object):
 
     noise = False # This isn't a 'real' segment, so it isn't written to a table
     closed = False # No more segments should be written to this segment
+    n_removed = 0 # Messages that are no longer held, see `TrimmedSegment()`
 
     def __init__(self, id, ssvid):
 
@@ -103,15 +118,21 @@ class Segment(object):
 
     @property
     def msg_count(self):
-        n = len(self.msgs)
+        n = len(self)
         if self.prev_state:
             n += self.prev_state.msg_count
         return n
 
     def get_all_reversed_msgs(self):
+        """
+        Yield the messages that have not been dropped, newest first, followed
+        by those carried over from the previous state.  Messages are read
+        lazily from the end, so taking the first few costs the same no matter
+        how long the segment is.
+        """
         source = self
         while source is not None:
-            for msg in source.msgs[::-1]:
+            for msg in reversed(source.msgs):
                 if not msg.get('drop', False):
                     yield msg
             source = source.prev_segment
@@ -132,6 +153,14 @@ class Segment(object):
             return self.prev_state.last_msg
         return None
 
+    @property
+    def last_epoch(self):
+        """
+        Timestamp of `last_msg` in epoch microseconds, or `None`.
+        """
+        msg = self.last_msg
+        return None if (msg is None) else msg_epoch(msg)
+
     @property
     def first_msg_of_day(self):
         if self.msgs:
@@ -151,6 +180,391 @@ class Segment(object):
 
 
 
+class ColumnarMsg(object):
+
+    """
+    View of a single message in a `ColumnarSegment()` that can be used in 
+    place of the message `dict` when matching.  Only `drop` and `metric`
+    can be set.
+    """
+
+    __slots__ = ['segment', 'index']
+
+    def __init__(self, segment, index):
+        self.segment = segment
+        self.index = index
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        seg = self.segment
+        i = self.index
+        if key == 'lat':
+            return seg.lats[i]
+        elif key == 'lon':
+            return seg.lons[i]
+        elif key == 'speed':
+            return seg.speeds[i]
+        elif key == 'course':
+            return seg.courses[i]
+        elif key == 'type':
+            return seg.types[seg.type_codes[i]]
+        elif key == 'metric':
+            metric = seg.metrics[i]
+            return default if (metric != metric) else metric
+        elif key == 'drop':
+            return True if seg.drops[i] else default
+        elif key == EPOCH_FIELD:
+            return seg.timestamps[i]
+        elif key == KINEMATICS_FIELD:
+            return seg.kinematics(i)
+        keys = seg.keys[i]
+        if key in keys:
+            value = seg.values[i][keys.index(key)]
+            return {} if (value is _EMPTY) else value
+        return default
+
+    def __setitem__(self, key, value):
+        if key == 'drop':
+            self.segment.drops[self.index] = 1 if value else 0
+        elif key == 'metric':
+            self.segment.metrics[self.index] = _nan if (value is None) else value
+        else:
+            raise KeyError("only 'drop' and 'metric' can be set on {}".format(
+                                self.__class__.__name__))
+
+    def __repr__(self):
+        return "<{cname}({index}) of {seg!r}>".format(
+            cname=self.__class__.__name__, index=self.index, seg=self.segment)
+
+
+_nan = float('nan')
+
+# Placeholders for values that are not stored in `ColumnarSegment.values`
+_COLUMN = object()
+_EMPTY = object()
+
+
+class ColumnarSegment(Segment):
+
+    """
+    Open segment that stores messages column-wise rather than as a list of
+    dicts, which takes considerably less memory per message.
+
+    The fields used when matching are held in typed arrays, `drop`, `metric`
+    and the `Kinematics()` included, so they are not added to the messages.  The rest of each message
+    is held as a tuple of values, with the tuple of keys shared between all
+    messages with the same fields.  Float values that are also in a column and
+    empty dicts are not stored in the tuple.  Message dicts are only rebuilt
+    when the segment is emitted, so they are new objects rather than the ones
+    that were added.
+
+    The messages must be positional.
+    """
+
+    __slots__ = ['timestamps', 'lats', 'lons', 'speeds', 'courses', 
+                 'course_rads', 'cos_courses', 'sin_courses', 'deg_lon_per_nms',
+                 'expected_speeds', 'type_codes', 'metrics', 'drops', 'keys',
+                 'values', 'types', '_type_codes', '_keys']
+
+    def __init__(self, id, ssvid):
+        self.id = id
+        self.ssvid = ssvid
+        self.prev_state = None
+        self.prev_segment = None
+        # Epoch microseconds, which doubles hold exactly until the year 2255
+        self.timestamps = array('d')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.speeds = array('d')
+        self.courses = array('d')
+        # `Kinematics()` fields that are not already in a column
+        self.course_rads = array('d')
+        self.cos_courses = array('d')
+        self.sin_courses = array('d')
+        self.deg_lon_per_nms = array('d')
+        self.expected_speeds = array('d')
+        self.type_codes = array('h')
+        self.metrics = array('d')
+        self.drops = array('b')
+        self.keys = []
+        self.values = []
+        # Message types are stored as an index into this list
+        self.types = []
+        self._type_codes = {}
+        # Distinct key tuples, so they are shared between messages
+        self._keys = {}
+
+    def _type_code(self, type_):
+        code = self._type_codes.get(type_)
+        if code is None:
+            code = self._type_codes[type_] = len(self.types)
+            self.types.append(type_)
+        return code
+
+    def kinematics(self, i):
+        """
+        `Kinematics()` of message `i`, rebuilt from the columns.
+        """
+        k = Kinematics.__new__(Kinematics)
+        k.lon = self.lons[i]
+        k.lat = self.lats[i]
+        k.speed = self.speeds[i]
+        k.course_rads = self.course_rads[i]
+        k.cos_course = self.cos_courses[i]
+        k.sin_course = self.sin_courses[i]
+        k.deg_lon_per_nm = self.deg_lon_per_nms[i]
+        k.expected_speed = self.expected_speeds[i]
+        return k
+
+    def __len__(self):
+        return len(self.values)
+
+    def _materialize(self, i):
+        msg = {}
+        for k, v in zip(self.keys[i], self.values[i]):
+            if v is _COLUMN:
+                v = ColumnarMsg(self, i).get(k)
+            elif v is _EMPTY:
+                v = {}
+            msg[k] = v
+        metric = self.metrics[i]
+        if metric == metric:
+            msg['metric'] = metric
+        if self.drops[i]:
+            msg['drop'] = True
+        return msg
+
+    @property
+    def msgs(self):
+        return [self._materialize(i) for i in range(len(self))]
+
+    def get_all_reversed_msgs(self):
+        for i in range(len(self) - 1, -1, -1):
+            if not self.drops[i]:
+                yield ColumnarMsg(self, i)
+        if self.prev_segment is not None:
+            for msg in self.prev_segment.get_all_reversed_msgs():
+                yield msg
+
+    @property
+    def first_msg(self):
+        if self.prev_state and self.prev_state.first_msg is not None:
+            return self.prev_state.first_msg
+        return self.first_msg_of_day
+
+    @property
+    def last_msg(self):
+        if len(self):
+            return self._materialize(-1)
+        if self.prev_state and self.prev_state.last_msg is not None:
+            return self.prev_state.last_msg
+        return None
+
+    @property
+    def last_epoch(self):
+        if len(self):
+            return self.timestamps[-1]
+        return Segment.last_epoch.fget(self)
+
+    @property
+    def first_msg_of_day(self):
+        if len(self):
+            return self._materialize(0)
+        return None
+
+    @property
+    def last_msg_of_day(self):
+        if len(self):
+            return self._materialize(-1)
+        return None
+
+    def add_msg(self, msg):
+        metric = msg.get('metric')
+        self.timestamps.append(msg_epoch(msg))
+        # The columns replace the epoch timestamp and `Kinematics()`
+        # `Segmentizer()` adds
+        msg.pop(EPOCH_FIELD, None)
+        k = msg.pop(KINEMATICS_FIELD, None)
+        if k is None:
+            k = Kinematics(msg['lon'], msg['lat'], msg['course'], msg['speed'])
+        self.lats.append(msg['lat'])
+        self.lons.append(msg['lon'])
+        self.speeds.append(msg['speed'])
+        self.courses.append(msg['course'])
+        self.course_rads.append(k.course_rads)
+        self.cos_courses.append(k.cos_course)
+        self.sin_courses.append(k.sin_course)
+        self.deg_lon_per_nms.append(k.deg_lon_per_nm)
+        self.expected_speeds.append(k.expected_speed)
+        self.type_codes.append(self._type_code(msg.get('type')))
+        self.metrics.append(_nan if (metric is None) else metric)
+        self.drops.append(1 if msg.get('drop') else 0)
+        keys = tuple(k for k in msg if k not in ('metric', 'drop'))
+        self.keys.append(self._keys.setdefault(keys, keys))
+        self.values.append(tuple(self._compact(k, msg[k]) for k in keys))
+
+    @staticmethod
+    def _compact(key, value):
+        if key in ('lat', 'lon', 'speed', 'course'):
+            # Only floats can be restored exactly from the column
+            return _COLUMN if (type(value) is float) else value
+        elif key == 'type':
+            return _COLUMN
+        elif type(value) is dict and not value:
+            return _EMPTY
+        return value
+
+
+class TrimmedSegment(Segment):
+
+    """
+    Base of the open segments that only hold the messages that can still be
+    matched against or dropped.  Older messages are removed from `msgs` with
+    `_remove()`, but the last few that were not dropped are kept in `stale`,
+    so that `get_all_reversed_msgs()` yields the same messages as it would
+    for a `Segment()` holding all of them.  `_lookback_candidates()` walks
+    past the messages that are too old to match, and takes the transponder
+    types of the segment from them as well.
+    """
+
+    __slots__ = ['n_removed', 'stale']
+
+    def __init__(self, id, ssvid):
+        super(TrimmedSegment, self).__init__(id, ssvid)
+        self.n_removed = 0
+        self.stale = []
+
+    def get_all_reversed_msgs(self):
+        for msg in reversed(self.msgs):
+            if not msg.get('drop', False):
+                yield msg
+        for msg in reversed(self.stale):
+            yield msg
+        if self.prev_segment is not None:
+            for msg in self.prev_segment.get_all_reversed_msgs():
+                yield msg
+
+    def _remove(self, n, keep):
+        """
+        Remove the first `n` messages, keeping the last `keep` of the ones
+        removed so far that were not dropped in `stale`.
+        """
+        msgs = self.msgs
+        stale = self.stale
+        stale.extend(x for x in msgs[:n] if not x.get('drop', False))
+        del stale[:-keep or len(stale)]
+        self.n_removed += n
+        del msgs[:n]
+
+
+class ProvisionalSegment(TrimmedSegment):
+
+    """
+    Open segment used by `Segmentizer(provisional=True)`.  Its messages have
+    already been emitted as they were assigned, so the `Segmentizer()` only
+    keeps the ones that can still be matched against or dropped and the few
+    needed for their transponder types, see `trim()`.  `msg_count` still includes the forgotten messages.
+    """
+
+    __slots__ = ['n_dropped', '_first']
+
+    def __init__(self, id, ssvid):
+        super(ProvisionalSegment, self).__init__(id, ssvid)
+        # Messages dropped by lookback and retracted
+        self.n_dropped = 0
+        # First message not dropped, once it has been trimmed
+        self._first = None
+
+    @property
+    def msg_count(self):
+        return self.n_removed + super(ProvisionalSegment, self).msg_count
+
+    @property
+    def first_msg(self):
+        if self.prev_state and self.prev_state.first_msg is not None:
+            return self.prev_state.first_msg
+        return self.first_msg_of_day
+
+    @property
+    def first_msg_of_day(self):
+        if self._first is not None:
+            return self._first
+        for msg in self.msgs:
+            if not msg.get('drop', False):
+                return msg
+        return None
+
+    def trim(self, n, keep=0):
+        """
+        Forget the first `n` messages, except for the last `keep` not dropped
+        ones, which are still visited by `get_all_reversed_msgs()`.
+        """
+        if self._first is None:
+            self._first = next((x for x in self.msgs[:n] if not x.get('drop', False)), None)
+        self._remove(n, keep)
+
+
+class SpillSegment(TrimmedSegment):
+
+    """
+    Open segment used by `Segmentizer(spill=True)`.  The `Segmentizer()`
+    finalizes the messages that can no longer be matched and moves them from
+    `msgs` to a `SpillLog()` with `spill()`.  They are still counted in
+    `msg_count` and iterated over, in which case they are read back from the
+    log, but `len()` only counts the messages held in memory.
+    """
+
+    __slots__ = ['spilled', '_first']
+
+    def __init__(self, id, ssvid):
+        super(SpillSegment, self).__init__(id, ssvid)
+        self.spilled = None
+        self._first = None
+
+    def __iter__(self):
+        if self.spilled is None:
+            return iter(self.msgs)
+        return itertools.chain(self.spilled.messages(dropped=None), self.msgs)
+
+    @property
+    def msg_count(self):
+        return self.n_removed + super(SpillSegment, self).msg_count
+
+    @property
+    def first_msg(self):
+        if self.prev_state and self.prev_state.first_msg is not None:
+            return self.prev_state.first_msg
+        return self.first_msg_of_day
+
+    @property
+    def first_msg_of_day(self):
+        if self._first is not None:
+            return self._first
+        return Segment.first_msg_of_day.fget(self)
+
+    def spill(self, n, spill_file=None, keep=0):
+        """
+        Move the first `n` messages to the `SpillLog()`, which is created in
+        `spill_file` when first needed, or in a file of its own.  The last
+        `keep` not dropped ones are also still visited by
+        `get_all_reversed_msgs()`.
+        """
+        if self.spilled is None:
+            self.spilled = SpillLog(spill_file=spill_file)
+        if self._first is None:
+            self._first = self.msgs[0]
+        msgs = self.msgs[:n]
+        # Before the log removes the `drop` fields
+        self._remove(n, keep)
+        for msg in msgs:
+            self.spilled.append(msg)
+
+
 class ClosedSegment(Segment):
     """
     Segment that has timed out or closed because of ambiguity
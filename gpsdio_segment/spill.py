@@ -0,0 +1,176 @@
+"""
+Append only logs of messages on disk for `Segmentizer(spill=True)`.
+
+A vessel that reports continuously keeps one segment open for the whole run,
+and without spilling all of its messages are held in memory until the
+segment is emitted.  Only the messages of the last `max_hours` can still be
+matched or dropped, so older ones are finalized, appended to a `SpillLog()`
+and read back through a memory map when the segment is emitted.
+
+The logs of all segments of a `Segmentizer()` share one temporary
+`SpillFile()`, so the number of open files does not grow with the number of
+vessels.  Records are a `uint8` flag that is set for messages dropped by
+lookback, a `uint32` length and the `int64` offset of the previous record of
+the same log, or -1, followed by the pickled message.  Space is not reclaimed
+when a log is discarded, and the file is deleted once no log refers to it.
+"""
+
+
+from __future__ import division, print_function
+import itertools
+import mmap
+import pickle
+import struct
+import tempfile
+
+
+_RECORD = struct.Struct('<BIq')
+
+
+class SpillFile(object):
+
+    """
+    Temporary file holding the records of any number of `SpillLog()`s.
+    """
+
+    def __init__(self, directory=None):
+
+        """
+        Parameters
+        ----------
+        directory : str, optional
+            Where to create the file.  Defaults to the system temporary
+            directory.
+        """
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._size = 0
+
+    def write(self, data):
+        """
+        Append `data` and return its offset.
+        """
+        offset = self._size
+        self._file.write(data)
+        self._size += len(data)
+        return offset
+
+    def map(self):
+        """
+        Read only memory map of everything written so far, or `None` if the
+        file is empty.
+        """
+        if not self._size:
+            return None
+        self._file.flush()
+        return mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+
+
+class SpillLog(object):
+
+    """
+    Messages appended to a `SpillFile()`.
+    """
+
+    def __init__(self, directory=None, spill_file=None):
+
+        """
+        Parameters
+        ----------
+        directory : str, optional
+            Where to create the file if `spill_file` is not given.  Defaults
+            to the system temporary directory.
+        spill_file : SpillFile, optional
+            File shared with other logs.  By default the log has its own.
+        """
+        self._spill_file = (spill_file if spill_file is not None
+                                else SpillFile(directory))
+        # Offset of the last record
+        self._last = -1
+        self._n_msgs = 0
+        self.n_dropped = 0
+
+    def __len__(self):
+        return self._n_msgs
+
+    def append(self, msg):
+        """
+        Add `msg`, removing its `drop` field, which is stored in the record
+        instead.
+        """
+        dropped = msg.pop('drop', False)
+        data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        self._last = self._spill_file.write(
+            _RECORD.pack(1 if dropped else 0, len(data), self._last) + data)
+        self._n_msgs += 1
+        if dropped:
+            self.n_dropped += 1
+
+    def messages(self, dropped=False):
+        """
+        Lazily read back the messages that were or were not dropped, in the
+        order they were added, or all of them if `dropped` is `None`, with
+        `drop` set on those that were.  Only the messages appended before
+        this is called are read.
+        """
+        last = self._last
+        data = self._spill_file.map()
+        if data is None:
+            return
+        try:
+            # Records are linked newest first
+            offsets = []
+            while last >= 0:
+                offsets.append(last)
+                last = _RECORD.unpack_from(data, last)[2]
+            for offset in reversed(offsets):
+                flag, n, _ = _RECORD.unpack_from(data, offset)
+                if dropped is None or bool(flag) == dropped:
+                    offset += _RECORD.size
+                    msg = pickle.loads(data[offset:offset + n])
+                    if dropped is None and flag:
+                        msg['drop'] = True
+                    yield msg
+        finally:
+            data.close()
+
+
+class SpilledMsgs(object):
+
+    """
+    Stands in for the `msgs` list of an emitted segment: the messages of a
+    `SpillLog()` that were not dropped, followed by those added with
+    `append()`.  Supports iteration, `len()` and indexing with an int, which
+    reads the log up to that message.
+    """
+
+    __slots__ = ['log', 'tail']
+
+    def __init__(self, log):
+        self.log = log
+        self.tail = []
+
+    def _n_spilled(self):
+        return len(self.log) - self.log.n_dropped
+
+    def __len__(self):
+        return self._n_spilled() + len(self.tail)
+
+    def __iter__(self):
+        return itertools.chain(self.log.messages(), self.tail)
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("message index out of range")
+        n_spilled = self._n_spilled()
+        if i >= n_spilled:
+            return self.tail[i - n_spilled]
+        return next(itertools.islice(self.log.messages(), i, None))
+
+    def append(self, msg):
+        self.tail.append(msg)
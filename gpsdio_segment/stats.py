@@ -0,0 +1,144 @@
+"""
+Counters and stage timings collected by `Segmentizer(stats=True)`.
+"""
+
+
+from __future__ import division, print_function
+import time
+
+
+# Outcomes messages are counted under in `SegmentizerStats.messages`
+POSITION = 'position'
+INFO = 'info'
+BAD = 'bad'
+NOISE = 'noise'
+DISCARDED = 'discarded'
+DUPLICATE = 'duplicate'
+SKIPPED = 'skipped'
+
+# Stages timed in `SegmentizerStats.seconds`
+CLASSIFICATION = 'classification'
+DEDUP = 'dedup'
+IDENTITY = 'identity'
+EXPIRY = 'expiry'
+MATCHING = 'matching'
+CLEAN = 'clean'
+
+STAGES = (CLASSIFICATION, DEDUP, IDENTITY, EXPIRY, MATCHING, CLEAN)
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class SegmentizerStats(object):
+
+    """
+    Running totals for a `Segmentizer()`, updated as the stream is consumed
+    and readable at any point.
+
+        >>> segmentizer = Segmentizer(msgs, stats=True)
+        >>> for seg in segmentizer:
+        ...     pass
+        >>> segmentizer.stats.messages['position']
+        >>> segmentizer.stats.as_dict()
+
+    Attributes
+    ----------
+    messages : dict
+        Number of messages by what happened to them: `'position'` if added
+        to a segment, `'info'`, `'bad'` if not a valid position, `'noise'`
+        if rejected while matching, `'duplicate'` or `'skipped'` if they did
+        not have the segmentizer's ssvid.  Positions that are later dropped
+        from their segment are also counted as `'discarded'`.
+    seconds : dict
+        Cumulative time spent in each stage.  Time spent in a nested stage,
+        such as `identity` annotation while cleaning a segment, only counts
+        towards the nested stage.
+    discrepancy_evaluations : int
+        Number of message pairs compared while matching.
+    unreachable_candidates : int
+        Message pairs that were not compared because they are too far apart,
+        see `Segmentizer(prefilter=True)`.
+    bounded_candidates : int
+        Message pairs that were not compared because no discrepancy would
+        have given a metric that changed the match.
+    segments_opened : int
+    segments_expired : int
+        Closed because no positions were added for `max_hours`.
+    segments_evicted : int
+        Closed to stay under `max_open_segments`.
+    ambiguity_closures : int
+        Closed because a message matched several segments equally well.
+    peak_open_segments : int
+    """
+
+    def __init__(self):
+        self.messages = dict((k, 0) for k in (POSITION, INFO, BAD, NOISE, DISCARDED,
+                                              DUPLICATE, SKIPPED))
+        self.seconds = dict((k, 0.0) for k in STAGES)
+        self.discrepancy_evaluations = 0
+        self.unreachable_candidates = 0
+        self.bounded_candidates = 0
+        self.segments_opened = 0
+        self.segments_expired = 0
+        self.segments_evicted = 0
+        self.ambiguity_closures = 0
+        self.peak_open_segments = 0
+        self._nested = []
+
+    def __repr__(self):
+        return "<{}() {}>".format(self.__class__.__name__, self.as_dict())
+
+    def as_dict(self):
+        """
+        A snapshot of the stats as plain values.
+        """
+        return {'messages': dict(self.messages),
+                'seconds': dict(self.seconds),
+                'discrepancy_evaluations': self.discrepancy_evaluations,
+                'unreachable_candidates': self.unreachable_candidates,
+                'bounded_candidates': self.bounded_candidates,
+                'segments_opened': self.segments_opened,
+                'segments_expired': self.segments_expired,
+                'segments_evicted': self.segments_evicted,
+                'ambiguity_closures': self.ambiguity_closures,
+                'peak_open_segments': self.peak_open_segments}
+
+    def _start(self):
+        self._nested.append(0.0)
+        return clock()
+
+    def _stop(self, stage, start):
+        elapsed = clock() - start
+        self.seconds[stage] += elapsed - self._nested.pop()
+        if self._nested:
+            self._nested[-1] += elapsed
+
+    def timed(self, stage, func):
+        """
+        Wrap `func` so the time spent in it is added to `stage`.
+        """
+        def wrapper(*args, **kwargs):
+            start = self._start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._stop(stage, start)
+        return wrapper
+
+    def timed_generator(self, stage, func):
+        """
+        Like `timed()` for generator functions.  Only the time spent producing
+        each item is added to `stage`, not the time the consumer holds it.
+        """
+        def wrapper(*args, **kwargs):
+            items = func(*args, **kwargs)
+            while True:
+                start = self._start()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    self._stop(stage, start)
+                yield item
+        return wrapper
@@ -0,0 +1,289 @@
+"""
+Run `Segmentizer()` over one dataset with many parameter sets.
+
+The default knobs of `Segmentizer()` are not known to be optimal, and trying
+alternatives one run at a time means parsing and classifying the same
+messages again for every configuration.  A `SweepDataset()` does that once:
+messages are grouped by ssvid, and the message type and normalized location
+of each are computed up front, as neither depends on the tunable knobs.
+`sweep()` then segments the dataset with each configuration on a pool of
+processes that share the prepared dataset read only, and reports summary
+statistics and throughput per configuration.
+
+    >>> from gpsdio_segment.sweep import SweepDataset, grid, sweep
+    >>> dataset = SweepDataset.from_stream(msgs)
+    >>> configs = grid(max_hours=[4, 8, 12], max_knots=[20, 25, 30])
+    >>> for result in sweep(dataset, configs):
+    ...     print(result['params'], result['n_segments'], result['noise_ratio'])
+
+Workers are forked with the dataset already in memory where possible, and
+otherwise receive it once when they start rather than once per
+configuration.
+"""
+
+
+from __future__ import division, print_function
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import random
+import time
+
+from gpsdio_segment.core import BAD_MESSAGE
+from gpsdio_segment.core import INFO_MESSAGE
+from gpsdio_segment.core import POSITION_MESSAGE
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.segment import BadSegment
+from gpsdio_segment.segment import DiscardedSegment
+from gpsdio_segment.segment import InfoSegment
+
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# Message types are stored as an index into this tuple, as the types
+# themselves do not survive pickling
+_TYPES = (POSITION_MESSAGE, INFO_MESSAGE, BAD_MESSAGE)
+_TYPE_CODES = dict((t, i) for (i, t) in enumerate(_TYPES))
+
+# The dataset of the current sweep in worker processes
+_dataset = None
+
+# Knobs accepted by `Segmentizer()`
+_PARAMETERS = frozenset(Segmentizer._PARAMETERS)
+
+
+class SweepDataset(object):
+
+    """
+    Messages grouped by ssvid with their message types and normalized
+    locations precomputed.  Messages are never modified, each run segments
+    copies of them.
+    """
+
+    def __init__(self, inputs):
+
+        """
+        Parameters
+        ----------
+        inputs : dict or iter
+            Map of ssvid to a time ordered sequence of messages for that
+            ssvid or an iterable of `(ssvid, msgs)` pairs, as passed to
+            `segment_parallel()`.
+        """
+        classifier = Segmentizer(None)
+        self.ssvids = []
+        self.classified = []
+        self.n_msgs = 0
+        items = inputs.items() if hasattr(inputs, 'items') else inputs
+        for ssvid, msgs in items:
+            rows = []
+            for msg in msgs:
+                x, y, course, speed, heading = classifier.extract_location(msg)
+                msg_type = classifier._message_type(x, y, course, speed)
+                loc = None
+                if msg_type is POSITION_MESSAGE:
+                    loc = classifier.normalize_location(x, y, course, speed, heading)
+                rows.append((msg, _TYPE_CODES[msg_type], loc))
+            self.ssvids.append(ssvid)
+            self.classified.append(rows)
+            self.n_msgs += len(rows)
+
+    @classmethod
+    def from_stream(cls, msgs):
+        """
+        Create a dataset from a time sorted stream of messages from any
+        number of ssvid, in the order each ssvid is first seen.
+        """
+        by_ssvid = OrderedDict()
+        for msg in msgs:
+            by_ssvid.setdefault(msg.get('ssvid'), []).append(msg)
+        return cls(by_ssvid)
+
+    def __len__(self):
+        return self.n_msgs
+
+
+def grid(**values):
+    """
+    Every combination of the given parameter values.
+
+        >>> grid(max_hours=[4, 8], max_knots=[20, 25])
+        [{'max_hours': 4, 'max_knots': 20}, {'max_hours': 4, 'max_knots': 25},
+         {'max_hours': 8, 'max_knots': 20}, {'max_hours': 8, 'max_knots': 25}]
+
+    Returns
+    -------
+    list of dict
+        Ordered by parameter name, with the last one varying fastest.
+    """
+    keys = sorted(values)
+    return [dict(zip(keys, combination)) for combination
+                in itertools.product(*[values[k] for k in keys])]
+
+
+def random_search(n, seed=None, **space):
+    """
+    `n` random parameter sets.  Each parameter is given as a list of values
+    to choose from or a `(low, high)` tuple to draw from uniformly, as ints
+    if both bounds are ints.
+
+        >>> random_search(20, seed=0, max_knots=(15, 35), lookback=[3, 5, 7])
+
+    Returns
+    -------
+    list of dict
+    """
+    rng = random.Random(seed)
+    keys = sorted(space)
+
+    def draw(k):
+        choices = space[k]
+        if isinstance(choices, tuple):
+            low, high = choices
+            if isinstance(low, int) and isinstance(high, int):
+                return rng.randint(low, high)
+            return rng.uniform(low, high)
+        return rng.choice(choices)
+
+    return [dict((k, draw(k)) for k in keys) for _ in range(n)]
+
+
+def _quantile(values, q):
+    # Linear interpolation between the closest ranks of sorted `values`
+    position = q * (len(values) - 1)
+    i = int(position)
+    if i + 1 >= len(values):
+        return values[-1]
+    return values[i] + (position - i) * (values[i + 1] - values[i])
+
+
+def _summarize(params, n_msgs, seconds, lengths, counts):
+    lengths.sort()
+    if lengths:
+        distribution = dict(min=lengths[0], max=lengths[-1],
+                            mean=sum(lengths) / len(lengths),
+                            p10=_quantile(lengths, 0.1),
+                            median=_quantile(lengths, 0.5),
+                            p90=_quantile(lengths, 0.9))
+    else:
+        distribution = None
+    positions = counts['position'] + counts['noise'] + counts['discarded']
+    return dict(params=params,
+                n_msgs=n_msgs,
+                seconds=seconds,
+                msgs_per_second=n_msgs / seconds if seconds else None,
+                n_segments=len(lengths),
+                segment_lengths=distribution,
+                messages=counts,
+                noise_ratio=counts['noise'] / positions if positions else None,
+                discard_ratio=counts['discarded'] / positions if positions else None)
+
+
+def _count(seg, msg_type, counts, lengths):
+    n = len(seg)
+    if isinstance(seg, BadSegment):
+        # Only ever emitted for the message being processed, which is
+        # otherwise positional if it was rejected while matching
+        counts['bad' if (msg_type is BAD_MESSAGE) else 'noise'] += n
+    elif isinstance(seg, InfoSegment):
+        counts['info'] += n
+    elif isinstance(seg, DiscardedSegment):
+        counts['discarded'] += n
+    else:
+        counts['position'] += n
+        lengths.append(n)
+
+
+def _run(dataset, params, kwargs):
+    options = dict(kwargs, **params)
+    lengths = []
+    counts = dict(position=0, noise=0, discarded=0, bad=0, info=0)
+    seconds = 0.0
+    for ssvid, rows in zip(dataset.ssvids, dataset.classified):
+        # Copied outside the timed section, as segmenting modifies messages
+        rows = [(dict(msg), _TYPES[code], loc) for (msg, code, loc) in rows]
+        segmentizer = Segmentizer(None, ssvid=ssvid, **options)
+        start = clock()
+        for msg, msg_type, loc in rows:
+            for seg in segmentizer._process_msg(msg, msg_type, loc):
+                _count(seg, msg_type, counts, lengths)
+        for seg in segmentizer.close_all():
+            _count(seg, None, counts, lengths)
+        seconds += clock() - start
+    # Everything else was a duplicate or had another ssvid
+    counts['skipped'] = dataset.n_msgs - sum(counts.values())
+    return _summarize(params, dataset.n_msgs, seconds, lengths, counts)
+
+
+def _share(dataset):
+    global _dataset
+    _dataset = dataset
+
+
+def _run_shared(params, kwargs):
+    return _run(_dataset, params, kwargs)
+
+
+def _executor(dataset, max_workers):
+    # Forked workers inherit the dataset.  Otherwise it is pickled once per
+    # worker by the initializer, which needs Python 3.7.
+    _share(dataset)
+    try:
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=_share,
+                                   initargs=(dataset,))
+    except TypeError:  # pragma: no cover
+        return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def sweep(dataset, configs, max_workers=None, **kwargs):
+
+    """
+    Segment `dataset` with each of `configs`.
+
+    Parameters
+    ----------
+    dataset : SweepDataset
+    configs : iter of dict
+        Parameter sets passed to `Segmentizer()`, for instance from `grid()`
+        or `random_search()`.
+    max_workers : int, optional
+        Number of processes to use.  Defaults to the number of CPUs.  If
+        `1`, everything is run in the current process.
+    **kwargs
+        Passed on to every `Segmentizer()`, overridden by `configs`.
+
+    Yields
+    ------
+    dict
+        For each of `configs` in order: the `params`, `n_msgs`, the
+        `seconds` spent segmenting and `msgs_per_second`, `n_segments`, the
+        `segment_lengths` distribution of those segments as `min`, `p10`,
+        `median`, `mean`, `p90` and `max`, or `None` if there are none, the
+        number of `messages` in segments (`position`), noise, discarded, bad
+        and info segments and `skipped` as duplicates, and the `noise_ratio`
+        and `discard_ratio` of all positional messages.
+    """
+    configs = list(configs)
+    for params in configs:
+        for k in params:
+            if k not in _PARAMETERS:
+                raise ValueError("Unknown `Segmentizer()` parameter {!r}".format(k))
+
+    if max_workers == 1:
+        for params in configs:
+            yield _run(dataset, params, kwargs)
+        return
+
+    executor = _executor(dataset, max_workers)
+    try:
+        futures = [executor.submit(_run_shared, params, kwargs) for params in configs]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Don't start any more work if the caller stops early
+            for future in futures:
+                future.cancel()
+    finally:
+        executor.shutdown()
+        _share(None)
@@ -0,0 +1,253 @@
+"""
+Generate realistic streams of AIS messages for load testing.
+
+Real tracks are too small to show how the segmenter behaves on long runs or
+on MMSIs shared by many vessels, which is where matching gets expensive.
+`SyntheticAIS()` simulates a fleet of vessels that all transmit with the
+same ssvid and produces their messages in time order with the quirks seen
+in real data: position noise, occasional wild positions, duplicated
+messages and speeds in `REPORTED_SPEED_EXCLUSION_RANGES`.  Messages are
+generated lazily and the stream is fully determined by the seed, so it can
+drive soak tests of any length without materializing the input.
+
+    >>> from gpsdio_segment.synthetic import SyntheticAIS
+    >>> for segment in Segmentizer(SyntheticAIS(n_vessels=10, seed=1).messages(10**8)):
+    ...     pass
+"""
+
+
+from __future__ import division, print_function
+import datetime
+import heapq
+import itertools
+import math
+import random
+
+from gpsdio_segment.core import REPORTED_SPEED_EXCLUSION_RANGES
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_US = 1000000
+
+POSITION = 'position'
+TYPE_27 = 'type_27'
+IDENTITY = 'identity'
+
+
+class _Vessel(object):
+
+    __slots__ = ['index', 'class_b', 'type_27', 'lat', 'lon', 'speed', 'course',
+                 'moored', 'epoch', 'shipname', 'callsign', 'imo']
+
+    def __init__(self, index, class_b, type_27, lat, lon, speed, course, epoch):
+        self.index = index
+        self.class_b = class_b
+        self.type_27 = type_27
+        self.lat = lat
+        self.lon = lon
+        self.speed = speed
+        self.course = course
+        self.moored = False
+        self.epoch = epoch
+        self.shipname = 'SYNTHETIC {}'.format(index)
+        self.callsign = 'SYN{}'.format(index)
+        self.imo = None if class_b else 9000000 + index
+
+
+class SyntheticAIS(object):
+
+    """
+    A fleet of simulated vessels transmitting with one ssvid.
+
+    Class A vessels report their position every 2 to 10 seconds depending on
+    speed, or every 3 minutes when moored, and send a type 5 identity message
+    every 6 minutes.  Class B vessels report every 30 seconds, or 3 minutes
+    when moored, and send type 24 identity messages.  Some vessels also send
+    low resolution type 27 positions every 3 minutes.  Vessels wander at sea
+    speeds with slowly changing course and occasionally moor for a while.
+
+    The rates of the various defects below may be overridden with keyword
+    arguments of the same name.
+    """
+
+    class_b_fraction = 0.3
+    type_27_fraction = 0.2
+    moored_fraction = 0.1
+    spread_degrees = 1.0
+    # Standard deviation of reported positions in degrees, about 5m
+    position_noise = 0.00005
+    # Probability that a position is off by up to `outlier_degrees`
+    outlier_rate = 0.0005
+    outlier_degrees = 1.0
+    # Probability that a message is received twice with the same msgid, or
+    # with a different one as if by another receiver
+    duplicate_rate = 0.01
+    # Probability of a speed in `REPORTED_SPEED_EXCLUSION_RANGES`
+    bad_speed_rate = 0.001
+
+    def __init__(self, n_vessels=1, ssvid=123456789, seed=0,
+                 start=datetime.datetime(2017, 1, 1), center=(0.0, 0.0), **kwargs):
+
+        """
+        Parameters
+        ----------
+        n_vessels : int, optional
+            Number of vessels transmitting with `ssvid`.
+        ssvid : int, optional
+        seed : int, optional
+            The stream is determined by the seed and the parameters.
+        start : datetime.datetime, optional
+            Naive UTC time of the first message.
+        center : tuple, optional
+            (lat, lon) around which the vessels start, scattered over
+            `spread_degrees`.
+        """
+        for k in ['class_b_fraction', 'type_27_fraction', 'moored_fraction',
+                  'spread_degrees', 'position_noise', 'outlier_rate',
+                  'outlier_degrees', 'duplicate_rate', 'bad_speed_rate']:
+            if k in kwargs:
+                setattr(self, k, kwargs.pop(k))
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments: {}".format(sorted(kwargs)))
+        self.n_vessels = n_vessels
+        self.ssvid = ssvid
+        self.seed = seed
+        self.start = start
+        self.center = center
+
+    def __iter__(self):
+        return self.messages()
+
+    def messages(self, n_msgs=None):
+
+        """
+        Lazily generate the time sorted messages of the fleet.
+
+        Parameters
+        ----------
+        n_msgs : int, optional
+            Stop after this many messages, including duplicates.  By default
+            the stream never ends.
+
+        Yields
+        ------
+        dict
+            Messages with `ssvid`, an integer `msgid`, a naive UTC `timestamp`,
+            `type` and either position or identity fields.
+        """
+        rng = random.Random(self.seed)
+        start = int((self.start - _EPOCH).total_seconds()) * _US
+        vessels = []
+        events = []
+        counter = itertools.count()
+        for i in range(self.n_vessels):
+            vessel = _Vessel(i, rng.random() < self.class_b_fraction,
+                             rng.random() < self.type_27_fraction,
+                             self.center[0] + rng.uniform(-0.5, 0.5) * self.spread_degrees,
+                             self.center[1] + rng.uniform(-0.5, 0.5) * self.spread_degrees,
+                             rng.uniform(3, 15), rng.uniform(0, 360), start)
+            vessel.moored = rng.random() < self.moored_fraction
+            vessels.append(vessel)
+            # Stagger the first transmissions
+            for kind in (POSITION, IDENTITY) + ((TYPE_27,) if vessel.type_27 else ()):
+                epoch = start + rng.randint(0, self._interval(vessel, kind) * _US)
+                events.append((epoch, next(counter), i, kind))
+        heapq.heapify(events)
+
+        msgids = itertools.count()
+        count = 0
+        while events and (n_msgs is None or count < n_msgs):
+            epoch, _, i, kind = heapq.heappop(events)
+            vessel = vessels[i]
+            self._move(rng, vessel, epoch)
+            msg = self._message(rng, vessel, kind, epoch)
+            msg['msgid'] = next(msgids)
+            copies = [msg]
+            if rng.random() < self.duplicate_rate:
+                dup = dict(msg)
+                if rng.random() < 0.5:
+                    dup['msgid'] = next(msgids)
+                copies.append(dup)
+            for x in copies:
+                if n_msgs is not None and count >= n_msgs:
+                    break
+                yield x
+                count += 1
+            interval = self._interval(vessel, kind)
+            # Reports drift a little around their nominal interval
+            jitter = rng.randint(-interval * _US // 10, interval * _US // 10)
+            heapq.heappush(events, (epoch + interval * _US + jitter, next(counter), i, kind))
+
+    @staticmethod
+    def _interval(vessel, kind):
+        # Seconds until the next message of `kind`
+        if kind == IDENTITY:
+            return 360
+        if kind == TYPE_27 or vessel.moored:
+            return 180
+        if vessel.class_b:
+            return 30
+        return 2 if vessel.speed > 23 else 6 if vessel.speed > 14 else 10
+
+    def _move(self, rng, vessel, epoch):
+        # Dead reckon `vessel` to `epoch`, then perturb its course and speed
+        hours = (epoch - vessel.epoch) / 3600 / _US
+        vessel.epoch = epoch
+        if hours <= 0:
+            return
+        if rng.random() < hours / 24:
+            vessel.moored = not vessel.moored
+        if vessel.moored:
+            vessel.speed = 0.0
+            return
+        if vessel.speed < 1:
+            vessel.speed = rng.uniform(3, 15)
+        course = math.radians(vessel.course)
+        distance = vessel.speed * hours / 60
+        vessel.lat += distance * math.cos(course)
+        vessel.lon += distance * math.sin(course) / max(math.cos(math.radians(vessel.lat)),
+                                                        0.01)
+        if abs(vessel.lat) > 70:
+            vessel.lat = math.copysign(70, vessel.lat)
+            vessel.course = 180 - vessel.course
+        vessel.lon = (vessel.lon + 180) % 360 - 180
+        scale = math.sqrt(hours * 3600)
+        vessel.course = (vessel.course + rng.gauss(0, 0.5) * scale) % 360
+        vessel.speed = min(max(vessel.speed + rng.gauss(0, 0.02) * scale, 1), 25)
+
+    def _message(self, rng, vessel, kind, epoch):
+        msg = {'ssvid': self.ssvid,
+               'timestamp': _EPOCH + datetime.timedelta(microseconds=epoch)}
+        if kind == IDENTITY:
+            msg.update(type='AIS.24' if vessel.class_b else 'AIS.5',
+                       shipname=vessel.shipname,
+                       callsign=vessel.callsign,
+                       imo=vessel.imo)
+            return msg
+
+        lat = vessel.lat + rng.gauss(0, self.position_noise)
+        lon = vessel.lon + rng.gauss(0, self.position_noise)
+        if rng.random() < self.outlier_rate:
+            lat = min(max(lat + rng.uniform(-1, 1) * self.outlier_degrees, -90), 90)
+            lon = (lon + rng.uniform(-1, 1) * self.outlier_degrees + 180) % 360 - 180
+        speed = max(vessel.speed + rng.gauss(0, 0.1), 0) if not vessel.moored else 0.0
+        course = (vessel.course + rng.gauss(0, 1)) % 360
+        if rng.random() < self.bad_speed_rate:
+            low, high = rng.choice(REPORTED_SPEED_EXCLUSION_RANGES)
+            speed = (low + high) / 2
+
+        if kind == TYPE_27:
+            # Positions to 1/10 minute, speed and course to whole units
+            msg.update(type='AIS.27',
+                       lat=round(lat * 600) / 600,
+                       lon=round(lon * 600) / 600,
+                       speed=float(round(speed)),
+                       course=float(round(course) % 360))
+        else:
+            msg.update(type='AIS.18' if vessel.class_b else 'AIS.1',
+                       lat=lat,
+                       lon=lon,
+                       speed=round(speed, 1),
+                       course=round(course, 1) % 360,
+                       heading=int(round(vessel.course)) % 360)
+        return msg
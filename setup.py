@@ -65,10 +65,17 @@ setup(
             'coverage',
             'python-dateutil',
             'pytz',
+            'numpy',
+        ],
+        'numpy': [
+            'numpy',
         ]
     },
     include_package_data=True,
-    install_requires=[],
+    install_requires=[
+        'click',
+        'futures; python_version < "3"',
+    ],
     keywords='AIS GIS remote sensing',
     license="Apache 2.0",
     long_description=readme,
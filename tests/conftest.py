@@ -1,9 +1,16 @@
 import pytest
 import datetime
+import sys
 from itertools import groupby
 from gpsdio_segment.core import Segmentizer
 
 
+# Async generators are a syntax error on older Pythons
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_aio.py')
+
+
 class MessageGenerator(object):
     def __init__(self, mmsi=None):
         self.mmsi = mmsi if mmsi else 123456789
@@ -1,3 +1,4 @@
+import datetime
 import json
 import dateutil.parser
 import random
@@ -31,3 +32,21 @@ def read_json(src, add_msgid=True, add_type=True):
                 msg['type'] = 'UNKNOWN'
             yield msg
 
+
+def mixed_transponders(seed, n_msgs=300):
+    """
+    A sparse random walk reported alternately over class A and class B
+    transponders, with gaps of up to several hours.
+    """
+    rng = random.Random(seed)
+    ts = datetime.datetime(2020, 1, 1)
+    lon = lat = 0.0
+    msgs = []
+    for i in range(n_msgs):
+        ts += datetime.timedelta(hours=rng.choice([0.05, 0.2, 0.5, 1, 2, 4.5]))
+        lon += rng.gauss(0, 0.05)
+        lat += rng.gauss(0, 0.05)
+        msgs.append(dict(ssvid=1, msgid=i, timestamp=ts, lon=lon, lat=lat,
+                         speed=rng.uniform(0, 12), course=rng.uniform(0, 359),
+                         type=rng.choice(['AIS.1', 'AIS.18'])))
+    return msgs
@@ -0,0 +1,124 @@
+"""
+Tests for segmenting an async feed.
+"""
+
+
+import asyncio
+
+import pytest
+
+from gpsdio_segment.aio import segment_async
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.synthetic import SyntheticAIS
+
+from support import read_json
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _summarize(segs):
+    return [(seg.__class__.__name__, seg.id, [msg['msgid'] for msg in seg])
+                for seg in segs]
+
+
+async def _feed(msgs, burst=50, error=None):
+    # Fake live feed delivering `burst` messages at a time
+    for i, msg in enumerate(msgs):
+        if i % burst == 0:
+            await asyncio.sleep(0)
+        yield msg
+    if error is not None:
+        raise error
+
+
+async def _collect(agen):
+    return [x async for x in agen]
+
+
+@pytest.mark.parametrize('vectorize', [False, True])
+def test_matches_segmentizer(vectorize):
+    msgs = _load('tests/data/416000000.json')
+    expected = _summarize(Segmentizer([x.copy() for x in msgs], vectorize=vectorize))
+    segs = asyncio.run(_collect(segment_async(_feed(msgs), batch_size=64,
+                                              vectorize=vectorize)))
+    assert _summarize(segs) == expected
+
+    # Continuing from saved states
+    first, second = msgs[:800], msgs[800:]
+    states = [seg.state for seg in Segmentizer([x.copy() for x in first])]
+    expected = _summarize(Segmentizer.from_seg_states(states, [x.copy() for x in second]))
+    segs = asyncio.run(_collect(segment_async(_feed(second), seg_states=states)))
+    assert _summarize(segs) == expected
+
+
+def test_batches_yield_to_loop():
+    msgs = list(SyntheticAIS(n_vessels=5, seed=2).messages(5000))
+    ticks = []
+
+    async def ticker(stop):
+        while not stop.is_set():
+            ticks.append(len(ticks))
+            await asyncio.sleep(0)
+
+    async def main():
+        queue = asyncio.Queue()
+        for msg in msgs:
+            queue.put_nowait(msg)
+        queue.put_nowait(None)
+
+        async def from_queue():
+            while True:
+                msg = await queue.get()
+                if msg is None:
+                    return
+                yield msg
+
+        stop = asyncio.Event()
+        task = asyncio.ensure_future(ticker(stop))
+        segs = await _collect(segment_async(from_queue(), batch_size=100, buffer_size=500))
+        stop.set()
+        await task
+        return segs
+
+    expected = _summarize(Segmentizer([x.copy() for x in msgs]))
+    segs = asyncio.run(main())
+    assert _summarize(segs) == expected
+    # The whole burst was available at once, but the loop still ran between batches
+    assert len(ticks) >= len(msgs) // 100
+
+
+def test_feed_error():
+    msgs = _load('tests/data/416000000.json')[:300]
+    seen = []
+
+    async def main():
+        async for seg in segment_async(_feed(msgs, error=IOError('disconnected'))):
+            seen.append(seg)
+
+    with pytest.raises(IOError):
+        asyncio.run(main())
+    # Segments finalized before the error were still emitted
+    segmentizer = Segmentizer(None)
+    expected = [x for msg in msgs for x in segmentizer.process_msg(msg.copy())]
+    assert expected and _summarize(seen) == _summarize(expected)
+
+
+def test_stop_early():
+    msgs = list(SyntheticAIS(n_vessels=20, seed=3).messages(5000))
+
+    async def main():
+        agen = segment_async(_feed(msgs), batch_size=10, max_open_segments=2)
+        seg = await agen.__anext__()
+        await agen.aclose()
+        # The feed reader has stopped by the time the generator is closed
+        return seg, [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    seg, tasks = asyncio.run(main())
+    assert len(seg) > 0
+    assert tasks == []
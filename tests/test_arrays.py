@@ -0,0 +1,111 @@
+"""
+Tests for segmenting messages held in arrays.
+"""
+
+
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from gpsdio_segment import segment_arrays
+from gpsdio_segment.arrays import INDEX_FIELD
+from gpsdio_segment.core import Segmentizer
+
+from support import read_json
+
+
+FIELDS = ['timestamp', 'lat', 'lon', 'speed', 'course', 'type', 'msgid']
+
+
+def _arrays(msgs):
+    nan = float('nan')
+    data = {k: np.array([nan if (x.get(k) is None) else x[k] for x in msgs])
+                for k in FIELDS}
+    data['timestamp'] = np.array([x['timestamp'].replace(tzinfo=None) for x in msgs],
+                                 dtype='datetime64[us]')
+    return data
+
+
+@pytest.mark.parametrize('path', ['tests/data/263576000.json',
+                                  'tests/data/416000000.json'])
+def test_same_as_segmentizer(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    ssvid = msgs[0]['ssvid']
+    result = segment_arrays(_arrays(msgs), ssvid=ssvid)
+
+    expected = {}
+    segments = []
+    for seg in Segmentizer([x.copy() for x in msgs]):
+        if not seg.noise:
+            segments.append(seg)
+            for msg in seg:
+                expected[msg['msgid']] = seg.id
+    assert list(result.segment_ids) == [expected.get(x['msgid']) for x in msgs]
+    assert ((result.classification == 'position') ==
+            [x['msgid'] in expected for x in msgs]).all()
+    assert list(result.segments['id']) == [seg.id for seg in segments]
+    assert list(result.segments['n_msgs']) == [len(seg) for seg in segments]
+    assert [x.id for x in result.states] == [seg.id for seg in segments]
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'spill': True}])
+def test_states_without_index(kwargs):
+    with open('tests/data/416000000.json') as f:
+        msgs = list(read_json(f))
+    result = segment_arrays(_arrays(msgs), ssvid=msgs[0]['ssvid'], **kwargs)
+    assert result.states
+    for state in result.states:
+        for msg in (state.first_msg, state.last_msg, state.first_msg_of_day,
+                    state.last_msg_of_day):
+            assert INDEX_FIELD not in msg
+    # and they can be continued from
+    assert list(Segmentizer.from_seg_states(result.states, []))
+
+
+def test_classification():
+    t = datetime(2017, 1, 1)
+    nan = float('nan')
+    rows = [
+        # timestamp, lat, lon, speed, course, type, msgid
+        (t, 0.0, 0.0, 1.0, 90.0, 'AIS.1', 0),
+        (t + timedelta(minutes=10), nan, nan, nan, nan, 'AIS.5', 1),
+        (t + timedelta(minutes=20), 91.0, 0.0, 1.0, 90.0, 'AIS.1', 2),
+        (t + timedelta(minutes=30), 0.0, 0.008, 1.0, 90.0, 'AIS.1', 3),
+        (t + timedelta(minutes=30), 0.0, 0.008, 1.0, 90.0, 'AIS.1', 3),
+        (t + timedelta(minutes=40), 0.0, 0.011, 1.0, 90.0, 'AIS.27', 4),
+        (t + timedelta(hours=20), 0.0, 0.5, 1.0, 90.0, 'AIS.1', 5),
+    ]
+    data = np.array(rows, dtype=[('timestamp', 'datetime64[us]'), ('lat', float),
+                                 ('lon', float), ('speed', float), ('course', float),
+                                 ('type', 'U6'), ('msgid', int)])
+    result = segment_arrays(data, ssvid=1)
+    assert list(result.classification) == ['position', 'info', 'bad', 'position',
+                                           'duplicate', 'noise', 'position']
+    first_id = '1-2017-01-01T00:00:00.000000Z'
+    last_id = '1-2017-01-01T20:00:00.000000Z'
+    assert list(result.segment_ids) == [first_id, None, None, first_id,
+                                        None, None, last_id]
+    segments = result.segments
+    assert list(segments['id']) == [first_id, last_id]
+    assert list(segments['closed']) == [True, False]
+    assert list(segments['n_msgs']) == [2, 1]
+    assert segments['last_timestamp'][0] == np.datetime64('2017-01-01T00:30')
+
+    # Continue from the states of the first run
+    more = data[-1:].copy()
+    more['timestamp'] += np.timedelta64(1, 'h')
+    more['lon'] += 0.02
+    more['msgid'] = 6
+    result = segment_arrays(more, ssvid=1, seg_states=[x for x in result.states
+                                                         if not x.closed])
+    assert list(result.segment_ids) == [last_id]
+    assert list(result.segments['msg_count']) == [2]
+    assert result.segments['first_timestamp'][0] == np.datetime64('2017-01-01T20:00')
+
+
+def test_missing_field():
+    with pytest.raises(ValueError):
+        segment_arrays({'timestamp': np.array([], dtype='datetime64[us]')})
@@ -0,0 +1,56 @@
+"""
+Tests for the benchmark suite in `benchmarks/`.
+"""
+
+
+import json
+import os
+import sys
+
+from gpsdio_segment.cli import dumps
+from gpsdio_segment.stats import STAGES
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks'))
+import run
+import sweep
+
+
+def test_run_case():
+    result = run.run_case(dict(source='synthetic', name='test', n_msgs=500,
+                               n_vessels=2, seed=0, options={}, profile=True))
+    assert result['n_msgs'] == 500
+    assert result['n_segments'] == 2
+    assert result['msgs_per_second'] > 0
+    assert set(result['stats']['seconds']) == set(STAGES + ('other',))
+    assert result['stats']['segments_opened'] == 2
+    assert result['discrepancy_evaluations_per_msg'] > 0
+    assert result['stats']['bounded_candidates'] > 0
+    assert 'profile' not in result
+
+    result = run.run_case(dict(source='fixture', name='263576000', repeat=1,
+                               options={'columnar': True}, profile=False))
+    assert result['n_msgs'] == 948
+    assert 'stats' not in result
+
+
+def test_sweep(tmpdir):
+    path = str(tmpdir.join('msgs.json'))
+    with open(path, 'w') as f:
+        for msg in run.load_fixture('263576000'):
+            f.write(dumps(msg) + '\n')
+    output = str(tmpdir.join('sweep.json'))
+    sweep.main([path, '--param', 'max_hours=2,8',
+                '--param', 'lookback=5', '--workers', '1', '--output', output])
+    with open(output) as f:
+        results = [json.loads(line) for line in f]
+    assert [x['params'] for x in results] == [{'lookback': 5, 'max_hours': 2},
+                                              {'lookback': 5, 'max_hours': 8}]
+    assert results[0]['n_segments'] > results[1]['n_segments']
+
+    output = str(tmpdir.join('random.json'))
+    sweep.main([path, '--random', '3', '--range', 'max_knots=15:35',
+                '--workers', '1', '--output', output])
+    with open(output) as f:
+        results = [json.loads(line) for line in f]
+    assert len(results) == 3
+    assert all(15 <= x['params']['max_knots'] <= 35 for x in results)
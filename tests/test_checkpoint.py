@@ -0,0 +1,119 @@
+"""
+Tests for the binary `SegmentState()` format.
+"""
+
+
+import datetime
+import io
+import itertools as it
+
+import pytest
+import pytz
+
+from gpsdio_segment.checkpoint import decode_states
+from gpsdio_segment.checkpoint import encode_states
+from gpsdio_segment.checkpoint import read_states
+from gpsdio_segment.checkpoint import write_states
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.segment import SegmentState
+
+from support import read_json
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _summarize(segs):
+    return [(seg.__class__.__name__, seg.id, seg.state.msg_count,
+             [msg['msgid'] for msg in seg]) for seg in segs]
+
+
+def _state(**kwargs):
+    ts = datetime.datetime(2017, 1, 1, 12, 30, 15, 123456)
+    first_msg = {'ssvid': 'abc', 'timestamp': ts, 'lat': 1.5, 'lon': -2.25,
+                 'speed': 10.0, 'course': 359.9, 'type': 'AIS.18', 'metric': 0.5,
+                 'shipnames': {'BOAT': 1}}
+    last_msg = {'ssvid': 'abc', 'timestamp': ts + datetime.timedelta(hours=1),
+                'lat': 1.75, 'lon': -2.0, 'speed': None, 'course': 10,
+                'type': 'VMS-X'}
+    state = dict(id=7, ssvid='abc', first_msg=first_msg, last_msg=last_msg,
+                 first_msg_of_day=first_msg, last_msg_of_day=last_msg,
+                 msg_count=12, noise=False, closed=True)
+    state.update(kwargs)
+    return SegmentState(**state)
+
+
+def test_round_trip():
+    state = _state()
+    [decoded] = decode_states(encode_states([state]))
+    assert decoded.id == 7
+    assert decoded.ssvid == 'abc'
+    assert decoded.msg_count == 12
+    assert decoded.closed and not decoded.noise
+    assert decoded.first_msg_of_day is None and decoded.last_msg_of_day is None
+    assert decoded.first_msg == {'ssvid': 'abc', 'timestamp': state.first_msg['timestamp'],
+                                 'lat': 1.5, 'lon': -2.25, 'speed': 10.0,
+                                 'course': 359.9, 'type': 'AIS.18', 'metric': 0.5}
+    assert decoded.last_msg == {'ssvid': 'abc', 'timestamp': state.last_msg['timestamp'],
+                                'lat': 1.75, 'lon': -2.0, 'speed': None,
+                                'course': 10.0, 'type': 'VMS-X'}
+
+    # Default ids, integer ssvid, aware timestamps, a missing message and dicts
+    ts = pytz.timezone('Europe/Paris').localize(datetime.datetime(2017, 6, 1, 12))
+    first_msg = dict(state.first_msg, timestamp=ts, type=None)
+    state = _state(id='123-2017-06-01T10:00:00.000000Z', ssvid=123, first_msg=first_msg,
+                   last_msg=None, noise=True, closed=False)
+    [decoded] = decode_states(encode_states([state._asdict()]))
+    assert decoded.id == state.id
+    assert decoded.ssvid == 123
+    assert decoded.noise and not decoded.closed
+    assert decoded.last_msg is None
+    assert decoded.first_msg['timestamp'] == ts
+    assert decoded.first_msg['timestamp'].utcoffset() == datetime.timedelta(0)
+    assert decoded.first_msg['type'] is None
+
+
+def test_from_seg_states():
+    msgs = _load('tests/data/416000000.json')
+    first, second = msgs[:800], msgs[800:]
+    states = [seg.state for seg in Segmentizer([x.copy() for x in first])]
+    expected = _summarize(Segmentizer.from_seg_states(states, [x.copy() for x in second]))
+
+    data = encode_states(states)
+    decoded = decode_states(data)
+    assert [x.id for x in decoded] == [x.id for x in states]
+    assert len(data) < 200 * len(states)
+    actual = _summarize(Segmentizer.from_seg_states(decoded, [x.copy() for x in second]))
+    assert actual == expected
+
+
+def test_streaming(tmpdir):
+    path = str(tmpdir.join('states.bin'))
+    states = [_state(id=i, msg_count=i) for i in range(1000)]
+    with io.open(path, 'wb') as f:
+        assert write_states(iter(states), f) == 1000
+    with io.open(path, 'rb') as f:
+        reader = read_states(f)
+        assert [x.id for x in it.islice(reader, 10)] == list(range(10))
+        assert [x.msg_count for x in reader] == list(range(10, 1000))
+
+
+def test_errors():
+    data = encode_states([_state()])
+    with pytest.raises(ValueError):
+        decode_states(b'garbage' + data)
+    with pytest.raises(ValueError):
+        # Unknown version
+        decode_states(data[:9] + b'\xff' + data[10:])
+    with pytest.raises(ValueError):
+        decode_states(data[:-1])
+    state = _state()
+    mixed = dict(state.last_msg,
+                 timestamp=state.last_msg['timestamp'].replace(tzinfo=pytz.utc))
+    with pytest.raises(ValueError):
+        encode_states([state._replace(last_msg=mixed)])
@@ -0,0 +1,123 @@
+"""
+Tests for the commandline interface.
+"""
+
+
+import datetime
+import gzip
+import io
+import json
+
+from click.testing import CliRunner
+import pytest
+
+from gpsdio_segment.cli import parse_timestamp
+from gpsdio_segment.cli import segment
+from gpsdio_segment.core import Segmentizer
+
+from support import read_json
+
+
+def _write_input(path, files, identities=()):
+    # Several fixtures interleaved into one time sorted file
+    msgs = list(identities)
+    for name in files:
+        with open('tests/data/{}.json'.format(name)) as f:
+            for i, line in enumerate(f):
+                msg = json.loads(line)
+                msg['type'] = 'AIS.1'
+                msg['msgid'] = '{}-{}'.format(name, i)
+                msgs.append(msg)
+    msgs.sort(key=lambda x: parse_timestamp(x['timestamp']))
+    opener = gzip.open if path.endswith('.gz') else io.open
+    with opener(path, 'wt') as f:
+        for msg in msgs:
+            f.write(u'{}\n'.format(json.dumps(msg)))
+    return len(msgs)
+
+
+def _read_output(path):
+    opener = gzip.open if path.endswith('.gz') else io.open
+    with opener(path, 'rt') as f:
+        return [json.loads(line) for line in f]
+
+
+def _expected_segments(name):
+    with open('tests/data/{}.json'.format(name)) as f:
+        msgs = list(read_json(f))
+    for msg in msgs:
+        msg['type'] = 'AIS.1'
+    expected = []
+    for seg in Segmentizer(msgs):
+        for msg in seg:
+            expected.append((msg['timestamp'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                             None if seg.noise else seg.id))
+    return sorted(expected)
+
+
+def test_parse_timestamp():
+    expected = datetime.datetime(2017, 1, 2, 3, 4, 5, 123000)
+    for value in ['2017-01-02T03:04:05.123Z', '2017-01-02 03:04:05.123000',
+                  '2017-01-02T03:04:05.123000000Z', '2017-01-02T05:04:05.123+02:00',
+                  '2017-01-02T02:34:05.123-0030']:
+        assert parse_timestamp(value) == expected
+    assert parse_timestamp('2017-01-02T03:04:05') == expected.replace(microsecond=0)
+    with pytest.raises(ValueError):
+        parse_timestamp('yesterday')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_segment(tmpdir, workers):
+    infile = str(tmpdir.join('in.json.gz'))
+    outfile = str(tmpdir.join('out.json'))
+    _write_input(infile, ['338013000', '416000000'])
+    result = CliRunner().invoke(segment, [infile, outfile, '--workers', str(workers),
+                                          '--segment-field', 'seg'])
+    assert result.exit_code == 0, result.output
+    output = _read_output(outfile)
+    for name in ['338013000', '416000000']:
+        expected = _expected_segments(name)
+        actual = [(x['timestamp'], x['seg']) for x in output if str(x['ssvid']) == name]
+        assert sorted(actual) == expected
+
+
+def test_segment_mmsi(tmpdir):
+    infile = str(tmpdir.join('in.json'))
+    outfile = str(tmpdir.join('out.json.gz'))
+    _write_input(infile, ['338013000', '416000000'])
+    result = CliRunner().invoke(segment, [infile, outfile, '--mmsi', '416000000'])
+    assert result.exit_code == 0, result.output
+    output = _read_output(outfile)
+    assert {x['ssvid'] for x in output} == {416000000}
+    assert (sorted((x['timestamp'], x['segment']) for x in output) == 
+            _expected_segments('416000000'))
+
+
+def test_segment_unsorted(tmpdir):
+    infile = str(tmpdir.join('in.json'))
+    outfile = str(tmpdir.join('out.json'))
+    _write_input(infile, ['338013000'])
+    with io.open(infile) as f:
+        lines = f.readlines()
+    with io.open(infile, 'w') as f:
+        f.writelines(lines[::-1])
+    for workers in ['1', '2']:
+        result = CliRunner().invoke(segment, [infile, outfile, '--workers', workers])
+        assert result.exit_code != 0
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_segment_identity(tmpdir, workers):
+    infile = str(tmpdir.join('in.json'))
+    outfile = str(tmpdir.join('out.json'))
+    identity = {'ssvid': 416000000, 'timestamp': '2014-01-01T01:14:00.000000Z',
+                'type': 'AIS.5', 'msgid': 'identity', 'shipname': 'BOAT',
+                'callsign': 'ABC123', 'imo': 9000001}
+    _write_input(infile, ['416000000'], [identity])
+    result = CliRunner().invoke(segment, [infile, outfile, '--workers', str(workers)])
+    assert result.exit_code == 0, result.output
+    output = _read_output(outfile)
+    annotated = [x for x in output if x['imos']]
+    assert annotated
+    assert all(x['imos'] == {'9000001': 1} for x in annotated)
+    assert all(x['shipnames'] == {'BOAT': 1} for x in annotated)
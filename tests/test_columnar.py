@@ -0,0 +1,109 @@
+"""
+Tests for columnar segment storage.
+"""
+
+
+from datetime import datetime
+from datetime import timedelta
+import itertools as it
+
+import pytest
+import pytz
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.discrepancy import KINEMATICS_FIELD
+from gpsdio_segment.discrepancy import Kinematics
+from gpsdio_segment.segment import ColumnarSegment
+
+from support import read_json
+
+
+def _msg(i, **kwargs):
+    msg = {'msgid': i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 1.5, 'lon': 2, 
+           'course': 90.0, 'speed': 3.25, 'shipnames': {}, 'heading': None,
+           'timestamp': datetime(2017, 1, 1, tzinfo=pytz.utc) + timedelta(minutes=i)}
+    msg.update(kwargs)
+    return msg
+
+
+def test_columnar_segment_round_trip():
+    seg = ColumnarSegment(1, 1)
+    msgs = [_msg(0), _msg(1, metric=0.5, type='AIS.18', extra='x'), _msg(2)]
+    for msg in msgs:
+        seg.add_msg(msg.copy())
+    assert len(seg) == 3
+    assert seg.msgs == msgs
+    assert type(seg.msgs[0]['lon']) is int
+    assert seg.last_msg == msgs[-1]
+    assert seg.first_msg == msgs[0]
+    assert seg.state.msg_count == 3
+
+
+def test_columnar_msg_view():
+    seg = ColumnarSegment(1, 1)
+    for i in range(3):
+        seg.add_msg(_msg(i, metric=0.1 * i if i else None))
+
+    views = list(seg.get_all_reversed_msgs())
+    assert [x['msgid'] for x in views] == [2, 1, 0]
+    view = views[0]
+    assert view['lat'] == 1.5
+    assert view['type'] == 'AIS.1'
+    assert view['timestamp'] == _msg(2)['timestamp']
+    assert view.get('metric', 0) == pytest.approx(0.2)
+    assert views[2].get('metric', 0) == 0
+    assert view.get('missing', 'default') == 'default'
+    with pytest.raises(KeyError):
+        view['missing']
+    with pytest.raises(KeyError):
+        view['lat'] = 0
+
+    view['drop'] = True
+    assert [x['msgid'] for x in seg.get_all_reversed_msgs()] == [1, 0]
+    assert [x.get('drop', False) for x in seg.msgs] == [False, False, True]
+
+
+def test_columnar_kinematics():
+    seg = ColumnarSegment(1, 1)
+    msg = _msg(0, course=45.0)
+    expected = Kinematics(msg['lon'], msg['lat'], msg['course'], msg['speed'])
+    seg.add_msg(dict(msg, **{KINEMATICS_FIELD: expected}))
+    seg.add_msg(_msg(1, course=360.0, speed=0.1))
+    assert KINEMATICS_FIELD not in seg.msgs[0]
+
+    [slow, view] = seg.get_all_reversed_msgs()
+    kinematics = view[KINEMATICS_FIELD]
+    for k in Kinematics.__slots__:
+        assert getattr(kinematics, k) == getattr(expected, k)
+    assert kinematics.expected_position(2) == expected.expected_position(2)
+    assert slow[KINEMATICS_FIELD].expected_speed == 0
+
+
+def test_columnar_types_per_segment():
+    segs = [ColumnarSegment(i, 1) for i in range(2)]
+    segs[0].add_msg(_msg(0, type='AIS.18'))
+    segs[1].add_msg(_msg(1))
+    segs[1].add_msg(_msg(2, type='AIS.18'))
+    assert segs[0].types == ['AIS.18']
+    assert segs[1].types == ['AIS.1', 'AIS.18']
+    assert [x['type'] for x in segs[1].msgs] == ['AIS.1', 'AIS.18']
+
+
+def _run_daily(msgs, **kwargs):
+    # Run one day at a time to include segments continued from states
+    states = []
+    output = []
+    for day, group in it.groupby([x.copy() for x in msgs], 
+                                 key=lambda x: x['timestamp'].day):
+        segs = list(Segmentizer.from_seg_states(states, group, **kwargs))
+        states = [seg.state for seg in segs]
+        output.extend((seg.__class__.__name__, seg.id, seg.msgs) for seg in segs)
+    return output
+
+
+@pytest.mark.parametrize('path', ['tests/data/338013000.json',
+                                  'tests/data/416000000.json'])
+def test_columnar_same_segments(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    assert _run_daily(msgs, columnar=True) == _run_daily(msgs)
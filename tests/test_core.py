@@ -8,6 +8,7 @@ from __future__ import division
 import datetime
 
 import pytest
+import pytz
 
 import gpsdio_segment.core
 
@@ -90,3 +91,88 @@ def test_last_msg_combinations():
     seg.add_msg(time_posit)
     seg.add_msg(non_posit)
     assert seg.last_msg == non_posit
+
+
+def _spoofed_msgs(n_vessels, n_msgs, minutes=10):
+    # Vessels far apart sharing an MMSI, each reporting in turn
+    t = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+    for i in range(n_msgs):
+        vessel = i % n_vessels
+        yield {'msgid': i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 0, 
+               'lon': 10 * vessel + 0.001 * i, 'course': 90, 'speed': 1,
+               'timestamp': t + datetime.timedelta(minutes=minutes * i)}
+
+
+def test_max_open_segments_evicts_stalest():
+    segmenter = gpsdio_segment.core.Segmentizer(_spoofed_msgs(8, 80), max_open_segments=5)
+    segs = list(segmenter)
+    closed = [seg for seg in segs if seg.closed]
+    # Vessels are evicted round robin, so each closed segment holds one point
+    assert len(closed) == 75
+    assert all(len(seg) == 1 for seg in closed)
+    assert [seg.msgs[0]['msgid'] for seg in closed] == list(range(75))
+    assert len([seg for seg in segs if not seg.closed]) == 5
+
+
+def test_expired_segments_in_opened_order():
+    msgs = list(_spoofed_msgs(4, 12))
+    # Vessel 1 reports once more, after the others have been silent for a long time
+    late = msgs[5].copy()
+    late['msgid'] = 100
+    late['timestamp'] = msgs[-1]['timestamp'] + datetime.timedelta(hours=9)
+    late['lon'] += 0.01
+    segmenter = gpsdio_segment.core.Segmentizer([])
+    segs = []
+    for msg in msgs + [late]:
+        segs.extend(segmenter.process_msg(msg))
+    # Heap entries of closed segments are discarded as they expire
+    assert len(segmenter._segment_heap) == 1
+    segs.extend(segmenter.close_all())
+    assert [seg.id for seg in segs] == sorted(seg.id for seg in segs)
+    assert [seg.closed for seg in segs] == [True, True, True, True, False]
+
+
+def test_epoch_delta_hours_matches_timedelta():
+    calc = gpsdio_segment.core.Segmentizer([])
+    t = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+    eastern = pytz.timezone('US/Eastern')
+    for i in range(1000):
+        ts1 = t + datetime.timedelta(seconds=i * 7919, microseconds=i * 104729)
+        ts2 = ts1 + datetime.timedelta(seconds=i * 31, microseconds=i * 7)
+        msg1 = {'timestamp': ts1}
+        msg2 = {'timestamp': ts2.astimezone(eastern)}
+        # Exactly equal, not just close
+        assert (calc.compute_msg_delta_hours(msg1, msg2) ==
+                calc.compute_ts_delta_hours(ts1, ts2))
+        msg1[gpsdio_segment.core.EPOCH_FIELD] = calc.msg_epoch(msg1)
+        assert (calc.compute_msg_delta_hours(msg1, msg2) ==
+                calc.compute_ts_delta_hours(ts1, ts2))
+    naive = datetime.datetime(2017, 1, 1, 12)
+    assert (gpsdio_segment.core.epoch_microseconds(naive) == 
+            gpsdio_segment.core.epoch_microseconds(naive.replace(tzinfo=pytz.utc)))
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_internal_fields_removed(columnar):
+    internal = {gpsdio_segment.core.EPOCH_FIELD, gpsdio_segment.core.KINEMATICS_FIELD}
+    msgs = list(_spoofed_msgs(3, 30))
+    segs = list(gpsdio_segment.core.Segmentizer(msgs, columnar=columnar))
+    assert sum(len(seg) for seg in segs) == 30
+    for seg in segs:
+        for msg in seg.msgs:
+            assert not internal & set(msg)
+        assert not internal & set(seg.state.last_msg)
+    for msg in msgs:
+        assert not internal & set(msg)
+
+
+def test_segment_unique_id():
+    segmenter = gpsdio_segment.core.Segmentizer([])
+    t = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+    for i in range(100):
+        ts = t + datetime.timedelta(seconds=i * 7919, microseconds=i * 104729)
+        assert (segmenter._segment_unique_id({'ssvid': 1, 'timestamp': ts}) ==
+                '1-{:%Y-%m-%dT%H:%M:%S.%fZ}'.format(ts))
+    msg = {'ssvid': 1, 'timestamp': t + datetime.timedelta(microseconds=999500)}
+    segmenter._segments['1-2017-01-01T00:00:00.999500Z'] = None
+    assert segmenter._segment_unique_id(msg) == '1-2017-01-01T00:00:01.000500Z'
@@ -0,0 +1,136 @@
+"""
+Tests for duplicate detection.
+"""
+
+
+from datetime import datetime
+from datetime import timedelta
+import pickle
+
+import pytest
+import pytz
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.dedup import ExpiringDict
+from gpsdio_segment.dedup import MsgidFilter
+
+
+def test_expiring_dict():
+    t = datetime(2017, 1, 1)
+    d = ExpiringDict(timedelta(hours=1))
+    d['a'] = t
+    d['b'] = t + timedelta(minutes=30)
+    d['a'] = t + timedelta(minutes=40)
+    assert list(d) == ['b', 'a']
+    d.expire(t + timedelta(minutes=90))
+    assert list(d) == ['b', 'a']
+    d.expire(t + timedelta(minutes=91))
+    assert list(d) == ['a']
+    d.expire(t + timedelta(hours=10))
+    assert len(d) == 0
+
+    d['c'] = t
+    assert pickle.loads(pickle.dumps(d)).max_age == d.max_age
+    assert d.copy() == d
+
+
+def test_expiring_dict_never_expires():
+    t = datetime(2017, 1, 1)
+    d = ExpiringDict()
+    d['a'] = t
+    d['b'] = t
+    d['a'] = t + timedelta(days=1)
+    d.expire(t + timedelta(days=1000))
+    assert sorted(d) == ['a', 'b']
+
+
+def _msgs(n, interval=timedelta(hours=1)):
+    t = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    for i in range(n):
+        yield {'msgid': i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 0, 'lon': 0.1 * i, 
+               'course': 90, 'speed': 6, 'timestamp': t + i * interval}
+
+
+def test_dedup_hours_bounds_tables():
+    segmentizer = Segmentizer(_msgs(100), dedup_hours=10)
+    segs = list(segmentizer)
+    assert sum(len(x) for x in segs) == 100
+    assert sorted(segmentizer.cur_msgids) == list(range(89, 100))
+    assert len(segmentizer.cur_locations) == 11
+
+    segmentizer = Segmentizer(_msgs(100))
+    list(segmentizer)
+    assert len(segmentizer.cur_msgids) == 100
+    assert len(segmentizer.cur_locations) == 100
+    assert type(segmentizer.cur_msgids) is dict
+
+
+def test_dedup_hours_duplicates():
+    msgs = list(_msgs(30))
+    # Repeat msgid 0 one hour later and msgid 5 twenty hours later
+    msgs[1]['msgid'] = 0
+    msgs[25]['msgid'] = 5
+    segs = list(Segmentizer([x.copy() for x in msgs], dedup_hours=10))
+    assert sum(len(x) for x in segs) == 29
+    segs = list(Segmentizer([x.copy() for x in msgs]))
+    assert sum(len(x) for x in segs) == 28
+
+
+def test_msgid_filter():
+    t = datetime(2017, 1, 1)
+    seen = MsgidFilter(capacity=1000, error_rate=0.01, partition_hours=24,
+                       max_age_hours=48)
+    seen.update(('a{}'.format(i), t + timedelta(minutes=i)) for i in range(1000))
+    seen.add(5, t)
+    assert all('a{}'.format(i) in seen for i in range(1000))
+    assert 5 in seen and '5' not in seen
+    assert sum('b{}'.format(i) in seen for i in range(10000)) < 100
+    assert len(seen) == 1
+
+    seen.add('c', t + timedelta(days=2))
+    assert len(seen) == 2 and 'a1' in seen
+    # Partitions are dropped once they end `max_age_hours` before the newest
+    seen.add('d', t + timedelta(days=3))
+    assert len(seen) == 2 and 'a1' not in seen
+    # And too old msgids are ignored without creating a partition for them
+    partitions = seen._partitions
+    seen.add('e', t)
+    assert 'e' not in seen
+    assert seen._partitions is partitions and len(seen) == 2
+    assert 'c' in seen and 'd' in seen
+
+
+def test_msgid_filter_save_load(tmpdir):
+    path = str(tmpdir.join('msgids.bin'))
+    t = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    seen = MsgidFilter(capacity=100)
+    seen.update((i, t + timedelta(hours=i)) for i in range(50))
+    seen.save(path)
+
+    loaded = MsgidFilter.load(path)
+    assert len(loaded) == len(seen)
+    assert all(i in loaded for i in range(50))
+    loaded.add('x', t)
+    assert 'x' in loaded
+    # Drops all of the earlier partitions
+    loaded.add('y', t + timedelta(days=10))
+    assert 'y' in loaded and 'x' not in loaded and 3 not in loaded
+    # The file is only changed by `save()`
+    assert 'x' not in MsgidFilter.load(path)
+    loaded.save(path)
+    assert 'x' not in loaded and 'y' in MsgidFilter.load(path)
+
+    with open(path, 'wb') as f:
+        f.write(b'nonsense')
+    with pytest.raises(ValueError):
+        MsgidFilter.load(path)
+
+
+def test_msgid_filter_across_runs():
+    msgs = list(_msgs(30))
+    seen = MsgidFilter(capacity=100)
+    first = list(Segmentizer([x.copy() for x in msgs[:20]], prev_msgids=seen))
+    seen.update((msg['msgid'], msg['timestamp']) for seg in first for msg in seg)
+    # The second run overlaps the first
+    second = list(Segmentizer([x.copy() for x in msgs[10:]], prev_msgids=seen))
+    assert sorted(msg['msgid'] for seg in second for msg in seg) == list(range(20, 30))
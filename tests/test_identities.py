@@ -1,6 +1,12 @@
 """Test application of identities"""
 from datetime import datetime, timedelta
 from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.core import INFO_PING_INTERVAL_MINS
+from gpsdio_segment.identity import EMPTY
+from gpsdio_segment.identity import FrozenDict
+from gpsdio_segment.identity import IdentityIndex
+import pickle
+import pytest
 import pytz
 
 class _MsgGenerator(object):
@@ -91,3 +97,88 @@ def test_multiple_identities():
         {}, {}, {}
     ]
 
+
+
+def _identity_messages(n=200):
+    gen = _MsgGenerator(interval=timedelta(minutes=1))
+    messages = []
+    for i in range(n):
+        if i % 3:
+            messages.append(gen.make_position_message())
+        else:
+            msg = gen.make_identity_message(['a', 'b', 'c'][i % 7 % 3])
+            msg['callsign'] = ['x', 'y'][i % 2]
+            msg['n_callsign'] = msg['callsign'].upper()
+            messages.append(msg)
+    return messages
+
+
+def test_identity_index_matches_legacy():
+    messages = _identity_messages()
+    legacy = {}
+    index = IdentityIndex(INFO_PING_INTERVAL_MINS)
+    for msg in messages:
+        Segmentizer.store_info(legacy, msg)
+        Segmentizer.store_info(index, msg)
+    # Every observation is stored exactly once
+    assert len(index) == len([x for x in messages if x['type'] == 'AIS.5'])
+
+    from_legacy = Segmentizer([], prev_info=legacy)
+    from_index = Segmentizer([], prev_info=index)
+    for msg in messages:
+        if msg['type'] == 'AIS.1':
+            a = msg.copy()
+            b = msg.copy()
+            from_legacy.add_info(a)
+            from_index.add_info(b)
+            for k in ['shipnames', 'callsigns', 'imos', 
+                      'n_shipnames', 'n_callsigns', 'n_imos']:
+                assert a[k] == b[k]
+            assert sum(b['n_callsigns'].values()) == sum(b['callsigns'].values())
+
+
+def test_identity_index_expires():
+    first = _identity_messages()
+    second = _identity_messages()
+    for msg in second:
+        msg['msgid'] += len(first)
+        msg['timestamp'] += timedelta(hours=12)
+    segmentizer = Segmentizer(first + second)
+    segments = [x for x in segmentizer if not x.noise]
+    assert len(segments) == 2
+    # Info from the first batch is dropped once its segment is closed
+    n_info = len([x for x in second if x['type'] == 'AIS.5'])
+    assert len(segmentizer.cur_info) == n_info
+    for seg in segments:
+        names = [x['shipnames'] for x in seg.msgs]
+        assert all(sum(x.values()) == 10 for x in names[20:-20])
+
+
+def test_identity_annotations_shared():
+    gen = _MsgGenerator(interval=timedelta(seconds=1))
+    info = gen.make_identity_message('a')
+    positions = [gen.make_position_message() for _ in range(5)]
+    lone = dict(positions[0], type='UNKNOWN')
+    segmentizer = Segmentizer([])
+    Segmentizer.store_info(segmentizer.cur_info, info)
+    for msg in positions + [lone]:
+        segmentizer.add_info(msg)
+    # Messages in the same minute share the same counts
+    assert positions[0]['shipnames'] == {'a': 1}
+    assert all(x['shipnames'] is positions[0]['shipnames'] for x in positions)
+    assert positions[0]['callsigns'] is EMPTY
+    assert lone['shipnames'] is EMPTY
+    with pytest.raises(TypeError):
+        positions[0]['shipnames']['b'] = 1
+    with pytest.raises(TypeError):
+        EMPTY.update(b=1)
+    assert positions[0]['shipnames'].copy() == {'a': 1}
+    restored = pickle.loads(pickle.dumps(positions[0]['shipnames']))
+    assert isinstance(restored, FrozenDict) and restored == {'a': 1}
+
+    # New info invalidates the cached counts
+    Segmentizer.store_info(segmentizer.cur_info, gen.make_identity_message('b'))
+    msg = positions[0].copy()
+    segmentizer.add_info(msg)
+    assert msg['shipnames'] == {'a': 1, 'b': 1}
+    assert positions[0]['shipnames'] == {'a': 1}
@@ -0,0 +1,156 @@
+"""
+Tests for segmenting streams with multiple ssvid.
+"""
+
+
+from datetime import datetime
+from datetime import timedelta
+import itertools as it
+
+import pytest
+import pytz
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.multi import MultiSegmentizer
+
+from support import read_json
+
+
+FIXTURES = ['tests/data/263576000.json', 
+            'tests/data/338013000.json', 
+            'tests/data/416000000.json']
+
+
+def _load_shifted(path, start):
+    # Shift all fixtures to start at the same time so the streams overlap
+    with open(path) as f:
+        msgs = list(read_json(f))
+    delta = start - msgs[0]['timestamp']
+    for i, msg in enumerate(msgs):
+        msg['timestamp'] += delta
+        msg['msgid'] = '{}-{}'.format(msg['ssvid'], i)
+    return msgs
+
+
+def _summarize(segs):
+    return [(seg.__class__.__name__, seg.id, [msg['msgid'] for msg in seg]) 
+                for seg in segs]
+
+
+def _ignore_open(summary):
+    # Open segments of vessels that went silent early are emitted as closed
+    return [('ClosedSegment' if cname == 'Segment' else cname, id_, msgids) 
+                for (cname, id_, msgids) in summary]
+
+
+def test_multi_matches_individual_runs():
+    start = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    streams = [_load_shifted(path, start) for path in FIXTURES]
+    merged = sorted(it.chain(*[[x.copy() for x in s] for s in streams]), 
+                    key=lambda x: x['timestamp'])
+
+    segmentizer = MultiSegmentizer(merged)
+    actual = _summarize(segmentizer)
+    for stream in streams:
+        ssvid = stream[0]['ssvid']
+        expected = _summarize(Segmentizer([x.copy() for x in stream]))
+        from_multi = [x for x in actual if x[1].startswith(str(ssvid))]
+        assert sorted(_ignore_open(from_multi)) == sorted(_ignore_open(expected))
+    # The vessel that is still active at the end keeps its open segment
+    assert [x[1] for x in actual if x[0] == 'Segment'] == [
+                x[1] for x in _summarize(Segmentizer([x.copy() for x in streams[2]])) 
+                    if x[0] == 'Segment']
+
+
+def test_multi_releases_idle_ssvid():
+    t = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    msgs = []
+    for i in range(10):
+        msgs.append({'msgid': i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 0, 'lon': 0.001 * i, 
+                     'course': 90, 'speed': 1, 'timestamp': t + timedelta(minutes=i)})
+    for i in range(10):
+        msgs.append({'msgid': 10 + i, 'ssvid': 2, 'type': 'AIS.1', 'lat': 0, 'lon': 0.001 * i, 
+                     'course': 90, 'speed': 1, 'timestamp': t + timedelta(hours=9, minutes=i)})
+
+    segmentizer = MultiSegmentizer(msgs)
+    output = []
+    for seg in segmentizer:
+        output.append(seg)
+        if seg.ssvid == 1:
+            # Vessel 1 is released as soon as vessel 2 shows up 9 hours later
+            assert 1 not in segmentizer.active_ssvids
+    assert _summarize(output) == [
+        ('ClosedSegment', '1-2017-01-01T00:00:00.000000Z', list(range(10))),
+        ('Segment', '2-2017-01-01T09:00:00.000000Z', list(range(10, 20)))]
+
+
+@pytest.mark.parametrize('dedup_hours', [None, 1, 24])
+def test_multi_duplicates_after_release(dedup_hours):
+    t = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    msgs = []
+    for i in range(10):
+        msgs.append({'msgid': i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 0, 'lon': 0.001 * i,
+                     'course': 90, 'speed': 1, 'timestamp': t + timedelta(minutes=i)})
+    for i in range(10):
+        msgs.append({'msgid': 10 + i, 'ssvid': 2, 'type': 'AIS.1', 'lat': 0, 'lon': 0.001 * i,
+                     'course': 90, 'speed': 1, 'timestamp': t + timedelta(hours=9, minutes=i)})
+    # Vessel 1 shows up again after being released, repeating msgids and
+    # locations it already sent
+    for i in range(5):
+        msgs.append({'msgid': i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 0, 'lon': 0.5 + 0.001 * i,
+                     'course': 90, 'speed': 1, 'timestamp': t + timedelta(hours=10, minutes=i)})
+        msgs.append({'msgid': 100 + i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 0, 'lon': 0.001 * i,
+                     'course': 90, 'speed': 1, 'timestamp': t + timedelta(hours=10, minutes=i)})
+
+    actual = _summarize(x for x in MultiSegmentizer([x.copy() for x in msgs],
+                                                    dedup_hours=dedup_hours)
+                            if x.ssvid == 1)
+    expected = _summarize(Segmentizer([x.copy() for x in msgs if x['ssvid'] == 1],
+                                      dedup_hours=dedup_hours))
+    assert _ignore_open(actual) == _ignore_open(expected)
+    n_msgs = sum(len(msgids) for (_, _, msgids) in actual)
+    assert n_msgs == (20 if dedup_hours == 1 else 10)
+
+
+@pytest.mark.parametrize('dedup_hours', [None, 4])
+def test_multi_released_dedup_bounded(dedup_hours):
+    # Each ssvid only shows up for a few minutes
+    t = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    msgs = []
+    for i in range(2000):
+        for j in range(3):
+            msgs.append({'msgid': (i, j), 'ssvid': i, 'type': 'AIS.1', 'lat': 0,
+                         'lon': 0.001 * j, 'course': 90, 'speed': 1,
+                         'timestamp': t + timedelta(minutes=10 * i + j)})
+
+    segmentizer = MultiSegmentizer(msgs, dedup_hours=dedup_hours)
+    n_released = []
+    for seg in segmentizer:
+        n_released.append(len(segmentizer._released))
+    # About `max_hours` or `dedup_hours` worth of vessels, 6 per hour
+    assert 0 < max(n_released) <= 6 * (dedup_hours or 8) + 6
+
+
+def test_multi_seg_states():
+    start = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    streams = [_load_shifted(path, start) for path in FIXTURES]
+    merged = sorted(it.chain(*streams), key=lambda x: x['timestamp'])
+    split = start + timedelta(days=1)
+    first = [x for x in merged if x['timestamp'] < split]
+    second = [x for x in merged if x['timestamp'] >= split]
+
+    states = [seg.state for seg in MultiSegmentizer(first)]
+    open_ids = {x.id for x in states if not x.closed}
+    assert open_ids
+
+    segs = list(MultiSegmentizer(second, seg_states=states))
+    continued = {seg.id for seg in segs if seg.has_prev_state}
+    assert continued == open_ids
+
+
+def test_multi_unsorted():
+    t = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    msgs = [{'msgid': 1, 'ssvid': 1, 'type': 'AIS.1', 'timestamp': t},
+            {'msgid': 2, 'ssvid': 2, 'type': 'AIS.1', 'timestamp': t - timedelta(seconds=1)}]
+    with pytest.raises(ValueError):
+        list(MultiSegmentizer(msgs))
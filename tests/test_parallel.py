@@ -0,0 +1,61 @@
+"""
+Tests for segmenting many ssvid in parallel.
+"""
+
+
+import itertools as it
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.parallel import segment_parallel
+
+from support import read_json
+
+
+FIXTURES = ['tests/data/263576000.json', 
+            'tests/data/338013000.json', 
+            'tests/data/416000000.json']
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _summarize(segs):
+    return [(seg.__class__.__name__, seg.id, seg.state.msg_count, 
+             [(msg['msgid'], msg['shipnames']) for msg in seg]) for seg in segs]
+
+
+def test_parallel_matches_serial():
+    inputs = [(int(path[-14:-5]), _load(path)) for path in FIXTURES]
+    expected = [(ssvid, _summarize(Segmentizer(msgs))) for (ssvid, msgs) in inputs]
+
+    inputs = [(int(path[-14:-5]), _load(path)) for path in FIXTURES]
+    actual = [(ssvid, _summarize(segs)) for (ssvid, segs) 
+                    in segment_parallel(inputs, max_workers=2)]
+    assert actual == expected
+
+    inputs = dict((int(path[-14:-5]), _load(path)) for path in FIXTURES)
+    actual = [(ssvid, _summarize(segs)) for (ssvid, segs) 
+                    in segment_parallel(inputs, max_workers=1)]
+    assert sorted(actual) == sorted(expected)
+
+
+def test_parallel_seg_states():
+    msgs = _load('tests/data/263576000.json')
+    ssvid = msgs[0]['ssvid']
+    first, second = [list(group) for (_, group) in 
+                        it.groupby(msgs, key=lambda x: x['timestamp'].date())]
+    states = [seg.state for seg in Segmentizer(first)]
+    expected = _summarize(Segmentizer.from_seg_states(states, second))
+
+    [(_, actual), (other, other_segs)] = list(segment_parallel(
+                                [(ssvid, second)], seg_states={ssvid: states, 1: states},
+                                max_workers=2))
+    assert _summarize(actual) == expected
+    # ssvid with only states still have their open segments emitted
+    assert other == 1
+    assert [seg.id for seg in other_segs] == [x.id for x in states if not x.closed]
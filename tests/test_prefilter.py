@@ -0,0 +1,65 @@
+"""
+Tests for skipping unreachable lookback candidates with `prefilter=True`.
+"""
+
+
+import random
+
+import pytest
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.discrepancy import DiscrepancyCalculator
+from gpsdio_segment.synthetic import SyntheticAIS
+
+from support import read_json
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _summarize(segs):
+    return [(seg.__class__.__name__, seg.id, [msg['msgid'] for msg in seg])
+                for seg in segs]
+
+
+def test_bound():
+    calc = DiscrepancyCalculator()
+    rng = random.Random(0)
+    n_exceeded = 0
+    for _ in range(20000):
+        lat = rng.uniform(-89, 89)
+        lon = rng.uniform(-180, 180)
+        spread = rng.choice([0.001, 0.1, 1, 10])
+        pair = []
+        for (x, y) in [(lon, lat), (lon + rng.gauss(0, spread), lat + rng.gauss(0, spread))]:
+            speed = rng.choice([0, 0.2, 5, 15, 25])
+            course = 360.0 if (speed < 0.35 and rng.random() < 0.5) else rng.uniform(0, 359.9)
+            pair.append(calc.kinematics((x + 180) % 360 - 180, max(-90, min(90, y)), 
+                                        course, speed))
+        hours = rng.choice([0, 0.01, 1, 8]) * rng.random()
+        discrepancy = calc.compute_kinematic_discrepancy(pair[0], pair[1], hours)
+        limit = discrepancy * rng.choice([0.5, 1, 1.5])
+        # With the allowance for rounding used by `Segmentizer()`
+        if calc.kinematic_discrepancy_exceeds(pair[0], pair[1], hours, limit * (1 + 1e-9)):
+            assert discrepancy > limit
+            n_exceeded += 1
+    assert n_exceeded > 1000
+
+
+@pytest.mark.parametrize('msgs', [
+    _load('tests/data/416000000.json'),
+    list(SyntheticAIS(n_vessels=10, seed=4, outlier_rate=0.01).messages(3000))])
+def test_same_results(msgs):
+    expected = _summarize(Segmentizer([x.copy() for x in msgs], prefilter=False))
+    segmentizer = Segmentizer([x.copy() for x in msgs], prefilter=True, stats=True)
+    assert _summarize(segmentizer) == expected
+    assert segmentizer.stats.unreachable_candidates > 0
+
+    default = Segmentizer([x.copy() for x in msgs], stats=True)
+    assert _summarize(default) == expected
+    assert default.stats.unreachable_candidates == 0
@@ -0,0 +1,116 @@
+"""
+Tests for `Segmentizer(provisional=True)`.
+"""
+
+
+import pytest
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.segment import Assignment
+from gpsdio_segment.segment import DiscardedSegment
+from gpsdio_segment.segment import Retraction
+from gpsdio_segment.synthetic import SyntheticAIS
+
+from support import mixed_transponders
+from support import read_json
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _replay(msgs, **kwargs):
+    """
+    Collect the events of a provisional run into the segments they imply.
+    """
+    assigned = {}
+    retracted = set()
+    closed = {}
+    max_held = 0
+    segmentizer = Segmentizer([x.copy() for x in msgs], provisional=True, **kwargs)
+    for x in segmentizer:
+        if isinstance(x, Assignment):
+            assert '_epoch_us' not in x.msg and 'metric' not in x.msg
+            assigned.setdefault(x.seg_id, []).append(x.msg['msgid'])
+        elif isinstance(x, Retraction):
+            retracted.add(x.msg['msgid'])
+        elif not x.noise:
+            assert len(x) == 0
+            closed[x.id] = x
+        max_held = max([max_held] + [len(seg) for seg in segmentizer._segments.values()])
+    segments = dict((k, [i for i in v if i not in retracted]) for (k, v) in assigned.items())
+    return segments, retracted, closed, max_held
+
+
+@pytest.mark.parametrize('msgs,kwargs', [
+    (_load('tests/data/416000000.json'), {}),
+    (_load('tests/data/416000000.json'), {'max_hours': 1}),
+    (list(SyntheticAIS(n_vessels=3, seed=5, outlier_rate=0.02).messages(10000)),
+     {'max_hours': 0.5, 'lookback': 3})])
+def test_matches_batch(msgs, kwargs):
+    batch = list(Segmentizer([x.copy() for x in msgs], **kwargs))
+    segments, retracted, closed, max_held = _replay(msgs, **kwargs)
+
+    expected = dict((seg.id, [x['msgid'] for x in seg]) for seg in batch if not seg.noise)
+    assert dict((k, v) for (k, v) in segments.items() if v) == expected
+    assert retracted == set(x['msgid'] for seg in batch
+                                if isinstance(seg, DiscardedSegment) for x in seg)
+    for seg in batch:
+        if not seg.noise:
+            state = closed[seg.id].state
+            assert state.msg_count == seg.state.msg_count
+            assert state.closed == seg.closed
+            assert state.first_msg['msgid'] == seg.state.first_msg['msgid']
+            assert state.last_msg['msgid'] == seg.state.last_msg['msgid']
+    # Open segments only hold the messages that can still be matched
+    if kwargs:
+        assert max_held < len(msgs) / 10
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_mixed_transponders(seed):
+    # The transponder types of the segment include messages that are too
+    # old to be matched
+    msgs = mixed_transponders(seed)
+    batch = list(Segmentizer([x.copy() for x in msgs], max_hours=4))
+    segments, retracted, _, _ = _replay(msgs, max_hours=4)
+    expected = dict((seg.id, [x['msgid'] for x in seg]) for seg in batch if not seg.noise)
+    assert dict((k, v) for (k, v) in segments.items() if v) == expected
+
+    # Messages are matched with the same metrics
+    batch = Segmentizer(None, max_hours=4)
+    provisional = Segmentizer(None, max_hours=4, provisional=True)
+    for msg in msgs:
+        expected = msg.copy()
+        list(batch.process_msg(expected))
+        for x in provisional.process_msg(msg.copy()):
+            if isinstance(x, Assignment):
+                assert x.metric == expected.get('metric')
+
+
+def test_assignment_latency():
+    msgs = list(SyntheticAIS(n_vessels=1, seed=1, outlier_rate=0,
+                             duplicate_rate=0, bad_speed_rate=0).messages(1000))
+    segmentizer = Segmentizer(None, provisional=True)
+    for msg in msgs:
+        if 'lat' in msg:
+            events = list(segmentizer.process_msg(msg))
+            # Each position is assigned as soon as it is processed
+            assert [x.msg['msgid'] for x in events if isinstance(x, Assignment)] == \
+                   [msg['msgid']]
+    [seg] = list(segmentizer.close_all())
+    assert not seg.closed
+    assert seg.state.msg_count == len([x for x in msgs if 'lat' in x])
+
+    # The state can be used to continue
+    continued = Segmentizer.from_seg_states([seg.state], [], provisional=True)
+    assert list(continued._segments) == [seg.id]
+
+
+def test_columnar():
+    with pytest.raises(ValueError):
+        Segmentizer([], provisional=True, columnar=True)
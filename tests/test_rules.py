@@ -5,8 +5,10 @@ Unittests for specific segmentation rules.
 
 from datetime import datetime
 from datetime import timedelta
+import math
 
 from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.discrepancy import KINEMATICS_FIELD
 from support import utcify
 
 # deltas = [{'distance': 0, 'speed': 0, 'duration': 0}]
@@ -63,6 +65,27 @@ def test_good_speed_good_time():
         assert len(seg) == 2
 
 
+def test_kinematics_reused():
+    segmenter = Segmentizer([])
+    p1 = {'lat': 10, 'lon': 179.9, 'course': 45, 'speed': 12, 
+          'timestamp': datetime(2017, 1, 1)}
+    p2 = {'lat': 10.1, 'lon': -179.95, 'course': 360.0, 'speed': 0.1, 
+          'timestamp': datetime(2017, 1, 1, 0, 30)}
+    k1 = segmenter.msg_kinematics(p1)
+    k2 = segmenter.msg_kinematics(p2)
+    # Unknown heading, so not expected to move
+    assert k2.expected_position(2) == (p2['lon'], p2['lat'])
+    x, y = k1.expected_position(1)
+    assert abs(y - (10 + 12 * math.sqrt(0.5) / 60)) < 1e-12
+    assert x > p1['lon']
+    discrepancy = segmenter.compute_discrepancy(p1, p2)
+    assert discrepancy == segmenter.compute_kinematic_discrepancy(k1, k2, 0.5)
+    # Cached kinematics are used in place of the message fields
+    p1[KINEMATICS_FIELD] = k1
+    p1['course'] = 90
+    assert segmenter.compute_discrepancy(p1, p2) == discrepancy
+
+
 # TODO: add tests of new segmenter rules
 
 
@@ -0,0 +1,140 @@
+"""
+Tests for `Segmentizer(spill=True)`.
+"""
+
+
+import pytest
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.segment import SpillSegment
+from gpsdio_segment.spill import SpilledMsgs
+from gpsdio_segment.spill import SpillFile
+from gpsdio_segment.spill import SpillLog
+from gpsdio_segment.synthetic import SyntheticAIS
+
+from support import mixed_transponders
+from support import read_json
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _summarize(segs):
+    return [(seg.__class__.__name__, seg.id, seg.state.msg_count, list(seg))
+                for seg in segs]
+
+
+def test_spill_log(tmpdir):
+    log = SpillLog(str(tmpdir))
+    assert list(log.messages()) == []
+    log.append({'msgid': 1})
+    log.append({'msgid': 2, 'drop': True})
+    reader = log.messages(dropped=None)
+    assert next(reader) == {'msgid': 1}
+    # Messages appended while reading are not seen by that reader
+    log.append({'msgid': 3})
+    assert list(reader) == [{'msgid': 2, 'drop': True}]
+    assert len(log) == 3 and log.n_dropped == 1
+    assert list(log.messages(dropped=True)) == [{'msgid': 2}]
+
+    msgs = SpilledMsgs(log)
+    msgs.append({'msgid': 4})
+    assert [x['msgid'] for x in msgs] == [1, 3, 4]
+    assert len(msgs) == 3
+    assert msgs[0]['msgid'] == 1 and msgs[1]['msgid'] == 3 and msgs[-1]['msgid'] == 4
+    with pytest.raises(IndexError):
+        msgs[3]
+
+
+def test_shared_spill_file(tmpdir):
+    spill_file = SpillFile(str(tmpdir))
+    logs = [SpillLog(spill_file=spill_file) for _ in range(3)]
+    for i in range(30):
+        logs[i % 3].append({'msgid': i, 'drop': i % 5 == 0})
+    reader = logs[0].messages()
+    assert next(reader) == {'msgid': 3}
+    logs[0].append({'msgid': 30})
+    assert [x['msgid'] for x in reader] == [6, 9, 12, 18, 21, 24, 27]
+    assert [x['msgid'] for x in logs[1].messages(dropped=True)] == [10, 25]
+    assert [x['msgid'] for x in logs[2].messages(dropped=None)] == list(range(2, 30, 3))
+    assert len(tmpdir.listdir()) == 0  # Unlinked while open
+
+
+def test_one_spill_file(tmpdir, monkeypatch):
+    # Many vessels sharing an ssvid each keep a segment open for the whole run
+    created = []
+    init = SpillFile.__init__
+
+    def counted(self, *args, **kwargs):
+        created.append(self)
+        init(self, *args, **kwargs)
+
+    monkeypatch.setattr(SpillFile, '__init__', counted)
+    msgs = list(SyntheticAIS(n_vessels=10, seed=2, outlier_rate=0,
+                             duplicate_rate=0).messages(10000))
+    kwargs = {'max_hours': 0.25, 'max_open_segments': 50}
+    expected = _summarize(Segmentizer([x.copy() for x in msgs], **kwargs))
+    segs = list(Segmentizer([x.copy() for x in msgs], spill=True,
+                            spill_dir=str(tmpdir), **kwargs))
+    assert _summarize(segs) == expected
+    assert sum(isinstance(x.msgs, SpilledMsgs) for x in segs) > 1
+    assert len(created) == 1
+
+
+@pytest.mark.parametrize('msgs,kwargs', [
+    (_load('tests/data/416000000.json'), {'max_hours': 1}),
+    (list(SyntheticAIS(n_vessels=3, seed=5, outlier_rate=0.02).messages(10000)),
+     {'max_hours': 0.5, 'lookback': 3})])
+def test_matches_memory(msgs, kwargs, tmpdir):
+    expected = _summarize(Segmentizer([x.copy() for x in msgs], **kwargs))
+
+    segmentizer = Segmentizer(None, spill=True, spill_dir=str(tmpdir), **kwargs)
+    segs = []
+    max_held = 0
+    for msg in msgs:
+        segs.extend(segmentizer.process_msg(msg.copy()))
+        max_held = max([max_held] + [len(x.msgs) for x in segmentizer._segments.values()])
+    segs.extend(segmentizer.close_all())
+    assert _summarize(segs) == expected
+    assert any(isinstance(x.msgs, SpilledMsgs) for x in segs)
+    assert max_held < len(msgs) / 10
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_mixed_transponders(seed, tmpdir):
+    # The transponder types of the segment include messages that are too
+    # old to be matched
+    msgs = mixed_transponders(seed)
+    expected = _summarize(Segmentizer([x.copy() for x in msgs], max_hours=4))
+    segs = list(Segmentizer([x.copy() for x in msgs], max_hours=4, spill=True,
+                            spill_dir=str(tmpdir)))
+    assert _summarize(segs) == expected
+    assert any(isinstance(x.msgs, SpilledMsgs) for x in segs)
+
+
+def test_open_segment():
+    msgs = list(SyntheticAIS(seed=1, outlier_rate=0, duplicate_rate=0,
+                             bad_speed_rate=0).messages(2000))
+    segmentizer = Segmentizer(None, spill=True, max_hours=0.5)
+    for msg in msgs:
+        assert list(segmentizer.process_msg(msg)) == [] or 'lat' not in msg
+    [seg] = segmentizer._segments.values()
+    assert isinstance(seg, SpillSegment) and seg.spilled is not None
+    positions = [x for x in msgs if 'lat' in x]
+    assert seg.msg_count == len(positions)
+    # Only the messages that are held count towards `len()`
+    assert len(seg) == len(seg.msgs) < len(positions)
+    assert [x['msgid'] for x in seg] == [x['msgid'] for x in positions]
+    assert seg.first_msg['msgid'] == positions[0]['msgid']
+
+
+def test_options():
+    with pytest.raises(ValueError):
+        Segmentizer([], spill=True, columnar=True)
+    with pytest.raises(ValueError):
+        Segmentizer([], spill=True, provisional=True)
@@ -99,3 +99,17 @@ def test_Segmentizer_state_message_count_bug(msg_generator):
     assert state.msg_count == 2
     state = seg.state
     assert state.msg_count == 2
+
+
+def test_get_all_reversed_msgs(msg_generator):
+    seg = Segment(id=1, ssvid=123456789)
+    msgs = [msg_generator.next_time_posit_msg() for _ in range(6)]
+    for msg in msgs[:3]:
+        seg.add_msg(msg)
+    seg = Segment.from_state(seg.state)
+    for msg in msgs[3:]:
+        seg.add_msg(msg)
+    msgs[4]['drop'] = True
+
+    # Only the first and last messages are carried over from the state
+    assert list(seg.get_all_reversed_msgs()) == [msgs[5], msgs[3], msgs[2], msgs[0]]
@@ -0,0 +1,94 @@
+"""
+Tests for the counters and timings of `Segmentizer(stats=True)`.
+"""
+
+
+import datetime
+
+import pytest
+import pytz
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.stats import SegmentizerStats
+from gpsdio_segment.stats import STAGES
+
+from support import read_json
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _summarize(segs):
+    return [(seg.__class__.__name__, seg.id, [msg['msgid'] for msg in seg])
+                for seg in segs]
+
+
+def test_disabled():
+    segmentizer = Segmentizer([])
+    assert segmentizer.stats is None
+    # No wrappers are installed
+    assert 'clean' not in vars(segmentizer)
+
+
+@pytest.mark.parametrize('vectorize', [False, True])
+def test_stats(vectorize):
+    msgs = _load('tests/data/416000000.json')
+    msgs.append(dict(msgs[-1]))
+    msgs.append(dict(msgs[-1], msgid=-1, lat=91))
+    expected = _summarize(Segmentizer([x.copy() for x in msgs], vectorize=vectorize))
+
+    segmentizer = Segmentizer(msgs, stats=True, vectorize=vectorize)
+    segs = list(segmentizer)
+    assert _summarize(segs) == expected
+    stats = segmentizer.stats
+    assert isinstance(stats, SegmentizerStats)
+
+    messages = stats.messages
+    assert messages['duplicate'] == 1
+    assert messages['bad'] == 1
+    assert messages['skipped'] == 0
+    counted = sum(messages.values()) - messages['discarded']
+    assert counted == len(msgs)
+    assert messages['position'] == sum(len(seg) for seg in segs if not seg.noise) + \
+                                   messages['discarded']
+    assert messages['noise'] == len([x for x in segs if x.noise]) - \
+                                messages['bad'] - messages['discarded']
+
+    assert stats.segments_opened == len([x for x in segs if not x.noise])
+    assert stats.ambiguity_closures > 0
+    assert stats.segments_expired > 0
+    assert 1 < stats.peak_open_segments <= Segmentizer.max_open_segments
+    assert stats.discrepancy_evaluations > 0
+    assert stats.bounded_candidates > 0
+    assert set(stats.seconds) == set(STAGES)
+    assert all(x > 0 for x in stats.seconds.values())
+
+    snapshot = stats.as_dict()
+    assert snapshot['messages'] == messages
+    assert snapshot['ambiguity_closures'] == stats.ambiguity_closures
+    assert 'ambiguity_closures' in repr(stats)
+
+
+def test_read_while_streaming():
+    t = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+    # Vessels far apart sharing an MMSI, each reporting in turn
+    msgs = [{'msgid': i, 'ssvid': 1, 'type': 'AIS.1', 'lat': 0,
+             'lon': 10 * (i % 4) + 0.001 * i, 'course': 90, 'speed': 1,
+             'timestamp': t + datetime.timedelta(minutes=10 * i)} for i in range(20)]
+    segmentizer = Segmentizer(None, max_open_segments=3, stats=True)
+    for msg in msgs[:3]:
+        list(segmentizer.process_msg(msg))
+    assert segmentizer.stats.messages['position'] == 3
+    assert segmentizer.stats.segments_evicted == 0
+    for msg in msgs[3:]:
+        list(segmentizer.process_msg(msg))
+    list(segmentizer.close_all())
+    assert segmentizer.stats.messages['position'] == 20
+    assert segmentizer.stats.segments_opened == 20
+    assert segmentizer.stats.segments_evicted == 17
+    assert segmentizer.stats.peak_open_segments == 3
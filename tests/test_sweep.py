@@ -0,0 +1,104 @@
+"""
+Tests for running `Segmentizer()` with many parameter sets.
+"""
+
+
+import pytest
+
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.sweep import SweepDataset
+from gpsdio_segment.sweep import grid
+from gpsdio_segment.sweep import random_search
+from gpsdio_segment.sweep import sweep
+from gpsdio_segment.synthetic import SyntheticAIS
+
+from support import read_json
+
+
+FIXTURES = ['tests/data/263576000.json',
+            'tests/data/416000000.json']
+
+
+def _load(path):
+    with open(path) as f:
+        msgs = list(read_json(f))
+    for i, msg in enumerate(msgs):
+        msg['msgid'] = i
+    return msgs
+
+
+def _expected(inputs, params):
+    n_segments = 0
+    noise = 0
+    for ssvid, msgs in inputs:
+        for seg in Segmentizer([x.copy() for x in msgs], ssvid=ssvid, **params):
+            if not seg.noise:
+                n_segments += 1
+            elif seg.__class__.__name__ == 'NoiseSegment':
+                noise += len(seg)
+    return n_segments, noise
+
+
+def test_grid():
+    assert grid(max_knots=[20, 25], lookback=[3]) == [
+        {'lookback': 3, 'max_knots': 20}, {'lookback': 3, 'max_knots': 25}]
+    assert grid() == [{}]
+
+
+def test_random_search():
+    configs = random_search(50, seed=1, max_knots=(15.0, 35.0), lookback=(2, 6),
+                            max_hours=[4, 8])
+    assert configs == random_search(50, seed=1, max_knots=(15.0, 35.0), lookback=(2, 6),
+                                    max_hours=[4, 8])
+    assert all(15 <= x['max_knots'] <= 35 for x in configs)
+    assert {x['lookback'] for x in configs} == {2, 3, 4, 5, 6}
+    assert {x['max_hours'] for x in configs} == {4, 8}
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_sweep(max_workers):
+    inputs = [(int(path[-14:-5]), _load(path)) for path in FIXTURES]
+    dataset = SweepDataset(inputs)
+    assert len(dataset) == sum(len(msgs) for (_, msgs) in inputs)
+    configs = grid(max_hours=[2, 8], ambiguity_factor=[2.0, 10.0])
+    results = list(sweep(dataset, configs, max_workers=max_workers))
+
+    assert [x['params'] for x in results] == configs
+    for result in results:
+        n_segments, noise = _expected(inputs, result['params'])
+        assert result['n_segments'] == n_segments
+        assert result['messages']['noise'] == noise
+        assert sum(result['messages'].values()) == len(dataset)
+        assert result['msgs_per_second'] > 0
+        lengths = result['segment_lengths']
+        assert 1 <= lengths['min'] <= lengths['median'] <= lengths['p90'] <= lengths['max']
+        assert 0 <= result['noise_ratio'] < 1
+        assert 0 < result['discard_ratio'] < 1
+    assert len({x['n_segments'] for x in results}) > 1
+
+    # The dataset is left untouched
+    assert 'shipnames' not in inputs[0][1][0]
+
+
+def test_from_stream():
+    msgs = _load(FIXTURES[0])
+    [result] = sweep(SweepDataset.from_stream(msgs), [{}], max_workers=1)
+    assert result['n_segments'] == _expected([(None, msgs)], {})[0]
+
+
+def test_type_27_noise():
+    msgs = list(SyntheticAIS(n_vessels=5, seed=1, type_27_fraction=0.5).messages(5000))
+    [result] = sweep(SweepDataset.from_stream(msgs), [{}], max_workers=1)
+    segmentizer = Segmentizer([x.copy() for x in msgs], stats=True)
+    list(segmentizer)
+    expected = segmentizer.stats.messages
+    assert result['noise_ratio'] > 0
+    assert result['messages']['noise'] == expected['noise']
+    assert result['messages']['bad'] == expected['bad']
+
+
+@pytest.mark.parametrize('name', ['max_knot', 'process', 'ssvid'])
+def test_unknown_parameter(name):
+    dataset = SweepDataset([])
+    with pytest.raises(ValueError):
+        list(sweep(dataset, [{name: 20}], max_workers=1))
@@ -0,0 +1,70 @@
+"""
+Tests for the synthetic AIS workload generator.
+"""
+
+
+from collections import Counter
+import itertools as it
+
+import pytest
+
+from gpsdio_segment.core import REPORTED_SPEED_EXCLUSION_RANGES
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.synthetic import SyntheticAIS
+
+
+def test_deterministic():
+    workload = SyntheticAIS(n_vessels=3, seed=1)
+    msgs = list(workload.messages(2000))
+    assert len(msgs) == 2000
+    assert msgs == list(workload.messages(2000))
+    assert msgs == list(it.islice(SyntheticAIS(n_vessels=3, seed=1), 2000))
+    assert msgs != list(SyntheticAIS(n_vessels=3, seed=2).messages(2000))
+
+
+def test_stream():
+    msgs = list(SyntheticAIS(n_vessels=10, seed=3, duplicate_rate=0.05,
+                             bad_speed_rate=0.01).messages(20000))
+    timestamps = [x['timestamp'] for x in msgs]
+    assert timestamps == sorted(timestamps)
+    assert {x['ssvid'] for x in msgs} == {123456789}
+
+    types = Counter(x['type'] for x in msgs)
+    assert set(types) == {'AIS.1', 'AIS.5', 'AIS.18', 'AIS.24', 'AIS.27'}
+    positions = [x for x in msgs if 'lat' in x]
+    class_a = [x for x in positions if x['type'] == 'AIS.1']
+    gaps = [(b['timestamp'] - a['timestamp']).total_seconds() for (a, b)
+                in zip(class_a, class_a[1:])]
+    assert min(gaps) < 10
+
+    msgids = Counter(x['msgid'] for x in msgs)
+    assert 0 < sum(1 for n in msgids.values() if n > 1) < 0.05 * len(msgs)
+    bad = [x for x in positions if any(l < x['speed'] < h for (l, h)
+                                       in REPORTED_SPEED_EXCLUSION_RANGES)]
+    assert 0 < len(bad) < 0.02 * len(positions)
+    for msg in msgs:
+        if msg['type'] == 'AIS.27':
+            assert msg['speed'] == int(msg['speed'])
+            assert round(msg['lat'] * 600, 6) == int(round(msg['lat'] * 600))
+        elif msg['type'] in ('AIS.5', 'AIS.24'):
+            assert msg['shipname'] and msg['callsign']
+
+
+@pytest.mark.parametrize('n_vessels', [1, 4])
+def test_segments_vessels(n_vessels):
+    msgs = SyntheticAIS(n_vessels=n_vessels, seed=0, outlier_rate=0,
+                        moored_fraction=0).messages(4000)
+    segs = [seg for seg in Segmentizer(msgs) if not seg.noise]
+    assert len(segs) == n_vessels
+    assert all(len(seg) > 100 for seg in segs)
+
+
+def test_lazy():
+    # Without `n_msgs` the stream never ends
+    msgs = SyntheticAIS(n_vessels=50).messages()
+    assert len(list(it.islice(msgs, 1000))) == 1000
+
+
+def test_unexpected_kwargs():
+    with pytest.raises(TypeError):
+        SyntheticAIS(noise=1)
@@ -0,0 +1,150 @@
+"""
+Tests for the vectorized matching path.
+"""
+
+
+from datetime import datetime
+from datetime import timedelta
+import random
+
+import numpy as np
+import pytest
+
+from gpsdio_segment import core
+from gpsdio_segment.core import POSITION_MESSAGE
+from gpsdio_segment.core import Segmentizer
+from gpsdio_segment.segment import Segment
+
+from support import read_json
+from support import utcify
+
+
+def _random_msg(rnd, timestamp):
+    return {'ssvid': 1, 'type': 'AIS.1', 'timestamp': timestamp,
+            'lat': rnd.uniform(-80, 80), 'lon': rnd.uniform(-180, 180),
+            'course': rnd.choice([rnd.uniform(0, 359.9), 360.0]), 
+            'speed': rnd.choice([0.1, rnd.uniform(0, 30)])}
+
+
+def _segment_ids(segments):
+    return [(seg.__class__.__name__, seg.id, [msg['msgid'] for msg in seg]) 
+                for seg in segments]
+
+
+def _assert_same_matches(actual, expected):
+    for k in ['seg_id', 'hours', 'msgs_to_drop']:
+        assert [x[k] for x in actual] == [x[k] for x in expected]
+    assert [x['metric'] is None for x in actual] == [x['metric'] is None for x in expected]
+    assert ([x['metric'] for x in actual] ==
+            pytest.approx([x['metric'] for x in expected], rel=1e-12, abs=0))
+
+
+@pytest.mark.parametrize('path', ['tests/data/338013000.json',
+                                  'tests/data/416000000.json'])
+@pytest.mark.parametrize('min_vectorized', [0, core.MIN_VECTORIZED_CANDIDATES])
+def test_vectorized_same_segments(monkeypatch, path, min_vectorized):
+    monkeypatch.setattr(core, 'MIN_VECTORIZED_CANDIDATES', min_vectorized)
+    # Every match must be the same as the scalar one, with metrics within
+    # the documented rounding
+    vectorized = Segmentizer._segment_matches_vectorized
+    n_checked = []
+
+    def checked(self, segments, msg):
+        actual = vectorized(self, segments, msg)
+        expected = [self._segment_match(seg, msg) for seg in segments]
+        _assert_same_matches(actual, expected)
+        n_checked.append(sum(x['metric'] is not None for x in actual))
+        return actual
+
+    monkeypatch.setattr(Segmentizer, '_segment_matches_vectorized', checked)
+    with open(path) as f:
+        msgs = list(read_json(f))
+    expected = _segment_ids(Segmentizer([x.copy() for x in msgs]))
+    actual = _segment_ids(Segmentizer([x.copy() for x in msgs], vectorize=True))
+    assert actual == expected
+    assert sum(n_checked) > 100
+
+
+def test_compute_kinematic_discrepancies_matches_scalar():
+    rnd = random.Random(43)
+    segmentizer = Segmentizer([])
+    msg2 = _random_msg(rnd, None)
+    msg2['course'] = 10.0
+    k2 = segmentizer.msg_kinematics(msg2)
+    k1s = []
+    for i in range(200):
+        msg = _random_msg(rnd, None)
+        if msg['course'] > 359.95:
+            msg['speed'] = 0.1
+        k1s.append(segmentizer.msg_kinematics(msg))
+    hours = [rnd.uniform(0, 24) for _ in k1s]
+    expected = [segmentizer.compute_kinematic_discrepancy(k1, k2, h) 
+                    for (k1, h) in zip(k1s, hours)]
+    actual = segmentizer.compute_kinematic_discrepancies(k1s, k2, np.array(hours))
+    assert np.allclose(actual, expected, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('min_vectorized', [0, core.MIN_VECTORIZED_CANDIDATES])
+def test_vectorized_same_matches(monkeypatch, min_vectorized):
+    monkeypatch.setattr(core, 'MIN_VECTORIZED_CANDIDATES', min_vectorized)
+    # Several vessels sharing an MMSI so that many segments are open
+    rnd = random.Random(7)
+    t0 = datetime(2017, 1, 1)
+    segmentizer = Segmentizer([], vectorize=True)
+    segs = []
+    for i in range(10):
+        seg = Segment(i, 1)
+        for j in range(rnd.randint(1, 8)):
+            msg = _random_msg(rnd, t0 + timedelta(minutes=10 * j + i))
+            msg['lat'] = 0.01 * (i + j)
+            msg['lon'] = 0.01 * i
+            msg['course'] = 0
+            msg['metric'] = rnd.random()
+            msg['drop'] = (rnd.random() < 0.2)
+            seg.add_msg(msg)
+        segs.append(seg)
+    msg = {'ssvid': 1, 'type': 'AIS.18', 'timestamp': t0 + timedelta(hours=2),
+           'lat': 0.05, 'lon': 0.05, 'course': 0, 'speed': 0.6}
+
+    expected = [segmentizer._segment_match(seg, msg) for seg in segs]
+    actual = segmentizer._segment_matches_vectorized(segs, msg)
+    _assert_same_matches(actual, expected)
+    assert any(x['metric'] is not None for x in expected)
+
+
+def test_classify_batch_matches_scalar():
+    rnd = random.Random(3)
+    segmentizer = Segmentizer([])
+    nan = float('nan')
+    msgs = []
+    for i in range(2000):
+        msg = {'lat': rnd.choice([rnd.uniform(-95, 95), 0.5 / 60000, None, nan]),
+               'lon': rnd.choice([rnd.uniform(-185, 185), 2.5 / 60000, None, nan]),
+               'course': rnd.choice([rnd.uniform(0, 360), 359.95, 360.0, 
+                                     rnd.randint(0, 3600) / 10, None, nan]),
+               'speed': rnd.choice([rnd.uniform(0, 110), 0.3, 51.2, 63.0, 102.3, 
+                                    rnd.randint(0, 1000) / 10, None, nan]),
+               'heading': rnd.choice([rnd.randint(0, 511), 2.5, None, nan])}
+        if i % 5 == 0:
+            msg = {k: (None if (rnd.random() < 0.5) else nan) for k in msg}
+        msgs.append(msg)
+    msg_types, locs = segmentizer._classify_batch(msgs)
+    for msg, msg_type, loc in zip(msgs, msg_types, locs):
+        x, y, course, speed, heading = segmentizer.extract_location(msg)
+        assert msg_type is segmentizer._message_type(x, y, course, speed)
+        if msg_type is POSITION_MESSAGE:
+            assert loc == segmentizer.normalize_location(x, y, course, speed, heading)
+        else:
+            assert loc is None
+    assert len(set(msg_types)) == 3
+
+
+def test_vectorized_process_in_batches(monkeypatch):
+    monkeypatch.setattr(core, 'MIN_VECTORIZED_CANDIDATES', 0)
+    with open('tests/data/416000000.json') as f:
+        msgs = list(read_json(f))
+    expected = _segment_ids(Segmentizer([x.copy() for x in msgs]))
+    for batch_size in [1, 7, 10000]:
+        actual = _segment_ids(Segmentizer([x.copy() for x in msgs], vectorize=True,
+                                          batch_size=batch_size))
+        assert actual == expected